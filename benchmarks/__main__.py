@@ -0,0 +1,120 @@
+"""
+运行全部离线基准测试，或对比两次运行的结果
+
+用法:
+    python -m benchmarks run [--quick] [--only reviewer,api] [--output results.jsonl]
+    python -m benchmarks compare base.jsonl head.jsonl [--threshold 0.1]
+"""
+import argparse
+import json
+import subprocess
+import sys
+from typing import Any, Dict, Iterator, List, Tuple
+
+SUITE: Dict[str, Tuple[List[str], List[str]]] = {
+    # 名称: (模块参数, --quick 时的模块参数)
+    "reviewer": (
+        ["benchmarks.bench_review_queries", "--forums", "3", "--loops", "10"],
+        ["benchmarks.bench_review_queries", "--loops", "3"],
+    ),
+    "reviewer-latency": (
+        ["benchmarks.bench_review_queries", "--forums", "3", "--loops", "5",
+         "--latency", "0.02", "--error-rate", "0.02"],
+        ["benchmarks.bench_review_queries", "--loops", "2", "--latency", "0.01"],
+    ),
+    "api": (
+        ["benchmarks.bench_api", "--duration", "10"],
+        ["benchmarks.bench_api", "--duration", "2"],
+    ),
+    "api-cached": (
+        ["benchmarks.bench_api", "--duration", "10", "--method", "get_posts", "--cache-ttl", "5"],
+        ["benchmarks.bench_api", "--duration", "2", "--method", "get_posts", "--cache-ttl", "5"],
+    ),
+    "fanout": (
+        ["benchmarks.bench_fanout", "--ws", "20", "--http", "4", "--messages", "5000"],
+        ["benchmarks.bench_fanout", "--messages", "500"],
+    ),
+    "encoding": (
+        ["benchmarks.bench_encoding"],
+        ["benchmarks.bench_encoding", "--messages", "500"],
+    ),
+    "wire": (
+        ["benchmarks.bench_wire"],
+        ["benchmarks.bench_wire", "--messages", "500"],
+    ),
+    "startup": (
+        ["benchmarks.bench_startup", "--runs", "5"],
+        ["benchmarks.bench_startup", "--runs", "2"],
+    ),
+}
+
+
+def run_suite(args):
+    names = args.only.split(",") if args.only else list(SUITE)
+    for name in names:
+        full, quick = SUITE[name]
+        command = [sys.executable, "-m", *(quick if args.quick else full), "--output", args.output]
+        print(f"# {name}", file=sys.stderr)
+        subprocess.run(command, check=True)
+
+
+def flatten(value: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def load(path: str) -> Dict[Tuple[str, str], Dict[str, float]]:
+    """按基准测试名与参数索引结果，同一组合出现多次时取最后一次"""
+    records = {}
+    with open(path, encoding="utf-8") as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            key = (record["benchmark"], json.dumps(record["params"], sort_keys=True))
+            records[key] = dict(flatten(record["results"]))
+    return records
+
+
+def compare(args):
+    base = load(args.base)
+    head = load(args.head)
+    for key in sorted(base.keys() & head.keys()):
+        print(f"{key[0]} {key[1]}")
+        for metric, old in base[key].items():
+            new = head[key].get(metric)
+            if new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            flag = " *" if abs(change) >= args.threshold else ""
+            print(f"    {metric:<40} {old:>14.4f} {new:>14.4f} {change:>+8.1%}{flag}")
+    for key in sorted(base.keys() ^ head.keys()):
+        print(f"{key[0]} {key[1]}: only in {'base' if key in base else 'head'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--quick", action="store_true")
+    run_parser.add_argument("--only")
+    run_parser.add_argument("--output", default="bench_results.jsonl")
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("head")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run_suite(args)
+    else:
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+测量运行中的服务处理 HTTP 与 WebSocket 调用的速率，服务在子进程中使用模拟客户端运行
+
+用法: python -m benchmarks.bench_api [--method get_threads] [--duration 5] [--concurrency 32]
+    [--connections 4] [--inflight 8] [--latency 0] [--error-rate 0] [--cache-ttl 0] [--account-rate 1000000]
+    [--output results.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+from aiohttp import ClientSession, WSMsgType
+
+from benchmarks.harness import emit, summarize
+
+
+def serve(args):
+    from benchmarks.fake_tieba import FakeClient, FakeForum
+    from benchmarks.harness import make_app
+
+    client = FakeClient(
+        FakeForum("forum0", 1, args.threads, args.posts),
+        latency=args.latency,
+        error_rate=args.error_rate,
+    )
+    # 默认不限制账号的请求速率，以测量服务本身的吞吐量
+    config = {
+        "account_rate": args.account_rate,
+        "default_account_rate": args.account_rate,
+        "account_burst": max(int(args.account_rate), 1),
+    }
+    if args.cache_ttl:
+        config["api_cache_ttl"] = {args.method: args.cache_ttl}
+    app = make_app(client, **config)
+    app.run(
+        host="127.0.0.1",
+        port=args.port,
+        single_process=True,
+        access_log=False,
+        motd=False,
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        writer.close()
+        return None
+    raise TimeoutError("server did not start")
+
+
+async def call_args(session: ClientSession, base: str, method: str) -> List[Any]:
+    if method != "get_posts":
+        return ["forum0"]
+    async with session.post(f"{base}/aiotieba/get_threads", json={"args": ["forum0"]}) as resp:
+        data = await resp.json()
+    return [data["data"]["objs"][0]["tid"]]
+
+
+async def bench_http(base: str, method: str, args: List[Any], duration: float, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async with ClientSession() as session:
+        async def worker():
+            nonlocal errors
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                async with session.post(f"{base}/aiotieba/{method}", json={"args": args}) as resp:
+                    await resp.read()
+                    if resp.status != 200:
+                        errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+        **summarize(latencies),
+    }
+
+
+async def bench_ws(base: str, method: str, args: List[Any], duration: float, connections: int, inflight: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.monotonic() + duration
+
+    async with ClientSession() as session:
+        async def connection():
+            nonlocal errors
+            sent: Dict[int, float] = {}
+            echo = 0
+            async with session.ws_connect(f"{base.replace('http', 'ws', 1)}/ws") as ws:
+                async def send():
+                    nonlocal echo
+                    echo += 1
+                    sent[echo] = time.perf_counter()
+                    await ws.send_str(json.dumps({"action": f"aiotieba.{method}", "args": args, "echo": echo}))
+
+                for _ in range(inflight):
+                    await send()
+                async for msg in ws:
+                    if msg.type != WSMsgType.TEXT:
+                        break
+                    data = json.loads(msg.data)
+                    if "echo" not in data:
+                        # 推送消息没有 echo
+                        continue
+                    latencies.append(time.perf_counter() - sent.pop(data["echo"]))
+                    if data.get("status") != "ok":
+                        errors += 1
+                    if time.monotonic() < deadline:
+                        await send()
+                    elif not sent:
+                        break
+
+        start = time.perf_counter()
+        await asyncio.gather(*[connection() for _ in range(connections)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "errors": errors,
+        **summarize(latencies),
+    }
+
+
+async def run_client(args, port: int) -> Dict[str, Any]:
+    base = f"http://127.0.0.1:{port}"
+    await wait_ready(port)
+    async with ClientSession() as session:
+        call = await call_args(session, base, args.method)
+    return {
+        "http": await bench_http(base, args.method, call, args.duration, args.concurrency),
+        "ws": await bench_ws(base, args.method, call, args.duration, args.connections, args.inflight),
+    }
+
+
+def run(args) -> Dict[str, Any]:
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.bench_api", "--serve", "--port", str(port)]
+    for key in ("method", "threads", "posts", "latency", "error_rate", "cache_ttl", "account_rate"):
+        command += [f"--{key.replace('_', '-')}", str(getattr(args, key))]
+    env = {**os.environ, "BC_API_TYPE": "http,ws"}
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        return asyncio.run(run_client(args, port))
+    finally:
+        server.terminate()
+        server.wait(10)
+
+
+def parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--method", default="get_threads", choices=["get_threads", "get_posts"])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--inflight", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--cache-ttl", type=float, default=0)
+    parser.add_argument("--account-rate", type=float, default=1_000_000)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--output")
+    return parser
+
+
+def main():
+    args = parser().parse_args()
+    if args.serve:
+        serve(args)
+        return None
+    params = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("serve", "port", "output")
+    }
+    emit("api", params, run(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
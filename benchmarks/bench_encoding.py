@@ -0,0 +1,82 @@
+"""
+比较推送消息的编码速度，单位为每秒消息数
+
+用法: python -m benchmarks.bench_encoding [--messages 2000] [--subscribers 10] [--output results.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import serializer
+from benchmarks.fake_tieba import FakeClient, FakeForum
+from benchmarks.harness import emit
+from reviewer import PushMessage
+
+
+def legacy_encode(post, subscribers: int):
+    # 旧流程: model_dump 后 json.dumps，每个 HTTP 回调再由 aiohttp 编码一次
+    result = json.dumps(
+        PushMessage(push_type="message", msg_type="post", data=post).model_dump(
+            exclude_none=True
+        )
+    )
+    for _ in range(subscribers):
+        json.dumps(result).encode()
+
+
+def encode(post, subscribers: int):
+    payload = PushMessage(push_type="message", msg_type="post", data=post).encode()
+    for _ in range(subscribers):
+        payload.data
+
+
+def measure(func, posts, subscribers: int, messages: int) -> float:
+    start = time.perf_counter()
+    for i in range(messages):
+        func(posts[i % len(posts)], subscribers)
+    return messages / (time.perf_counter() - start)
+
+
+async def load_posts():
+    forum = FakeForum("bench", 1, thread_num=1, post_num=30, comment_num=10)
+    client = FakeClient(forum)
+    await client.get_threads(forum.fname)
+    tid = next(iter(forum.threads))
+    return (await client.get_posts(tid, with_comments=True, comment_rn=10)).objs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--subscribers", type=int, default=10)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    posts = asyncio.run(load_posts())
+    results = {
+        "legacy": measure(legacy_encode, posts, args.subscribers, args.messages),
+    }
+    for backend in ("json", "orjson"):
+        try:
+            serializer.set_backend(backend)
+        except RuntimeError:
+            continue
+        results[backend] = measure(encode, posts, args.subscribers, args.messages)
+    serializer.set_backend()
+
+    emit(
+        "encoding",
+        {"messages": args.messages, "subscribers": args.subscribers},
+        {
+            name: {
+                "messages_per_second": round(rate, 1),
+                "speedup": round(rate / results["legacy"], 2),
+            }
+            for name, rate in results.items()
+        },
+        args.output,
+    )
+
+if __name__ == "__main__":
+    main()
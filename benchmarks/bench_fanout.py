@@ -0,0 +1,146 @@
+"""
+测量推送消息分发到多个本地 WebSocket 与 HTTP 回调接收端的速率
+
+用法: python -m benchmarks.bench_fanout [--ws 10] [--http 2] [--messages 2000] [--burst 100]
+    [--batch] [--queue-size 1000] [--output results.jsonl]
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict
+
+from aiohttp import ClientSession, WSMsgType, web
+
+from benchmarks.bench_encoding import load_posts
+from benchmarks.harness import emit, peak_rss_mib
+from custom_type import Config
+from delivery import Delivery
+from metrics import PUSH_DELIVERY_SECONDS
+from reviewer import PushMessage
+
+
+class Sinks:
+    """本地接收端，统计收到的消息数"""
+
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.received = 0
+
+    def count(self, number: int = 1):
+        self.received += number
+
+    async def websocket(self, request: web.Request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            if msg.type == WSMsgType.TEXT:
+                self.count()
+        return ws
+
+    async def callback(self, request: web.Request):
+        data = json.loads(await request.read())
+        self.count(len(data) if isinstance(data, list) else 1)
+        return web.Response()
+
+
+async def run(
+    ws: int = 10,
+    http: int = 2,
+    messages: int = 2000,
+    burst: int = 100,
+    batch: bool = False,
+    queue_size: int = 1000,
+    timeout: float = 60,
+) -> Dict[str, Any]:
+    sinks = Sinks(messages * (ws + http))
+    app = web.Application()
+    app.router.add_get("/ws", sinks.websocket)
+    app.router.add_post("/callback", sinks.callback)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    posts = await load_posts()
+    payloads = [
+        PushMessage(push_type="message", msg_type="post", data=post).encode()
+        for post in posts
+    ]
+    delivery = Delivery(Config(
+        delivery_queue_size=queue_size,
+        http_callback_batch=batch,
+        delivery_max_retries=0,
+    ))
+    PUSH_DELIVERY_SECONDS.values.clear()
+
+    async with ClientSession() as session:
+        connections = [
+            await session.ws_connect(f"http://127.0.0.1:{port}/ws") for _ in range(ws)
+        ]
+        for i, connection in enumerate(connections):
+            delivery.add_websocket(connection, f"ws-sink-{i}")
+        for _ in range(http):
+            delivery.add_http_callback(f"http://127.0.0.1:{port}/callback", session)
+
+        start = time.perf_counter()
+        for i in range(messages):
+            delivery.publish(payloads[i % len(payloads)])
+            # 模拟 Reviewer 一次发布一批消息
+            if (i + 1) % burst == 0:
+                await asyncio.sleep(0)
+        published = time.perf_counter() - start
+
+        # 被丢弃的消息不会到达，等待所有队列清空且接收端收到其余消息
+        timed_out = True
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = delivery.status()
+            lost = sum(subscriber["dropped"] + subscriber["failed"] for subscriber in status)
+            if sinks.received + lost >= sinks.expected:
+                timed_out = False
+                break
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        status = delivery.status()
+        await delivery.close(0)
+        for connection in connections:
+            await connection.close()
+    await runner.cleanup()
+
+    latency = {}
+    for (kind,), counts in PUSH_DELIVERY_SECONDS.values.items():
+        latency[kind] = round(counts[-2] / counts[-1] * 1000, 3) if counts[-1] else 0
+    return {
+        "deliveries": sinks.received,
+        "expected": sinks.expected,
+        "timed_out": timed_out,
+        "publish_seconds": round(published, 4),
+        "seconds": round(elapsed, 4),
+        "deliveries_per_second": round(sinks.received / elapsed, 1),
+        "messages_per_second": round(messages / elapsed, 1),
+        "dropped": sum(subscriber["dropped"] for subscriber in status),
+        "failed": sum(subscriber["failed"] for subscriber in status),
+        "mean_latency_ms": latency,
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ws", type=int, default=10)
+    parser.add_argument("--http", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--burst", type=int, default=100)
+    parser.add_argument("--batch", action="store_true")
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    params = vars(args).copy()
+    output = params.pop("output")
+    emit("fanout", params, asyncio.run(run(**params)), output)
+
+
+if __name__ == "__main__":
+    main()
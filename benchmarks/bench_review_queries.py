@@ -0,0 +1,147 @@
+"""
+测量 Reviewer 的吞吐量、每轮检查产生的数据库查询次数、内存占用及流水线各阶段的峰值队列长度
+
+用法: python -m benchmarks.bench_review_queries [--forums 1] [--threads 50] [--posts 30] [--loops 5]
+    [--bump-ratio 0.2] [--latency 0] [--error-rate 0] [--db sqlite://:memory:] [--write-behind] [--output results.jsonl]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from types import SimpleNamespace
+
+from tortoise import Tortoise
+
+from benchmarks.fake_tieba import FakeClient, FakeForum
+from benchmarks.harness import emit, peak_rss_mib
+from custom_type import Config
+from db import WriteBuffer, db_config
+from reviewer import Reviewer
+
+
+class QueryCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def fake_app():
+    ctx = SimpleNamespace(ws_connections=[], config=Config(http_callback_url=[]))
+    return SimpleNamespace(ctx=ctx, add_task=lambda coro, **kwargs: coro.close())
+
+
+async def run(
+    forums: int = 1,
+    threads: int = 50,
+    posts: int = 30,
+    comments: int = 3,
+    loops: int = 5,
+    bump_ratio: float = 0.2,
+    latency: float = 0,
+    error_rate: float = 0,
+    db: str = "sqlite://:memory:",
+    write_behind: bool = False,
+    verbose: bool = False,
+) -> dict:
+    await Tortoise.init(config=db_config(db, ["models"]))
+    await Tortoise.generate_schemas()
+
+    counter = QueryCounter()
+    db_logger = logging.getLogger("tortoise.db_client")
+    db_logger.setLevel(logging.DEBUG)
+    db_logger.propagate = False
+    db_logger.addHandler(counter)
+
+    fake_forums = [
+        FakeForum(f"forum{i}", i + 1, threads, posts, comments, bump_ratio, seed=i)
+        for i in range(forums)
+    ]
+    client = FakeClient(*fake_forums, latency=latency, error_rate=error_rate)
+    writer = WriteBuffer() if write_behind else None
+    reviewer = Reviewer(fake_app(), [forum.fname for forum in fake_forums], writer=writer)
+    reviewer.client = client
+    pushed = []
+    reviewer.send_to = lambda context, ctx_type="unknown": pushed.append(ctx_type)
+
+    await reviewer.warm_cache()
+
+    results = []
+    for loop in range(loops):
+        counter.count = 0
+        pushed.clear()
+        items = client.items
+        start = time.perf_counter()
+        await asyncio.gather(*[reviewer.review(forum.fname) for forum in fake_forums])
+        if writer:
+            await writer.flush()
+        seconds = time.perf_counter() - start
+        result = {
+            "loop": loop,
+            "queries": counter.count,
+            "pushed": len(pushed),
+            "items": client.items - items,
+            "seconds": round(seconds, 4),
+            "thread_pages": {
+                fname: schedule.pages for fname, schedule in reviewer.schedules.items()
+            },
+        }
+        if verbose:
+            result.update(reviewer.status())
+            print(result)
+        results.append(result)
+        for forum in fake_forums:
+            forum.tick()
+
+    await reviewer.pipeline.close()
+    await Tortoise.close_connections()
+
+    # 首轮为冷启动，单独统计
+    steady = results[1:] or results
+    seconds = sum(result["seconds"] for result in steady)
+    return {
+        "cold_seconds": results[0]["seconds"],
+        "cold_queries": results[0]["queries"],
+        "queries_per_loop": round(sum(r["queries"] for r in steady) / len(steady), 2),
+        "pushed_per_loop": round(sum(r["pushed"] for r in steady) / len(steady), 2),
+        "items_per_second": round(sum(r["items"] for r in steady) / seconds, 1) if seconds else 0,
+        "seconds_per_loop": round(seconds / len(steady), 4),
+        "upstream_calls": sum(client.calls.values()),
+        "upstream_errors": client.errors,
+        "peak_rss_mib": peak_rss_mib(),
+        "stages": {
+            name: {
+                key: status[key]
+                for key in ("peak_depth", "peak_active", "processed", "busy_seconds")
+            }
+            for name, status in reviewer.pipeline.status().items()
+        },
+        "loops": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--forums", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=30)
+    parser.add_argument("--comments", type=int, default=3)
+    parser.add_argument("--loops", type=int, default=5)
+    parser.add_argument("--bump-ratio", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--db", default="sqlite://:memory:")
+    parser.add_argument("--write-behind", action="store_true")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    params = vars(args).copy()
+    output = params.pop("output")
+    verbose = params.pop("verbose")
+    emit("reviewer", params, asyncio.run(run(**params, verbose=verbose)), output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+测量从启动进程到第一个请求返回的耗时，每次在新的解释器中运行
+
+用法: python -m benchmarks.bench_startup [--runs 5] [--cold] [--output results.jsonl]
+
+需要安装 sanic-testing；--cold 时每次运行前删除 OpenAPI 缓存
+"""
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.harness import emit
+
+
+def child():
+    import asyncio
+
+    start = time.perf_counter()
+    from sanic import Sanic
+
+    from benchmarks.fake_tieba import FakeClient, FakeForum
+    from benchmarks.harness import make_app
+    import route  # noqa: F401
+
+    imported = time.perf_counter()
+    Sanic.test_mode = True
+    app = make_app(FakeClient(FakeForum("forum0", 1)))
+
+    async def first_request():
+        _, response = await app.asgi_client.post(
+            "/aiotieba/get_threads", json={"args": ["forum0"]}
+        )
+        assert response.status == 200, response.body
+        first = time.perf_counter()
+        _, response = await app.asgi_client.get("/docs/openapi.json")
+        assert response.status == 200, response.body
+        return first, time.perf_counter()
+
+    first, spec = asyncio.run(first_request())
+    print(json.dumps({
+        "import": round(imported - start, 4),
+        "first_request": round(first - start, 4),
+        "openapi": round(spec - first, 4),
+        "routes": len(app.router.routes),
+    }))
+
+
+def run(runs: int = 5, cold: bool = False) -> dict:
+    results = []
+    for _ in range(runs):
+        if cold:
+            shutil.rmtree(".cache", ignore_errors=True)
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_startup", "--child"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        result["process"] = round(time.perf_counter() - started, 4)
+        results.append(result)
+
+    return {
+        key: round(statistics.median(result[key] for result in results), 4)
+        for key in results[0]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true")
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    params = {"runs": args.runs, "cold": args.cold}
+    emit("startup", params, run(**params), args.output)
+
+
+if __name__ == "__main__":
+    if "--child" in sys.argv:
+        child()
+    else:
+        main()
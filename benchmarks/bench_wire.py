@@ -0,0 +1,60 @@
+"""
+比较 JSON 与 MessagePack 格式的推送消息大小及编码、解码速度
+
+用法: python -m benchmarks.bench_wire [--messages 2000] [--output results.jsonl]
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Dict, List
+
+import serializer
+from benchmarks.bench_encoding import load_posts
+from benchmarks.harness import emit
+from reviewer import PushMessage
+
+
+def measure(func: Callable[[Any], Any], items: List[Any], messages: int) -> float:
+    start = time.perf_counter()
+    for i in range(messages):
+        func(items[i % len(items)])
+    return messages / (time.perf_counter() - start)
+
+
+def run(messages: int) -> Dict[str, Any]:
+    posts = asyncio.run(load_posts())
+    pushes = [PushMessage(push_type="message", msg_type="post", data=post) for post in posts]
+    texts = [push.encode().data for push in pushes]
+    results = {
+        "json": {
+            "mean_bytes": round(sum(map(len, texts)) / len(texts), 1),
+            "encode_per_second": round(measure(lambda push: push.encode().data, pushes, messages), 1),
+            "decode_per_second": round(measure(serializer.loads, texts, messages), 1),
+        }
+    }
+    if serializer.msgpack is None:
+        return results
+
+    packed = [serializer.packb(serializer.loads(text)) for text in texts]
+    # 订阅者使用 MessagePack 时由已编码的 JSON 转换，与推送流程一致
+    results["msgpack"] = {
+        "mean_bytes": round(sum(map(len, packed)) / len(packed), 1),
+        "encode_per_second": round(measure(lambda push: push.encode().packed, pushes, messages), 1),
+        "decode_per_second": round(measure(serializer.unpackb, packed, messages), 1),
+    }
+    results["msgpack"]["size_ratio"] = round(
+        results["msgpack"]["mean_bytes"] / results["json"]["mean_bytes"], 3
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+    emit("wire", {"messages": args.messages}, run(args.messages), args.output)
+
+
+if __name__ == "__main__":
+    main()
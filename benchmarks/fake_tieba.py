@@ -0,0 +1,304 @@
+import asyncio
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from aiotieba import PostSortType
+from aiotieba.api.get_comments._classdef import Comment, Comments, Page_c
+from aiotieba.api.get_posts._classdef import (
+    Comment_p,
+    Contents_p,
+    Contents_pc,
+    FragText_p,
+    Page_p,
+    Post,
+    Posts,
+    UserInfo_p,
+)
+from aiotieba.api.get_threads._classdef import Forum_t, Page_t, Thread, Threads
+from aiotieba.exception import IntResponse, TiebaServerError
+
+
+TEXT = "这是一条用于离线测试的模拟回复，内容长度接近真实楼层。" * 3
+
+
+def make_contents(text: str = TEXT, cls=Contents_p):
+    frag = FragText_p(text=text)
+    return cls(objs=[frag], texts=[frag])
+
+
+@dataclass
+class FakePost:
+    pid: int
+    floor: int
+    agree: int = 0
+    comments: List[int] = field(default_factory=list)
+
+
+@dataclass
+class FakeThread:
+    tid: int
+    last_time: int
+    posts: List[FakePost] = field(default_factory=list)
+
+
+class FakeForum:
+    """
+    一个可推进时间的模拟贴吧
+
+    Attributes:
+        - fname: 贴吧名
+        - fid: 贴吧id
+        - thread_num: 初始主题贴数量
+        - post_num: 每个主题贴的初始楼层数
+        - comment_num: 每个楼层的初始楼中楼数
+        - bump_ratio: 每次推进时被回复的主题贴比例
+        - new_threads: 每次推进时新增的主题贴数量
+        - post_rate: 每个被回复的主题贴每次推进时新增的楼层数
+        - comment_rate: 每个被回复的主题贴每次推进时新增的楼中楼数
+        - seed: 随机种子
+    """
+
+    def __init__(
+        self,
+        fname: str,
+        fid: int,
+        thread_num: int = 50,
+        post_num: int = 30,
+        comment_num: int = 3,
+        bump_ratio: float = 0.2,
+        seed: int = 0,
+        new_threads: int = 1,
+        post_rate: int = 1,
+        comment_rate: int = 1,
+    ):
+        self.fname = fname
+        self.fid = fid
+        self.bump_ratio = bump_ratio
+        self.new_threads = new_threads
+        self.post_rate = post_rate
+        self.comment_rate = comment_rate
+        self.random = random.Random(seed)
+        self.now = 1_700_000_000
+        self._next_id = fid * 10_000_000
+        # 各主题贴、楼层与楼中楼的创建时间
+        self.created: Dict[int, int] = {}
+        self.threads: Dict[int, FakeThread] = {}
+        for _ in range(thread_num):
+            thread = FakeThread(tid=self.next_id(), last_time=self.now)
+            for _ in range(post_num):
+                self.add_post(thread, comment_num)
+            self.threads[thread.tid] = thread
+
+    def next_id(self) -> int:
+        self._next_id += 1
+        self.created[self._next_id] = self.now
+        return self._next_id
+
+    def add_post(self, thread: FakeThread, comment_num: int = 0):
+        post = FakePost(pid=self.next_id(), floor=len(thread.posts) + 1)
+        post.comments.extend(self.next_id() for _ in range(comment_num))
+        thread.posts.append(post)
+        thread.last_time = self.now
+
+    def tick(self, seconds: int = 30):
+        """推进时间，随机回复一部分主题贴并新增主题贴"""
+        self.now += seconds
+        threads = list(self.threads.values())
+        bumped = self.random.sample(threads, int(len(threads) * self.bump_ratio))
+        for thread in bumped:
+            for _ in range(self.post_rate):
+                self.add_post(thread)
+            for _ in range(self.comment_rate):
+                target = self.random.choice(thread.posts)
+                target.comments.append(self.next_id())
+            thread.last_time = self.now
+        for _ in range(self.new_threads):
+            thread = FakeThread(tid=self.next_id(), last_time=self.now)
+            self.add_post(thread)
+            self.threads[thread.tid] = thread
+
+    def sorted_threads(self) -> List[FakeThread]:
+        return sorted(self.threads.values(), key=lambda t: t.last_time, reverse=True)
+
+
+class FakeClient:
+    """
+    替代 aiotieba.Client 的离线客户端，只实现 Reviewer 用到的接口
+
+    Attributes:
+        - forums: 模拟的贴吧
+        - latency: 每次调用的平均延迟，单位为秒，实际延迟在其 0.5 到 1.5 倍之间
+        - error_rate: 调用返回错误的概率
+        - error_code: 注入错误的错误码，默认为贴吧的频率限制
+        - seed: 随机种子
+    """
+
+    def __init__(
+        self,
+        *forums: FakeForum,
+        latency: float = 0,
+        error_rate: float = 0,
+        error_code: int = 220034,
+        seed: int = 0,
+    ):
+        self.forums = {forum.fname: forum for forum in forums}
+        self.threads: Dict[int, FakeForum] = {}
+        self.calls: Dict[str, int] = {}
+        self.errors = 0
+        self.items = 0
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return None
+
+    async def _call(self, name: str, result_cls: type):
+        """计数并模拟网络延迟，按概率返回带有错误的空结果"""
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.errors += 1
+            result = result_cls()
+            result.err = TiebaServerError(self.error_code, "injected error")
+            return result
+        return None
+
+    def _thread_forum(self, tid: int) -> FakeForum:
+        forum = self.threads.get(tid)
+        if forum is None:
+            forum = next(forum for forum in self.forums.values() if tid in forum.threads)
+            self.threads[tid] = forum
+        return forum
+
+    def _forum(self, fname_or_fid) -> FakeForum:
+        if isinstance(fname_or_fid, int):
+            return next(forum for forum in self.forums.values() if forum.fid == fname_or_fid)
+        return self.forums[fname_or_fid]
+
+    async def get_fid(self, fname: str) -> IntResponse:
+        await self._call("get_fid", IntResponse)
+        return IntResponse(self.forums[fname].fid)
+
+    async def get_threads(self, fname_or_fid, /, pn: int = 1, *, rn: int = 30, **kwargs) -> Threads:
+        if error := await self._call("get_threads", Threads):
+            return error
+        forum = self._forum(fname_or_fid)
+        ordered = forum.sorted_threads()
+        objs = []
+        for fake in ordered[(pn - 1) * rn: pn * rn]:
+            self.threads[fake.tid] = forum
+            objs.append(
+                Thread(
+                    fid=forum.fid,
+                    fname=forum.fname,
+                    tid=fake.tid,
+                    pid=fake.posts[0].pid,
+                    reply_num=len(fake.posts) - 1,
+                    create_time=forum.created[fake.tid],
+                    last_time=fake.last_time,
+                )
+            )
+        total_page = (len(ordered) + rn - 1) // rn
+        self.items += len(objs)
+        return Threads(
+            objs=objs,
+            page=Page_t(page_size=rn, current_page=pn, total_page=total_page, has_more=pn < total_page),
+            forum=Forum_t(fid=forum.fid, fname=forum.fname),
+        )
+
+    async def get_posts(
+        self,
+        tid: int,
+        /,
+        pn: int = 1,
+        *,
+        rn: int = 30,
+        sort: PostSortType = PostSortType.ASC,
+        with_comments: bool = False,
+        comment_rn: int = 4,
+        **kwargs,
+    ) -> Posts:
+        if error := await self._call("get_posts", Posts):
+            return error
+        forum = self._thread_forum(tid)
+        fake = forum.threads[tid]
+        total_page = max((len(fake.posts) + rn - 1) // rn, 1)
+        if pn > total_page:
+            # 越界页码在倒序时返回最新的一页
+            pn = 1 if sort == PostSortType.DESC else total_page
+        if sort == PostSortType.DESC:
+            ordered = fake.posts[::-1]
+        elif sort == PostSortType.HOT:
+            ordered = sorted(fake.posts, key=lambda p: p.agree, reverse=True)
+        else:
+            ordered = fake.posts
+        objs = []
+        for post in ordered[(pn - 1) * rn: pn * rn]:
+            comments = []
+            if with_comments:
+                comments = [
+                    Comment_p(
+                        contents=make_contents(TEXT[:20], Contents_pc),
+                        fid=forum.fid,
+                        fname=forum.fname,
+                        tid=tid,
+                        ppid=post.pid,
+                        pid=pid,
+                        floor=i + 1,
+                        create_time=forum.created[pid],
+                    )
+                    for i, pid in enumerate(post.comments[:comment_rn])
+                ]
+            objs.append(
+                Post(
+                    contents=make_contents(),
+                    user=UserInfo_p(user_id=post.pid % 1000, user_name=f"user{post.pid % 1000}"),
+                    author_id=post.pid % 1000,
+                    fid=forum.fid,
+                    fname=forum.fname,
+                    tid=tid,
+                    pid=post.pid,
+                    floor=post.floor,
+                    reply_num=len(post.comments),
+                    agree=post.agree,
+                    create_time=forum.created[post.pid],
+                    comments=comments,
+                )
+            )
+        self.items += len(objs) + sum(len(post.comments) for post in objs)
+        return Posts(
+            objs=objs,
+            page=Page_p(page_size=rn, current_page=pn, total_page=total_page, has_more=pn < total_page),
+        )
+
+    async def get_comments(self, tid: int, pid: int, /, pn: int = 1, **kwargs) -> Comments:
+        if error := await self._call("get_comments", Comments):
+            return error
+        forum = self._thread_forum(tid)
+        post = next(post for post in forum.threads[tid].posts if post.pid == pid)
+        rn = 30
+        total_page = max((len(post.comments) + rn - 1) // rn, 1)
+        objs = [
+            Comment(
+                fid=forum.fid,
+                fname=forum.fname,
+                tid=tid,
+                ppid=pid,
+                pid=cid,
+                floor=i + 1,
+                create_time=forum.created[cid],
+            )
+            for i, cid in enumerate(post.comments[(pn - 1) * rn: pn * rn], (pn - 1) * rn)
+        ]
+        self.items += len(objs)
+        return Comments(
+            objs=objs,
+            page=Page_c(page_size=rn, current_page=pn, total_page=total_page, has_more=pn < total_page),
+        )
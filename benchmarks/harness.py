@@ -0,0 +1,104 @@
+"""
+基准测试的公共工具
+
+每个基准测试输出一行 JSON 记录，包含提交、参数与结果，可通过 --output 追加到 JSONL 文件，
+再用 python -m benchmarks compare 对比两次提交的结果
+"""
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional
+
+if TYPE_CHECKING:
+    from benchmarks.fake_tieba import FakeClient
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = "unknown"
+    return {
+        "commit": commit,
+        "time": int(time.time()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def emit(benchmark: str, params: Dict[str, Any], results: Dict[str, Any], output: Optional[str] = None):
+    """
+    输出一条基准测试记录
+    Args:
+        benchmark: 基准测试名
+        params: 运行参数
+        results: 测量结果
+        output: 追加写入的 JSONL 文件，为空时只打印
+    """
+    record = {"benchmark": benchmark, **environment(), "params": params, "results": results}
+    line = json.dumps(record, ensure_ascii=False)
+    print(line)
+    if output:
+        with open(output, "a", encoding="utf-8") as fp:
+            fp.write(line + "\n")
+    return record
+
+
+def summarize(samples: Iterable[float]) -> Dict[str, float]:
+    """延迟样本的均值与分位数，单位为毫秒"""
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def percentile(p: float) -> float:
+        return samples[min(int(len(samples) * p), len(samples) - 1)] * 1000
+
+    return {
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(percentile(0.5), 3),
+        "p90_ms": round(percentile(0.9), 3),
+        "p99_ms": round(percentile(0.99), 3),
+    }
+
+
+def peak_rss_mib() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KiB 为单位
+    return round(usage / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def make_app(client: "FakeClient", name: str = "BungleCatBench", **config: Any):
+    """创建一个使用模拟客户端、不连接贴吧的应用"""
+    from cache import ResponseCache
+    from custom_type import App, Config, Context
+    from delivery import Delivery
+    from metrics import MetricsStore
+    from pool import ClientPool
+    from route import group, refresh_gauges
+    from utils import CustomErrorHandler
+
+    app = App(name, ctx=Context, error_handler=CustomErrorHandler())
+    app.blueprint(group)
+
+    @app.before_server_start
+    async def setup(_app: App):
+        _app.ctx.config = Config(**config)
+        _app.ctx.bot = client
+        _app.ctx.delivery = Delivery(_app.ctx.config)
+        _app.ctx.api_cache = ResponseCache(
+            _app.ctx.config.api_cache_ttl, _app.ctx.config.api_cache_max_bytes
+        )
+        _app.ctx.pool = ClientPool(_app.ctx.config)
+        _app.ctx.pool.add("default", client, default=True)
+        _app.ctx.metrics = MetricsStore(_app, refresh_gauges)
+
+    return app
@@ -0,0 +1,239 @@
+import asyncio
+import json as sys_json
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+MISSING: Any = object()
+
+
+class LRUCache(Generic[K, V]):
+    """
+    有容量上限的 LRU 缓存，记录命中与未命中次数
+
+    Attributes:
+        - max_size: 最多保存的条目数
+        - hits: 命中次数
+        - misses: 未命中次数
+        - evictions: 因超出容量被淘汰的条目数
+        - complete: 缓存是否包含数据源的全部条目，为真时未命中即代表不存在
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.complete = False
+        self._data: OrderedDict[K, V] = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key: K):
+        return key in self._data
+
+    def get(self, key: K, default: Any = MISSING) -> V:
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: K, value: V):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            self.complete = False
+
+    def update(self, items: Iterable[Tuple[K, V]]):
+        for key, value in items:
+            self.set(key, value)
+
+    def discard(self, keys: Iterable[K]):
+        """删除数据源中已不存在的条目，complete 保持不变"""
+        for key in keys:
+            self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self.complete = False
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "complete": self.complete,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+def _retrieve_exception(task: asyncio.Task):
+    """所有等待者都已取消时避免 "exception was never retrieved" 警告"""
+    if not task.cancelled():
+        task.exception()
+
+
+class ResponseCache:
+    """
+    aiotieba 只读接口的响应缓存，相同参数的并发调用只会向贴吧发出一次请求
+
+    Attributes:
+        - ttl: 方法名到缓存有效期的映射，单位为秒，只有其中的方法会被缓存
+        - max_bytes: 缓存响应编码后的总大小上限，超出后淘汰最久未使用的响应
+    """
+
+    READONLY_PREFIXES = ("get_", "search_")
+    READONLY_METHODS = {"tieba_uid2user_info", "hash2image"}
+
+    def __init__(self, ttl: Dict[str, float], max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = {
+            name: seconds
+            for name, seconds in ttl.items()
+            if seconds > 0 and self.is_readonly(name)
+        }
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._data: OrderedDict[str, Tuple[float, Any, int]] = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    @classmethod
+    def is_readonly(cls, name: str) -> bool:
+        return name.startswith(cls.READONLY_PREFIXES) or name in cls.READONLY_METHODS
+
+    def enabled(self, name: str) -> bool:
+        return name in self.ttl
+
+    @staticmethod
+    def make_key(name: str, args: Any, kwargs: Any, scope: Optional[str] = None) -> str:
+        return sys_json.dumps(
+            [name, scope, list(args or ()), kwargs or {}],
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+
+    def _count(self, name: str, stat: str):
+        stats = self._stats.setdefault(
+            name, {"hits": 0, "misses": 0, "coalesced": 0}
+        )
+        stats[stat] += 1
+
+    def _get(self, key: str) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return MISSING
+        expires_at, value, size = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.size -= size
+            return MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def _set(self, name: str, key: str, value: Any, size: int):
+        if size > self.max_bytes:
+            return None
+        old = self._data.pop(key, None)
+        if old:
+            self.size -= old[2]
+        self._data[key] = (time.monotonic() + self.ttl[name], value, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+
+    async def call(
+        self,
+        name: str,
+        args: Any,
+        kwargs: Any,
+        func: Callable[[], Awaitable[Any]],
+        sizeof: Callable[[Any], int],
+        scope: Optional[str] = None,
+    ) -> Any:
+        """
+        读取缓存，未命中时调用 func 并写入缓存
+        Args:
+            name: aiotieba 方法名
+            args: 位置参数
+            kwargs: 关键字参数
+            func: 实际发起请求的协程函数
+            sizeof: 计算响应大小的函数
+            scope: 缓存的作用域，例如与账号相关的接口使用账号名
+        """
+        if not self.enabled(name):
+            return await func()
+
+        key = self.make_key(name, args, kwargs, scope)
+        value = self._get(key)
+        if value is not MISSING:
+            self._count(name, "hits")
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._count(name, "coalesced")
+            return await asyncio.shield(inflight)
+
+        self._count(name, "misses")
+        # 请求在独立的任务中进行，发起者被取消时合并等待的调用者仍能得到结果
+        task = asyncio.get_running_loop().create_task(self._fill(name, key, func, sizeof))
+        task.add_done_callback(_retrieve_exception)
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fill(
+        self,
+        name: str,
+        key: str,
+        func: Callable[[], Awaitable[Any]],
+        sizeof: Callable[[Any], int],
+    ) -> Any:
+        try:
+            value = await func()
+            self._set(name, key, value, sizeof(value))
+            return value
+        finally:
+            del self._inflight[key]
+
+    def status(self) -> Dict[str, Any]:
+        methods = {}
+        for name, stats in self._stats.items():
+            total = sum(stats.values())
+            methods[name] = {
+                **stats,
+                "hit_rate": round(
+                    (stats["hits"] + stats["coalesced"]) / total, 4
+                ) if total else 0.0,
+            }
+        return {
+            "entries": len(self._data),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "methods": methods,
+        }
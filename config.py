@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from pathlib import Path
 
 import tomli_w
@@ -8,6 +9,7 @@ from dotenv import load_dotenv
 from custom_type import ApiType, Config, EnvConfig
 
 
+@lru_cache
 def load_env_config(env_prefix: str = "SANIC_"):
     load_dotenv(".env")
     API_TYPE = os.environ.get(f"{env_prefix}API_TYPE", "http,ws").split(",")
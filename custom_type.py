@@ -1,18 +1,29 @@
-import json as sys_json
+import re
 from asyncio import Task
 from enum import StrEnum, auto
 from types import SimpleNamespace
-from typing import Any, List, Literal, Optional, Set, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional, Set, Union
 
 from aiohttp import ClientSession, ClientWebSocketResponse
 from aiotieba import Client
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr, field_validator
 from sanic import Config as SanicConfig
 from sanic import Request as SanicRequest
-from sanic import Sanic, SanicException, Websocket, json
+from sanic import Sanic, SanicException, Websocket, raw
 from sanic.log import error_logger
 
 from exceptions import AioTiebaException
+from serializer import dumps, packb
+
+if TYPE_CHECKING:
+    from cache import ResponseCache
+    from db import Compactor, WriteBuffer
+    from delivery import Delivery
+    from fanout import Fanout
+    from http_client import ReverseWebsocket
+    from metrics import MetricsStore
+    from pool import ClientPool
+    from reviewer import Reviewer
 
 
 class ApiType(StrEnum):
@@ -22,12 +33,94 @@ class ApiType(StrEnum):
     HTTP_CALLBACK = "http-callback"
 
 
+class WireFormat(StrEnum):
+    JSON = auto()
+    MSGPACK = auto()
+
+
+class AccountConfig(BaseModel):
+    name: str = ""
+    bduss: str
+    stoken: str = ""
+
+
+class PushFilter(BaseModel):
+    """
+    推送消息的过滤规则，各条件之间为且，条件内各项之间为或，为空的条件不限
+
+    Attributes:
+        - fnames: 贴吧名
+        - msg_types: 消息类型
+        - author_ids: 作者id
+        - keywords: 内容包含的关键词
+        - patterns: 内容匹配的正则
+    """
+
+    fnames: List[str] = []
+    msg_types: List[Literal["thread", "post", "comment"]] = []
+    author_ids: List[int] = []
+    keywords: List[str] = []
+    patterns: List[str] = []
+
+    @field_validator("patterns")
+    @classmethod
+    def check_patterns(cls, patterns: List[str]) -> List[str]:
+        for pattern in patterns:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"invalid pattern {pattern!r}: {e}")
+        return patterns
+
+
 class Config(BaseModel):
     bduss: str = ""
     token: str = ""
     fnames: List[str] = []
     http_callback_url: Optional[List[str]] = None
     reverse_ws_url: Optional[List[str]] = None
+    accounts: List[AccountConfig] = []
+    account_rate: float = 5
+    default_account_rate: Optional[float] = None
+    account_burst: int = 10
+    account_cooldown: int = 60
+    rate_limit_codes: List[int] = [429, 220034]
+    review_cache_size: int = 100_000
+    api_cache_ttl: Dict[str, float] = {}
+    api_cache_max_bytes: int = 64 * 1024 * 1024
+    ws_max_inflight: int = 64
+    batch_max_calls: int = 200
+    batch_max_concurrency: int = 16
+    review_wait_time: int = 30
+    review_min_wait_time: int = 5
+    review_max_wait_time: int = 300
+    review_max_post_pages: int = 5
+    review_max_comment_pages: int = 10
+    review_fetch_workers: int = 8
+    review_queue_size: int = 100
+    review_diff_batch: int = 50
+    review_max_thread_pages: int = 3
+    review_forum_max_thread_pages: Dict[str, int] = {}
+    db_write_batch: int = 500
+    db_flush_ms: int = 200
+    db_retention: int = 30 * 24 * 3600
+    db_compact_interval: int = 3600
+    db_compact_batch: int = 200
+    delivery_queue_size: int = 1000
+    delivery_batch_size: int = 50
+    delivery_flush_ms: int = 200
+    delivery_max_retries: int = 5
+    delivery_spill_dir: str = ""
+    http_callback_batch: bool = False
+    push_filters: Dict[str, List[PushFilter]] = {}
+    replay_dir: str = ""
+    replay_segment_bytes: int = 4 * 1024 * 1024
+    replay_max_bytes: int = 256 * 1024 * 1024
+    replay_max_age: int = 24 * 3600
+    reverse_ws_connect_timeout: float = 10
+    reverse_ws_heartbeat: float = 30
+    reverse_ws_backoff: float = 1
+    reverse_ws_max_backoff: float = 60
 
 
 class EnvConfig(SanicConfig):
@@ -48,6 +141,15 @@ class Context:
     tasks: list[Task] = []
     ws_connections: list[Union[Websocket, ClientWebSocketResponse]] = []
     http_session: Optional[ClientSession] = None
+    reviewer: Optional["Reviewer"] = None
+    delivery: Optional["Delivery"] = None
+    api_cache: Optional["ResponseCache"] = None
+    pool: Optional["ClientPool"] = None
+    fanout: Optional["Fanout"] = None
+    reverse_ws: list["ReverseWebsocket"] = []
+    metrics: Optional["MetricsStore"] = None
+    writer: Optional["WriteBuffer"] = None
+    compactor: Optional["Compactor"] = None
 
 
 App = Sanic[EnvConfig, Context]
@@ -63,15 +165,63 @@ class Result(BaseModel):
     msg: Optional[str] = None
     description: Optional[str] = None
     data: Any = None
+    _encoded: Optional[bytes] = PrivateAttr(default=None)
+    _items: Optional[List["Result"]] = PrivateAttr(default=None)
+
+    def to_dict(self):
+        result = {
+            key: value
+            for key, value in self.__dict__.items()
+            if key != "code" and value is not None
+        }
+        if self._items is not None:
+            result["data"] = [item.to_dict() for item in self._items]
+        return result
+
+    def encode(self) -> bytes:
+        if self._encoded is None:
+            self._encoded = dumps(self.to_dict())
+        return self._encoded
+
+    def encode_with(self, **extra: Any) -> bytes:
+        """在已编码的结果前拼接额外字段，避免重新编码可能被多个请求共享的结果"""
+        data = self.encode()
+        if extra:
+            data = dumps(extra)[:-1] + b"," + data[1:]
+        return data
+
+    @classmethod
+    def from_results(cls, results: List["Result"]) -> "Result":
+        """将多个结果按顺序合并为一个结果，data 为各结果组成的数组"""
+        result = cls()
+        result._items = results
+        # 各结果已编码，只编码外层字段后拼接，to_dict 会包含 data，不能用于外层
+        envelope = dumps({"status": result.status, "retcode": result.retcode})
+        result._encoded = (
+            envelope[:-1]
+            + b',"data":['
+            + b",".join(item.encode() for item in results)
+            + b"]}"
+        )
+        return result
 
     def to_http(self):
-        result = self.model_dump(exclude={"code"}, exclude_none=True)
-        return json(sys_json.dumps(result), self.code)
+        return raw(self.encode(), self.code, content_type="application/json")
+
+    def to_ws(self, echo: Any = None, wire_format: WireFormat = WireFormat.JSON, **extra: Any):
+        """
+        编码为 WebSocket 消息，JSON 为文本帧，MessagePack 为二进制帧
+        Args:
+            echo: 请求中的 echo，不为空时附加在结果中
+            wire_format: 连接使用的消息格式
+            extra: 附加在结果前的其他字段
+        """
+        if echo is not None:
+            extra = {"echo": echo, **extra}
+        if wire_format == WireFormat.MSGPACK:
+            return packb({**extra, **self.to_dict()})
+        return self.encode_with(**extra).decode()
 
-    def to_ws(self):
-        result = self.model_dump(exclude={"code"}, exclude_none=True)
-        return sys_json.dumps(result)
-    
     @classmethod
     def from_exception(cls, app: App, url: str, exception: Exception):
         quiet = getattr(exception, "quiet", False)
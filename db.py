@@ -0,0 +1,399 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Type, Union
+
+from sanic.log import logger
+from tortoise import Model, Tortoise, connections
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.transactions import in_transaction
+
+from metrics import DB_PRUNED_ROWS, DB_QUERY_SECONDS, DB_SIZE_BYTES
+from models import PendingPost, PendingThread, Post, Thread
+
+SQLITE_PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000,
+}
+
+
+def db_config(db_url: str, modules: List[str]) -> Dict[str, Any]:
+    """
+    生成 Tortoise 配置，SQLite 连接默认使用 WAL 及适合频繁小批量写入的 pragma，
+    可在 DB_URL 的查询参数中覆盖，如 sqlite://db.sqlite3?synchronous=FULL
+    Args:
+        db_url: 数据库地址
+        modules: 模型所在模块
+    """
+    connection = expand_db_url(db_url)
+    if connection["engine"].endswith("sqlite"):
+        for pragma, value in SQLITE_PRAGMAS.items():
+            connection["credentials"].setdefault(pragma, value)
+    return {
+        "connections": {"default": connection},
+        "apps": {"models": {"models": modules, "default_connection": "default"}},
+    }
+
+
+# 旧版本创建的表中缺少的列，SQLite 不支持 ADD COLUMN 时使用非常量默认值，添加后再填充
+UPGRADE_COLUMNS = [
+    ("review_thread", "last_seen", "BIGINT NOT NULL DEFAULT 0", "strftime('%s', 'now')"),
+    ("review_thread", "max_floor", "INT NOT NULL DEFAULT 0", "0"),
+    ("review_thread", "max_pid", "BIGINT NOT NULL DEFAULT 0", "0"),
+    ("review_thread", "reply_num", "INT NOT NULL DEFAULT 0", "0"),
+    ("review_post", "comment_cursor", "BIGINT NOT NULL DEFAULT 0", "0"),
+]
+
+
+async def prepare_db(config: Dict[str, Any]):
+    """
+    在主进程中升级旧版本的表结构并创建缺少的表及索引
+    Args:
+        config: Tortoise 配置
+    """
+    await Tortoise.init(config=config)
+    try:
+        await upgrade_schema()
+        await Tortoise.generate_schemas()
+    finally:
+        await Tortoise.close_connections()
+
+
+async def upgrade_schema():
+    connection = connections.get("default")
+    if connection.capabilities.dialect != "sqlite":
+        logger.warning("Schema upgrades are only automatic on SQLite, add missing columns manually.")
+        return None
+    for table, column, definition, value in UPGRADE_COLUMNS:
+        _, rows = await connection.execute_query(f'PRAGMA table_info("{table}")')
+        columns = {row["name"] for row in rows}
+        if not columns or column in columns:
+            continue
+        await connection.execute_script(
+            f'ALTER TABLE "{table}" ADD COLUMN "{column}" {definition};'
+            f'UPDATE "{table}" SET "{column}" = {value};'
+        )
+        logger.info("Added column %s to %s.", column, table)
+
+
+class WriteBuffer:
+    def __init__(self, max_rows: int = 500, flush_ms: int = 200):
+        """
+        延迟写入检查记录，累积到一定行数或经过一定时间后在同一个事务中批量写入
+
+        同一条记录的多次写入会合并，尚未写入的新记录被更新时直接修改待插入的记录，
+        被删除时丢弃待插入的记录，同时删除之前可能已写入数据库的同一条记录
+
+        Attributes:
+            - max_rows: 待写入的行数达到该值时立即写入，默认值为500，类型为int
+            - flush_ms: 定时写入的间隔，默认值为200毫秒，类型为int
+        """
+        self.max_rows = max_rows
+        self.flush_ms = flush_ms
+        self.created: Dict[Type[Model], Dict[Any, Model]] = {}
+        self.updated: Dict[Tuple[Type[Model], Tuple[str, ...]], Dict[Any, Model]] = {}
+        self.deleted: Dict[Type[Model], Set[Any]] = {}
+        self.rows = 0
+        self.lock = asyncio.Lock()
+        self.closed = False
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.errors = 0
+
+    async def add(
+        self,
+        model: Type[Model],
+        new_records: List[Model],
+        changed_records: Optional[List[Model]] = None,
+        fields: Optional[List[str]] = None,
+    ):
+        """
+        加入待写入的记录，关闭后直接写入数据库
+        Args:
+            model: 记录对应的模型
+            new_records: 需要插入的记录
+            changed_records: 需要更新的记录
+            fields: 需要更新的字段
+        """
+        if self.closed:
+            await save_records(model, new_records, changed_records, fields)
+            return None
+        created = self.created.setdefault(model, {})
+        for record in new_records:
+            self.rows += record.pk not in created
+            created[record.pk] = record
+        if changed_records:
+            updated = self.updated.setdefault((model, tuple(fields)), {})
+            for record in changed_records:
+                pending = created.get(record.pk)
+                if pending is not None:
+                    for field in fields:
+                        setattr(pending, field, getattr(record, field))
+                    continue
+                self.rows += record.pk not in updated
+                updated[record.pk] = record
+        if self.rows >= self.max_rows:
+            await self.flush()
+
+    async def delete(self, model: Type[Model], ids: Iterable[Any]):
+        """
+        加入待删除的记录，关闭后直接删除
+        Args:
+            model: 记录对应的模型
+            ids: 需要删除的主键
+        """
+        if self.closed:
+            await delete_records(model, ids)
+            return None
+        created = self.created.get(model, {})
+        deleted = self.deleted.setdefault(model, set())
+        for _id in ids:
+            if created.pop(_id, None) is not None:
+                self.rows -= 1
+            # 插入时忽略冲突，待插入的记录也可能已在之前的批次中写入
+            if _id not in deleted:
+                deleted.add(_id)
+                self.rows += 1
+        if self.rows >= self.max_rows:
+            await self.flush()
+
+    def lookup(
+        self, model: Type[Model], field: Union[str, Tuple[str, ...]], ids: Iterable[Any]
+    ) -> Dict[Any, Any]:
+        """
+        查询尚未写入的记录的字段值
+        Args:
+            model: 记录对应的模型
+            field: 需要查询的字段名，为元组时查询多个字段的值组成的元组
+            ids: 需要查询的主键
+        """
+        names = (field,) if isinstance(field, str) else field
+        values: Dict[Any, Any] = {}
+        sources = [self.created.get(model, {})]
+        sources.extend(
+            records
+            for (_model, fields), records in self.updated.items()
+            if _model is model and set(names).issubset(fields)
+        )
+        for _id in ids:
+            for records in sources:
+                record = records.get(_id)
+                if record is not None:
+                    values[_id] = field_value(record, field)
+                    break
+        return values
+
+    async def flush(self):
+        async with self.lock:
+            if not self.rows:
+                return None
+            created, updated, deleted, rows = self.created, self.updated, self.deleted, self.rows
+            self.created, self.updated, self.deleted, self.rows = {}, {}, {}, 0
+            try:
+                with DB_QUERY_SECONDS.time("WriteBuffer", "flush"):
+                    async with in_transaction():
+                        # 先删除，删除后重新加入的记录才能插入
+                        for model, ids in deleted.items():
+                            if ids:
+                                await delete_records(model, ids)
+                        for model, records in created.items():
+                            if records:
+                                await model.bulk_create(list(records.values()), ignore_conflicts=True)
+                        for (model, fields), records in updated.items():
+                            if records:
+                                await model.bulk_update(list(records.values()), fields)
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Failed to flush %d review records: %s", rows, e)
+                self.restore(created, updated, deleted)
+                return None
+            self.flushes += 1
+            self.flushed_rows += rows
+
+    def restore(self, created, updated, deleted):
+        """将写入失败的记录放回缓冲区，期间加入的较新记录优先，期间被删除的新记录不再放回"""
+        for model, records in created.items():
+            dropped = self.deleted.get(model, set())
+            records = {pk: record for pk, record in records.items() if pk not in dropped}
+            self.created[model] = {**records, **self.created.get(model, {})}
+        for model, ids in deleted.items():
+            self.deleted[model] = ids | self.deleted.get(model, set())
+        for key, records in updated.items():
+            self.updated[key] = {**records, **self.updated.get(key, {})}
+        self.rows = (
+            sum(map(len, self.created.values()))
+            + sum(map(len, self.updated.values()))
+            + sum(map(len, self.deleted.values()))
+        )
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_ms / 1000)
+            await self.flush()
+
+    async def close(self):
+        self.closed = True
+        await self.flush()
+        if self.rows:
+            logger.error("%d review records were not saved.", self.rows)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "pending": self.rows,
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            "errors": self.errors,
+        }
+
+
+def field_value(record: Model, field: Union[str, Tuple[str, ...]]) -> Any:
+    if isinstance(field, str):
+        return getattr(record, field)
+    return tuple(getattr(record, name) for name in field)
+
+
+async def save_records(
+    model: Type[Model],
+    new_records: List[Model],
+    changed_records: Optional[List[Model]] = None,
+    fields: Optional[List[str]] = None,
+):
+    """
+    在同一个事务中批量写入新记录并更新已变化的记录
+    Args:
+        model: 记录对应的模型
+        new_records: 需要插入的记录
+        changed_records: 需要更新的记录
+        fields: 需要更新的字段
+    """
+    if not new_records and not changed_records:
+        return None
+    with DB_QUERY_SECONDS.time(model.__name__, "save"):
+        async with in_transaction():
+            if new_records:
+                await model.bulk_create(new_records, ignore_conflicts=True)
+            if changed_records:
+                await model.bulk_update(changed_records, fields)
+
+
+async def delete_records(model: Type[Model], ids: Iterable[Any], chunk_size: int = 500):
+    """按主键分块删除记录，避免超出 SQLite 的变量上限"""
+    ids = list(ids)
+    with DB_QUERY_SECONDS.time(model.__name__, "delete"):
+        for i in range(0, len(ids), chunk_size):
+            await model.filter(pk__in=ids[i : i + chunk_size]).delete()
+
+
+class Compactor:
+    def __init__(
+        self,
+        retention: int,
+        interval: int = 3600,
+        batch_size: int = 200,
+        pause: float = 0.05,
+        on_prune: Optional[Callable[[List[int], List[int]], Any]] = None,
+    ):
+        """
+        定期清理长期未出现在检查范围内的主题贴及其楼层与楼中楼记录
+
+        每批删除少量主题贴并在批次之间让出数据库，避免阻塞检查
+
+        Attributes:
+            - retention: 主题贴超过该时间未出现时清理，单位为秒，类型为int
+            - interval: 清理的间隔，默认值为3600秒，类型为int
+            - batch_size: 每批清理的主题贴数量，默认值为200，类型为int
+            - pause: 批次之间的等待时间，默认值为0.05秒，类型为float
+            - on_prune: 每批删除后以主题贴 id 与楼层 id 调用，用于清除缓存中已删除的记录
+        """
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.on_prune = on_prune
+        self.pruned = {"threads": 0, "posts": 0}
+        self.last_run: Optional[float] = None
+        self.size: Dict[str, int] = {}
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.compact()
+            except Exception as e:
+                logger.warning("Failed to compact review records: %s", e)
+
+    async def compact(self) -> Dict[str, int]:
+        """
+        清理过期记录并回收空闲页
+
+        Returns:
+            Dict[str, int]: 本次清理的主题贴与楼层数量
+        """
+        cutoff = int(time.time()) - self.retention
+        pruned = {"threads": 0, "posts": 0}
+        while True:
+            tids = await (
+                Thread.filter(last_seen__lt=cutoff)
+                .limit(self.batch_size)
+                .values_list("tid", flat=True)
+            )
+            if not tids:
+                break
+            with DB_QUERY_SECONDS.time("Compactor", "delete"):
+                async with in_transaction():
+                    pids = await Post.filter(tid__in=tids).values_list("pid", flat=True)
+                    posts = await Post.filter(tid__in=tids).delete()
+                    threads = await Thread.filter(tid__in=tids).delete()
+                    await PendingPost.filter(tid__in=tids).delete()
+                    await PendingThread.filter(tid__in=tids).delete()
+            if self.on_prune:
+                self.on_prune(tids, pids)
+            pruned["threads"] += threads
+            pruned["posts"] += posts
+            await asyncio.sleep(self.pause)
+
+        for model, rows in pruned.items():
+            self.pruned[model] += rows
+            DB_PRUNED_ROWS.inc(model, amount=rows)
+        self.size = await self.db_size(vacuum=pruned["threads"] > 0)
+        if self.size:
+            DB_SIZE_BYTES.set(self.size["size"])
+        self.last_run = time.time()
+        logger.info(
+            "Pruned %d threads and %d posts not seen for %d seconds, database size is %s bytes.",
+            pruned["threads"],
+            pruned["posts"],
+            self.retention,
+            self.size.get("size", "unknown"),
+        )
+        return pruned
+
+    @staticmethod
+    async def db_size(vacuum: bool = False) -> Dict[str, int]:
+        """SQLite 数据库的大小及空闲页大小，auto_vacuum 为 INCREMENTAL 时可回收空闲页"""
+        connection = connections.get("default")
+        if connection.capabilities.dialect != "sqlite":
+            return {}
+
+        async def pragma(name: str) -> int:
+            _, rows = await connection.execute_query(f"PRAGMA {name}")
+            return rows[0][0] if rows else 0
+
+        if vacuum and await pragma("auto_vacuum") == 2:
+            await connection.execute_script("PRAGMA incremental_vacuum")
+        page_size = await pragma("page_size")
+        return {
+            "size": await pragma("page_count") * page_size,
+            "free": await pragma("freelist_count") * page_size,
+        }
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "retention": self.retention,
+            "last_run": self.last_run,
+            "pruned": self.pruned,
+            "db_size": self.size,
+        }
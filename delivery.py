@@ -0,0 +1,460 @@
+import asyncio
+import hashlib
+import time
+from pathlib import Path
+from typing import IO, Any, Dict, List, Optional, Union
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, ClientWebSocketResponse
+from sanic import Websocket
+from sanic.log import logger
+
+from custom_type import Config, PushFilter, WireFormat
+from filters import FilterIndex, Topic
+from metrics import PUSH_DELIVERY_SECONDS, PUSH_MESSAGES
+from replay import ReplayLog
+from serializer import Payload
+from utils import union_ws_send
+
+
+class Subscriber:
+    """
+    推送消息的订阅者，每个订阅者拥有独立的有界队列和发送协程
+
+    Attributes:
+        - name: 订阅者名称，用于日志和状态
+        - queue_size: 队列容量，超出后丢弃最旧的消息或写入磁盘
+        - batch_size: 单次发送的最大消息数
+        - flush_interval: 凑齐一批消息的最长等待时间，单位为秒
+        - max_retries: 发送失败后的最大重试次数
+        - backoff: 首次重试前的等待时间，之后每次翻倍，单位为秒
+        - max_backoff: 重试等待时间的上限，单位为秒
+        - spill_dir: 队列溢出时写入的目录，为空时丢弃最旧的消息
+        - filters: 过滤规则，满足任意一条的消息才会发送，为空时接收所有消息
+    """
+
+    kind = "unknown"
+
+    def __init__(
+        self,
+        name: str,
+        queue_size: int = 1000,
+        batch_size: int = 50,
+        flush_interval: float = 0.2,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        spill_dir: Optional[str] = None,
+        filters: Optional[List[PushFilter]] = None,
+    ):
+        self.name = name
+        self.filters = filters or []
+        self.queue: asyncio.Queue[Payload] = asyncio.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.spill_path: Optional[Path] = None
+        if spill_dir:
+            digest = hashlib.md5(name.encode()).hexdigest()[:16]
+            self.spill_path = Path(spill_dir) / f"{self.kind}-{digest}.jsonl"
+        self._drain: Optional[IO[bytes]] = None
+        self.replay: Optional[ReplayLog] = None
+        self.cursor = 0
+        self.skip_through = 0
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.retries = 0
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(
+            self.run(), name=f"delivery:{self.name}"
+        )
+        return self
+
+    def put(self, message: Payload):
+        if self.closed:
+            return None
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.spill_path:
+                self.spill(message)
+            else:
+                self.queue.get_nowait()
+                self.dropped += 1
+                PUSH_MESSAGES.inc(self.kind, "dropped")
+                self.queue.put_nowait(message)
+
+    def spill(self, message: Payload):
+        self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.spill_path, "ab") as fp:
+            fp.write(message.data + b"\n")
+        self.spilled += 1
+        PUSH_MESSAGES.inc(self.kind, "spilled")
+
+    def read_spill(self) -> List[Payload]:
+        """从溢出文件中读取下一批消息，读完后删除文件"""
+        if self._drain is None:
+            if not self.spill_path or not self.spill_path.exists():
+                return []
+            drain_path = self.spill_path.with_suffix(".draining")
+            if not drain_path.exists():
+                self.spill_path.replace(drain_path)
+            self._drain = open(drain_path, "rb")
+
+        batch = []
+        while len(batch) < self.batch_size:
+            line = self._drain.readline()
+            if not line:
+                drain_path = Path(self._drain.name)
+                self._drain.close()
+                self._drain = None
+                drain_path.unlink(missing_ok=True)
+                break
+            if line.strip():
+                batch.append(Payload(line.rstrip(b"\n")))
+        return batch
+
+    async def next_batch(self) -> List[Payload]:
+        if self.queue.empty() and (
+            self._drain or (self.spill_path and self.spill_path.exists())
+        ):
+            batch = self.read_spill()
+            if batch:
+                return batch
+
+        message = await self.next_message()
+        if message is None:
+            return []
+        batch = [message]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def next_message(self) -> Optional[Payload]:
+        """等待下一条实时消息，开始补发时返回空"""
+        if not self.queue.empty():
+            return self.queue.get_nowait()
+        get = asyncio.ensure_future(self.queue.get())
+        wakeup = asyncio.ensure_future(self.wakeup.wait())
+        try:
+            await asyncio.wait((get, wakeup), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            wakeup.cancel()
+            if not get.done():
+                get.cancel()
+        if get.done() and not get.cancelled():
+            return get.result()
+        return None
+
+    def resume(self, replay: ReplayLog, seq: int):
+        """
+        从回放日志补发序号大于 seq 的消息，补发完成后继续发送实时消息
+
+        补发期间到达的实时消息已在日志中，补发完成后跳过序号不大于已补发消息的实时消息
+        Args:
+            replay: 回放日志
+            seq: 订阅者收到的最后一条消息的序号
+        """
+        self.replay = replay
+        self.cursor = seq
+        self.skip_through = 0
+        # 唤醒正在等待实时消息的发送协程
+        self.wakeup.set()
+
+    def read_replay(self) -> List[Payload]:
+        """读取下一批需要补发的消息，读完后退出补发"""
+        index = FilterIndex([self])
+        while True:
+            records = self.replay.read(self.cursor, self.batch_size)
+            if not records:
+                self.replay = None
+                self.skip_through = self.cursor
+                return []
+            self.cursor = records[-1].seq
+            batch = [message for message in records if index.match(message.topic)]
+            if batch:
+                return batch
+
+    async def run(self):
+        while not self.closed:
+            if self.replay is not None:
+                self.wakeup.clear()
+                batch = self.read_replay()
+            else:
+                batch = await self.next_batch()
+                if self.replay is not None:
+                    # 凑齐一批期间开始补发，已在日志中的消息由补发发送
+                    batch = [message for message in batch if message.seq is None]
+                elif self.skip_through:
+                    batch = [
+                        message
+                        for message in batch
+                        if message.seq is None or message.seq > self.skip_through
+                    ]
+                    if batch:
+                        self.skip_through = 0
+            if batch:
+                await self.deliver(batch)
+
+    async def deliver(self, batch: List[Payload]):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.send(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.closed or attempt == self.max_retries:
+                    logger.warning("delivery to %s failed: %r", self.name, e)
+                    break
+                self.retries += 1
+                await asyncio.sleep(min(self.backoff * 2**attempt, self.max_backoff))
+            else:
+                self.sent += len(batch)
+                PUSH_MESSAGES.inc(self.kind, "sent", amount=len(batch))
+                now = time.monotonic()
+                for message in batch:
+                    PUSH_DELIVERY_SECONDS.observe(now - message.created, self.kind)
+                return None
+        self.failed += len(batch)
+        PUSH_MESSAGES.inc(self.kind, "failed", amount=len(batch))
+
+    async def send(self, batch: List[Payload]):
+        raise NotImplementedError
+
+    async def flush(self, timeout: float):
+        """在超时之前等待队列中的消息发送完毕"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self.queue.empty() and not self.closed and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+
+    async def close(self):
+        self.closed = True
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except (asyncio.CancelledError, Exception):
+                pass
+        if self._drain:
+            self._drain.close()
+            self._drain = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "depth": self.queue.qsize(),
+            "max_depth": self.queue.maxsize,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "retries": self.retries,
+            "filters": len(self.filters),
+            "replaying": self.replay is not None,
+            "cursor": self.cursor,
+            "closed": self.closed,
+        }
+
+
+class WebsocketSubscriber(Subscriber):
+    """
+    WebSocket 及反向 WebSocket 连接，连接断开后不再重试
+
+    Attributes:
+        - ws: 连接
+        - wire_format: 消息格式，MessagePack 以二进制帧发送
+    """
+
+    kind = "websocket"
+
+    def __init__(
+        self,
+        ws: Union[Websocket, ClientWebSocketResponse],
+        name: str,
+        wire_format: WireFormat = WireFormat.JSON,
+        **kwargs,
+    ):
+        kwargs["flush_interval"] = 0
+        kwargs["spill_dir"] = None
+        super().__init__(name, **kwargs)
+        self.ws = ws
+        self.wire_format = wire_format
+
+    async def send(self, batch: List[Payload]):
+        binary = self.wire_format == WireFormat.MSGPACK
+        try:
+            for message in batch:
+                await union_ws_send(self.ws, message.packed if binary else message.text)
+        except Exception:
+            self.closed = True
+            raise
+
+
+class HTTPCallbackSubscriber(Subscriber):
+    """
+    HTTP 回调地址，批量发送时以数组形式提交
+
+    Attributes:
+        - session: 发送请求使用的会话
+        - batch: 是否以数组形式批量提交
+        - timeout: 单次请求的超时时间，单位为秒
+    """
+
+    kind = "http-callback"
+
+    def __init__(
+        self,
+        url: str,
+        session: ClientSession,
+        batch: bool = False,
+        timeout: float = 10,
+        **kwargs,
+    ):
+        if not batch:
+            kwargs["batch_size"] = 1
+        super().__init__(url, **kwargs)
+        self.session = session
+        self.batch = batch
+        self.timeout = ClientTimeout(total=timeout)
+
+    async def send(self, batch: List[Payload]):
+        if self.batch:
+            data = b"[" + b",".join(message.data for message in batch) + b"]"
+        else:
+            data = batch[0].data
+        async with self.session.post(
+            self.name,
+            data=data,
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
+        ) as resp:
+            if resp.status >= 400:
+                raise ClientError(f"status {resp.status}")
+
+
+class Delivery:
+    """管理所有订阅者，按过滤规则将推送消息分发到各自的队列，配置了 replay_dir 时可补发错过的消息"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.subscribers: List[Subscriber] = []
+        self._index: Optional[FilterIndex] = None
+        self.replay: Optional[ReplayLog] = None
+        if config.replay_dir:
+            self.replay = ReplayLog(
+                config.replay_dir,
+                config.replay_segment_bytes,
+                config.replay_max_bytes,
+                config.replay_max_age,
+            )
+
+    @property
+    def index(self) -> FilterIndex:
+        if self._index is None:
+            self._index = FilterIndex(self.subscribers)
+        return self._index
+
+    def _options(self) -> Dict[str, Any]:
+        return {
+            "queue_size": self.config.delivery_queue_size,
+            "batch_size": self.config.delivery_batch_size,
+            "flush_interval": self.config.delivery_flush_ms / 1000,
+            "max_retries": self.config.delivery_max_retries,
+        }
+
+    def add_websocket(
+        self,
+        ws: Union[Websocket, ClientWebSocketResponse],
+        name: str = "unknown",
+        wire_format: WireFormat = WireFormat.JSON,
+    ) -> WebsocketSubscriber:
+        subscriber = WebsocketSubscriber(
+            ws,
+            name,
+            wire_format,
+            filters=self.config.push_filters.get(name),
+            **self._options(),
+        ).start()
+        self.subscribers.append(subscriber)
+        self._index = None
+        return subscriber
+
+    def add_http_callback(self, url: str, session: ClientSession) -> HTTPCallbackSubscriber:
+        subscriber = HTTPCallbackSubscriber(
+            url,
+            session,
+            batch=self.config.http_callback_batch,
+            spill_dir=self.config.delivery_spill_dir or None,
+            filters=self.config.push_filters.get(url),
+            **self._options(),
+        ).start()
+        self.subscribers.append(subscriber)
+        self._index = None
+        return subscriber
+
+    def set_filters(self, subscriber: Subscriber, filters: List[PushFilter]):
+        subscriber.filters = filters
+        self._index = None
+
+    def resume(self, subscriber: Subscriber, seq: int) -> Dict[str, Any]:
+        """
+        为重新连接的订阅者补发错过的消息
+        Args:
+            subscriber: 订阅者
+            seq: 订阅者收到的最后一条消息的序号
+        Returns:
+            Dict[str, Any]: 日志中最旧的序号及补发是否完整，日志已删除部分错过的消息时不完整
+        """
+        first_seq = self.replay.first_seq()
+        subscriber.resume(self.replay, seq)
+        return {
+            "seq": seq,
+            "first_seq": first_seq,
+            "complete": first_seq is None or first_seq <= seq + 1,
+        }
+
+    async def remove(self, subscriber: Subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+            self._index = None
+        await subscriber.close()
+
+    def wants(self, topic: Topic) -> bool:
+        """是否有订阅者需要接收该消息，没有时可以跳过编码"""
+        return self.index.wants(topic)
+
+    def publish(self, message: Payload):
+        for subscriber in self.index.match(message.topic):
+            subscriber.put(message)
+
+    def status(self) -> List[Dict[str, Any]]:
+        return [subscriber.status() for subscriber in self.subscribers]
+
+    async def close(self, timeout: float = 5):
+        await asyncio.gather(
+            *[subscriber.flush(timeout) for subscriber in self.subscribers]
+        )
+        for subscriber in list(self.subscribers):
+            await self.remove(subscriber)
+        if self.replay is not None:
+            self.replay.close()
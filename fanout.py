@@ -0,0 +1,198 @@
+import asyncio
+import os
+import struct
+import tempfile
+from multiprocessing import Array, Value
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+from sanic.log import logger
+
+from custom_type import App
+from filters import Topic
+from serializer import Payload
+
+# 帧头为序号、筛选依据与消息的长度，没有筛选依据时长度为 0
+_HEADER = struct.Struct("!QII")
+
+
+def setup_fanout(app: App):
+    """在主进程中创建选举巡查 worker 所需的共享状态，仅在多 worker 部署时调用"""
+    path = Path(tempfile.gettempdir()) / f"bunglecat-{os.getpid()}.sock"
+    app.shared_ctx.review_leader = Value("i", 0)
+    app.shared_ctx.fanout_path = Array("c", str(path).encode())
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Fanout:
+    """
+    多 worker 部署时只由一个 worker 巡查贴吧，推送消息经本地 socket 转发给其他 worker
+
+    回调地址与反向 WebSocket 只由巡查 worker 推送，其他 worker 只推送给各自的 WebSocket 订阅者
+
+    单 worker 部署时直接发布到本进程的 Delivery
+
+    巡查 worker 为每条推送消息分配递增的序号，开启回放日志时写入日志，接任时从日志恢复序号
+
+    Attributes:
+        - app: 当前 worker 的应用
+        - on_leader: 当前 worker 成为巡查 worker 时的协程回调，接任时同样调用
+        - max_buffer: 单个 worker 未读取的消息上限，超出后断开该连接，单位为字节
+    """
+
+    def __init__(
+        self,
+        app: App,
+        on_leader: Callable[[App], Awaitable[Any]],
+        max_buffer: int = 64 * 1024 * 1024,
+    ):
+        self.app = app
+        self.on_leader = on_leader
+        self.max_buffer = max_buffer
+        self.leader = getattr(app.shared_ctx, "review_leader", None)
+        self.path: Optional[str] = None
+        if self.leader is not None:
+            self.path = app.shared_ctx.fanout_path.value.decode()
+        self.is_leader = False
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.peers: Set[asyncio.StreamWriter] = set()
+        self.task: Optional[asyncio.Task] = None
+        self.seq = 0
+        self.forwarded = 0
+        self.received = 0
+        self.disconnected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.leader is not None
+
+    @property
+    def role(self) -> str:
+        if not self.enabled:
+            return "single"
+        return "leader" if self.is_leader else "follower"
+
+    def elect(self) -> bool:
+        """巡查 worker 不存在或已退出时由当前 worker 接任"""
+        with self.leader.get_lock():
+            pid = self.leader.value
+            if pid and pid != os.getpid() and pid_alive(pid):
+                return False
+            self.leader.value = os.getpid()
+        return True
+
+    async def start(self):
+        if not self.enabled or self.elect():
+            await self.lead()
+        else:
+            self.task = self.app.add_task(self.follow(), name="fanout")
+
+    async def lead(self):
+        self.is_leader = True
+        replay = self.app.ctx.delivery.replay
+        if replay is not None:
+            self.seq = max(self.seq, replay.open())
+        if self.enabled:
+            Path(self.path).unlink(missing_ok=True)
+            self.server = await asyncio.start_unix_server(self._accept, self.path)
+            logger.info("Worker %d is reviewing, fan-out via %s.", os.getpid(), self.path)
+        task = await self.on_leader(self.app)
+        if task is not None:
+            self.app.ctx.tasks.append(task)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.peers.add(writer)
+        try:
+            await reader.read()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.peers.discard(writer)
+            writer.close()
+
+    async def follow(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except (ConnectionError, FileNotFoundError):
+                if self.elect():
+                    await self.lead()
+                    return None
+                await asyncio.sleep(1)
+                continue
+            logger.info("Worker %d is receiving pushes from the reviewing worker.", os.getpid())
+            try:
+                while True:
+                    header = await reader.readexactly(_HEADER.size)
+                    self.seq, topic_size, size = _HEADER.unpack(header)
+                    topic = None
+                    if topic_size:
+                        topic = Topic.unpack(await reader.readexactly(topic_size))
+                    data = await reader.readexactly(size)
+                    self.received += 1
+                    self.app.ctx.delivery.publish(Payload(data, topic, self.seq))
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.disconnected += 1
+                logger.warning("Lost connection to the reviewing worker.")
+            finally:
+                writer.close()
+
+    def wants(self, topic: Topic) -> bool:
+        """
+        其他 worker 的订阅者无法在此判断，有其他 worker 连接时总是需要编码，
+        开启回放日志时也需要为断线的订阅者保存
+        """
+        delivery = self.app.ctx.delivery
+        return delivery.replay is not None or bool(self.peers) or delivery.wants(topic)
+
+    def publish(self, payload: Payload):
+        self.seq += 1
+        payload = payload.with_seq(self.seq)
+        if self.app.ctx.delivery.replay is not None:
+            self.app.ctx.delivery.replay.append(payload)
+        self.app.ctx.delivery.publish(payload)
+        if not self.peers:
+            return None
+        topic = payload.topic.pack() if payload.topic else b""
+        frame = _HEADER.pack(self.seq, len(topic), len(payload.data)) + topic + payload.data
+        for writer in list(self.peers):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                logger.warning("A worker is not reading pushes, disconnecting it.")
+                self.peers.discard(writer)
+                writer.close()
+                continue
+            writer.write(frame)
+        self.forwarded += 1
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        if self.server:
+            self.server.close()
+            for writer in list(self.peers):
+                writer.close()
+            Path(self.path).unlink(missing_ok=True)
+        if self.is_leader and self.enabled:
+            with self.leader.get_lock():
+                if self.leader.value == os.getpid():
+                    self.leader.value = 0
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "role": self.role,
+            "pid": os.getpid(),
+            "seq": self.seq,
+            "peers": len(self.peers),
+            "forwarded": self.forwarded,
+            "received": self.received,
+            "disconnected": self.disconnected,
+        }
@@ -0,0 +1,102 @@
+import re
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Pattern, Set
+
+from custom_type import PushFilter
+
+if TYPE_CHECKING:
+    from delivery import Subscriber
+
+
+class Topic(NamedTuple):
+    """推送消息的筛选依据，由 Reviewer 在编码前生成，随消息转发给其他 worker"""
+
+    msg_type: str
+    fname: str
+    author_id: int
+    text: str
+
+    @classmethod
+    def of(cls, context, msg_type: str) -> "Topic":
+        return cls(msg_type, context.fname, context.author_id, context.text)
+
+    def pack(self) -> bytes:
+        return "\0".join((self.msg_type, self.fname, str(self.author_id), self.text)).encode()
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "Topic":
+        msg_type, fname, author_id, text = data.decode().split("\0", 3)
+        return cls(msg_type, fname, int(author_id), text)
+
+
+class CompiledFilter:
+    """
+    编译后的过滤规则，关键词与正则合并为一个正则，最后匹配
+
+    Attributes:
+        - subscriber: 规则所属的订阅者
+        - msg_types: 消息类型，为空时不限
+        - author_ids: 作者id，为空时不限
+        - pattern: 关键词与正则合并后的正则，为空时不限
+    """
+
+    __slots__ = ("subscriber", "msg_types", "author_ids", "pattern")
+
+    def __init__(self, subscriber: "Subscriber", push_filter: PushFilter):
+        self.subscriber = subscriber
+        self.msg_types: Set[str] = set(push_filter.msg_types)
+        self.author_ids: Set[int] = set(push_filter.author_ids)
+        alternatives = [re.escape(keyword) for keyword in push_filter.keywords]
+        alternatives.extend(f"(?:{pattern})" for pattern in push_filter.patterns)
+        self.pattern: Optional[Pattern[str]] = (
+            re.compile("|".join(alternatives)) if alternatives else None
+        )
+
+    def match(self, topic: Topic) -> bool:
+        if self.msg_types and topic.msg_type not in self.msg_types:
+            return False
+        if self.author_ids and topic.author_id not in self.author_ids:
+            return False
+        return self.pattern is None or self.pattern.search(topic.text) is not None
+
+
+class FilterIndex:
+    """
+    按贴吧分组的过滤规则索引，没有过滤规则的订阅者接收所有消息
+
+    一个订阅者的多条规则之间为或，一条规则内各条件之间为且
+    """
+
+    def __init__(self, subscribers: Iterable["Subscriber"]):
+        self.subscribers = list(subscribers)
+        self.everything: List["Subscriber"] = []
+        self.by_forum: Dict[Optional[str], List[CompiledFilter]] = {}
+        for subscriber in self.subscribers:
+            if not subscriber.filters:
+                self.everything.append(subscriber)
+                continue
+            for push_filter in subscriber.filters:
+                compiled = CompiledFilter(subscriber, push_filter)
+                for fname in push_filter.fnames or (None,):
+                    self.by_forum.setdefault(fname, []).append(compiled)
+
+    def match(self, topic: Optional[Topic]) -> List["Subscriber"]:
+        """
+        查找需要接收消息的订阅者
+        Args:
+            topic: 消息的筛选依据，为空时发送给所有订阅者
+        """
+        if topic is None:
+            return self.subscribers
+        matched: Dict["Subscriber", None] = dict.fromkeys(self.everything)
+        for compiled in (*self.by_forum.get(topic.fname, ()), *self.by_forum.get(None, ())):
+            if compiled.subscriber not in matched and compiled.match(topic):
+                matched[compiled.subscriber] = None
+        return list(matched)
+
+    def wants(self, topic: Topic) -> bool:
+        if self.everything:
+            return True
+        return any(
+            compiled.match(topic)
+            for compiled in (*self.by_forum.get(topic.fname, ()), *self.by_forum.get(None, ()))
+        )
@@ -1,16 +1,26 @@
+import asyncio
+import random
+import time
 from asyncio import Task
+from typing import Any, Dict, Optional
 
 from aiohttp import ClientSession
 from sanic.log import logger
 
-from custom_type import App
-from route import _websocket_call
+from custom_type import ApiType, App, WireFormat
+from route import WIRE_SUBPROTOCOLS, _websocket_call
 
 
 async def create_http_session(app: App):
     app.ctx.http_session = ClientSession(loop=app.loop)
-    for url in app.ctx.config.http_callback_url:
-        logger.info("loaded http callback url: %s", url)
+
+
+def add_http_callbacks(app: App):
+    """只由巡查 worker 调用，其他 worker 不推送到回调地址，以免重复推送"""
+    if ApiType.HTTP_CALLBACK in app.config.API_TYPE:
+        for url in app.ctx.config.http_callback_url or ():
+            app.ctx.delivery.add_http_callback(url, app.ctx.http_session)
+            logger.info("loaded http callback url: %s", url)
 
 
 async def close_http_session(app: App):
@@ -18,12 +28,86 @@ async def close_http_session(app: App):
         await app.ctx.http_session.close()
 
 
+class ReverseWebsocket:
+    """
+    反向 WebSocket 连接，断开后按带抖动的指数退避重连
+
+    Attributes:
+        - url: 连接地址
+        - state: 连接状态，connecting / connected / waiting
+        - connects: 成功建立连接的次数
+        - reconnects: 重连尝试次数
+    """
+
+    def __init__(self, app: App, url: str):
+        self.app = app
+        self.url = url
+        self.state = "connecting"
+        self.connects = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self.connected_at: Optional[float] = None
+
+    def backoff(self, attempt: int) -> float:
+        config = self.app.ctx.config
+        delay = min(config.reverse_ws_backoff * 2**attempt, config.reverse_ws_max_backoff)
+        return delay * random.uniform(0.5, 1)
+
+    async def run(self):
+        config = self.app.ctx.config
+        attempt = 0
+        while True:
+            self.state = "connecting"
+            try:
+                ws = await asyncio.wait_for(
+                    self.app.ctx.http_session.ws_connect(
+                        self.url,
+                        heartbeat=config.reverse_ws_heartbeat or None,
+                        protocols=WIRE_SUBPROTOCOLS,
+                    ),
+                    config.reverse_ws_connect_timeout,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = repr(e)
+                logger.warning("reverse-ws %s connect failed: %r", self.url, e)
+            else:
+                attempt = 0
+                self.state = "connected"
+                self.connects += 1
+                self.connected_at = time.time()
+                logger.info("reverse-ws %s was connected.", self.url)
+                wire_format = WireFormat.MSGPACK if ws.protocol == WireFormat.MSGPACK else WireFormat.JSON
+                await _websocket_call(self.app, ws, None, self.url, wire_format)
+                self.connected_at = None
+                if ws.exception():
+                    self.last_error = repr(ws.exception())
+                logger.warning("reverse-ws %s was disconnected.", self.url)
+
+            delay = self.backoff(attempt)
+            attempt += 1
+            self.reconnects += 1
+            self.state = "waiting"
+            await asyncio.sleep(delay)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "state": self.state,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "connected_at": self.connected_at,
+        }
+
+
 async def create_reverse_ws_connections(app: App):
+    """只由巡查 worker 调用，每个地址只建立一个连接，以免重复推送"""
     tasks: list[Task] = []
     for url in app.ctx.config.reverse_ws_url or ():
-        ws = await app.ctx.http_session.ws_connect(url)
-
-        task = app.add_task(_websocket_call(app, ws, app.ctx.bot, url))
-        logger.info("reverse-ws %s was connected.", url)
+        connection = ReverseWebsocket(app, url)
+        app.ctx.reverse_ws.append(connection)
+        task = app.add_task(connection.run(), name=f"reverse-ws:{url}")
         tasks.append(task)
     return tasks
@@ -0,0 +1,337 @@
+import asyncio
+import json as sys_json
+import os
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager, contextmanager
+from multiprocessing import Array
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sanic.log import logger
+
+from fanout import pid_alive
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """
+    指标基类，各 worker 分别记录，抓取时合并
+
+    Attributes:
+        - name: 指标名
+        - documentation: 指标说明
+        - labels: 标签名
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values: Dict[LabelValues, Any] = {}
+        REGISTRY.register(self)
+
+    def _key(self, labels: Iterable[Any]) -> LabelValues:
+        key = tuple(str(label) for label in labels)
+        if len(key) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}")
+        return key
+
+    def merge(self, values: Dict[LabelValues, Any], key: LabelValues, value: Any):
+        values[key] = values.get(key, 0) + value
+
+    def samples(self, key: LabelValues, value: Any) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        yield self.name, dict(zip(self.labels, key)), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: Any, amount: float = 1):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *labels: Any):
+        self.values[self._key(labels)] = value
+
+    def clear(self):
+        self.values.clear()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def observe(self, value: float, *labels: Any):
+        key = self._key(labels)
+        # 各桶的计数不累加，最后两项为总和与次数
+        counts = self.values.get(key)
+        if counts is None:
+            counts = self.values[key] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        counts[-2] += value
+        counts[-1] += 1
+
+    @contextmanager
+    def time(self, *labels: Any):
+        start = time.perf_counter()
+        try:
+            yield None
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def merge(self, values: Dict[LabelValues, Any], key: LabelValues, value: List[float]):
+        counts = values.get(key)
+        if counts is None:
+            values[key] = list(value)
+        else:
+            for i, count in enumerate(value):
+                counts[i] += count
+
+    def samples(self, key: LabelValues, value: List[float]):
+        labels = dict(zip(self.labels, key))
+        cumulative = 0
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            yield f"{self.name}_bucket", {**labels, "le": repr(float(bound))}, cumulative
+        yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, value[-1]
+        yield f"{self.name}_sum", labels, value[-2]
+        yield f"{self.name}_count", labels, value[-1]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        self.metrics[metric.name] = metric
+
+    def dump(self) -> Dict[str, List[Tuple[LabelValues, Any]]]:
+        return {
+            name: [[list(key), value] for key, value in metric.values.items()]
+            for name, metric in self.metrics.items()
+        }
+
+    def render(self, dumps: Iterable[Dict[str, List]]) -> str:
+        """合并多个 worker 的指标并输出为 Prometheus 文本格式"""
+        merged: Dict[str, Dict[LabelValues, Any]] = {name: {} for name in self.metrics}
+        for dump in dumps:
+            for name, values in dump.items():
+                metric = self.metrics.get(name)
+                if metric is None:
+                    continue
+                for key, value in values:
+                    metric.merge(merged[name], tuple(key), value)
+
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key, value in sorted(merged[name].items()):
+                for sample, labels, sample_value in metric.samples(key, value):
+                    if labels:
+                        label_text = ",".join(
+                            f'{label}="{_escape(label_value)}"'
+                            for label, label_value in labels.items()
+                        )
+                        sample = f"{sample}{{{label_text}}}"
+                    lines.append(f"{sample} {_format_value(sample_value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+AIOTIEBA_CALL_SECONDS = Histogram(
+    "bunglecat_aiotieba_call_seconds",
+    "Latency of aiotieba calls that reach the upstream.",
+    ["method", "source"],
+)
+AIOTIEBA_CALL_ERRORS = Counter(
+    "bunglecat_aiotieba_call_errors_total",
+    "Failed aiotieba calls by error type.",
+    ["method", "source", "error"],
+)
+REVIEW_STAGE_SECONDS = Histogram(
+    "bunglecat_review_stage_seconds",
+    "Duration of each reviewer pipeline stage batch and whole review per forum.",
+    ["forum", "stage"],
+)
+REVIEW_STAGE_ITEMS = Counter(
+    "bunglecat_review_stage_items_total",
+    "Items processed by each reviewer pipeline stage.",
+    ["stage"],
+)
+REVIEW_QUEUE_DEPTH = Gauge(
+    "bunglecat_review_queue_depth",
+    "Items waiting in each reviewer pipeline stage.",
+    ["stage"],
+)
+REVIEW_INTERVAL_SECONDS = Gauge(
+    "bunglecat_review_interval_seconds",
+    "Current review interval per forum.",
+    ["forum"],
+)
+REVIEW_THREAD_PAGES = Gauge(
+    "bunglecat_review_thread_pages",
+    "Thread list pages scanned per review of each forum.",
+    ["forum"],
+)
+REVIEW_THREAD_CHURN = Gauge(
+    "bunglecat_review_thread_churn",
+    "Share of changed threads on the last scanned thread list page per forum.",
+    ["forum"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "bunglecat_db_query_seconds",
+    "Duration of reviewer database operations.",
+    ["model", "operation"],
+)
+DB_PRUNED_ROWS = Counter(
+    "bunglecat_db_pruned_rows_total",
+    "Review records removed by compaction.",
+    ["model"],
+)
+DB_SIZE_BYTES = Gauge(
+    "bunglecat_db_size_bytes",
+    "Size of the SQLite database measured after compaction.",
+)
+WAIT_SECONDS = Histogram(
+    "bunglecat_wait_seconds",
+    "Time spent waiting for a concurrency or rate limit slot.",
+    ["limiter"],
+)
+PUSH_DELIVERY_SECONDS = Histogram(
+    "bunglecat_push_delivery_seconds",
+    "Time from publishing a push to delivering it to a subscriber.",
+    ["kind"],
+)
+PUSH_MESSAGES = Counter(
+    "bunglecat_push_messages_total",
+    "Push messages by subscriber kind and outcome.",
+    ["kind", "result"],
+)
+WEBSOCKET_CONNECTIONS = Gauge(
+    "bunglecat_websocket_connections",
+    "Open websocket connections.",
+    ["kind"],
+)
+DELIVERY_QUEUE_DEPTH = Gauge(
+    "bunglecat_delivery_queue_depth",
+    "Messages waiting in subscriber queues.",
+    ["kind"],
+)
+
+
+@asynccontextmanager
+async def waited(limiter: asyncio.Semaphore, name: str):
+    """进入信号量并记录等待时间"""
+    start = time.perf_counter()
+    async with limiter:
+        WAIT_SECONDS.observe(time.perf_counter() - start, name)
+        yield None
+
+
+def setup_metrics(app):
+    """在主进程中创建各 worker 共享的指标目录，仅在多 worker 部署时调用"""
+    path = Path(tempfile.gettempdir()) / f"bunglecat-{os.getpid()}-metrics"
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir()
+    app.shared_ctx.metrics_dir = Array("c", str(path).encode())
+
+
+def cleanup_metrics(app):
+    metrics_dir = getattr(app.shared_ctx, "metrics_dir", None)
+    if metrics_dir is not None:
+        shutil.rmtree(metrics_dir.value.decode(), ignore_errors=True)
+
+
+class MetricsStore:
+    """
+    多 worker 部署时各 worker 定期将指标写入共享目录，抓取时由处理请求的 worker 合并
+
+    Attributes:
+        - app: 当前 worker 的应用
+        - refresh: 写入前更新瞬时指标的回调
+        - interval: 写入间隔，单位为秒
+    """
+
+    def __init__(self, app, refresh: Callable[[Any], None], interval: float = 5):
+        self.app = app
+        self.refresh = refresh
+        self.interval = interval
+        self.path: Optional[Path] = None
+        metrics_dir = getattr(app.shared_ctx, "metrics_dir", None)
+        if metrics_dir is not None:
+            self.path = Path(metrics_dir.value.decode()) / f"{os.getpid()}.json"
+
+    def write(self):
+        self.refresh(self.app)
+        if self.path is None:
+            return None
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as fp:
+            sys_json.dump(REGISTRY.dump(), fp)
+        tmp_path.replace(self.path)
+
+    async def run(self):
+        if self.path is None:
+            return None
+        while True:
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning("Failed to write metrics: %s", e)
+            await asyncio.sleep(self.interval)
+
+    def collect(self) -> str:
+        self.write()
+        if self.path is None:
+            return REGISTRY.render([REGISTRY.dump()])
+
+        dumps = []
+        for path in self.path.parent.glob("*.json"):
+            if not pid_alive(int(path.stem)):
+                path.unlink(missing_ok=True)
+                continue
+            try:
+                with open(path) as fp:
+                    dumps.append(sys_json.load(fp))
+            except (OSError, ValueError):
+                continue
+        return REGISTRY.render(dumps)
+
+    def close(self):
+        if self.path is not None:
+            self.path.unlink(missing_ok=True)
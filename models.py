@@ -1,15 +1,27 @@
+import time
+
 from tortoise import Model, fields
 
 
+def now() -> int:
+    return int(time.time())
+
+
 class Thread(Model):
     """
     记录已加入检查队列的主题贴
 
-    Notes: 有记录的主题贴不代表已经检查过，当检查过程中终止程序，可能会有主题贴未被检查
+    Notes: 有记录的主题贴不代表已经检查过，未检查完楼层的主题贴记录在 PendingThread 中
+        last_seen 为最近一次在检查范围内出现的时间，长期未出现的主题贴及其楼层会被清理
+        max_floor、max_pid 与 reply_num 为已检查到的最高楼层、其楼层id与回复数，为 0 时未知
     """
     tid = fields.BigIntField(pk=True)
     fid = fields.BigIntField()
     last_time = fields.BigIntField()
+    last_seen = fields.BigIntField(default=now, index=True)
+    max_floor = fields.IntField(default=0)
+    max_pid = fields.BigIntField(default=0)
+    reply_num = fields.IntField(default=0)
 
     class Meta:
         table = "review_thread"
@@ -17,14 +29,46 @@ class Thread(Model):
 
 class Post(Model):
     """
-    记录已加入检查队列的楼层及楼中楼
+    记录已加入检查队列的楼层
 
-    Notes: 有记录的楼层及楼中楼不代表已经检查过，当检查过程中终止程序，可能会有楼层及楼中楼未被检查
+    Notes: 有记录的楼层不代表已经检查过，未检查完楼中楼的楼层记录在 PendingPost 中
+        comment_cursor 为已检查到的最大楼中楼id，为 0 时未知；楼中楼不再单独记录，旧版本留下的楼中楼记录 ppid 不为空
     """
     pid = fields.BigIntField(pk=True)
-    tid = fields.BigIntField()
-    ppid = fields.BigIntField(null=True, default=None)
+    tid = fields.BigIntField(index=True)
+    ppid = fields.BigIntField(null=True, default=None, index=True)
     reply_num = fields.IntField(null=True, default=None)
+    comment_cursor = fields.BigIntField(default=0)
+
+    class Meta:
+        table = "review_post"
+
+
+class PendingThread(Model):
+    """
+    已更新记录但楼层尚未检查完的主题贴，检查完成后删除，启动时优先继续检查
+
+    Notes: reply_num 为加入时的回复数
+    """
+    tid = fields.BigIntField(pk=True)
+    fname = fields.CharField(max_length=64, index=True)
+    reply_num = fields.IntField(default=0)
+
+    class Meta:
+        table = "review_pending_thread"
+
+
+class PendingPost(Model):
+    """
+    已更新记录但楼中楼尚未检查完的楼层，检查完成后删除，启动时优先继续检查
+
+    Notes: reply_num 为加入时的回复数，prev_reply_num 为上次检查时的回复数，新楼层为空
+    """
+    pid = fields.BigIntField(pk=True)
+    tid = fields.BigIntField(index=True)
+    fname = fields.CharField(max_length=64, index=True)
+    reply_num = fields.IntField(default=0)
+    prev_reply_num = fields.IntField(null=True, default=None)
 
     class Meta:
-        table = "review_post"
\ No newline at end of file
+        table = "review_pending_post"
@@ -0,0 +1,196 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from sanic.log import logger
+
+from metrics import REVIEW_STAGE_ITEMS, REVIEW_STAGE_SECONDS
+
+
+class Job:
+    """
+    一次检查中尚未完成的工作项计数，工作项在产生的下一阶段工作项加入队列后才算完成
+
+    Attributes:
+        - name: 贴吧名，用于日志与各阶段的耗时指标
+        - changed: 新增或有新回复的主题贴数量
+        - failed: 获取失败或未检查完、留在待检查项中等待继续检查的主题贴与楼层数量
+        - error: 处理过程中最后一次出现的异常
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.changed = 0
+        self.failed = 0
+        self.error: Optional[Exception] = None
+        self.finished = asyncio.Event()
+        self.finished.set()
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return (self.name,)
+
+    def add(self):
+        self.items += 1
+        self.finished.clear()
+
+    def finish(self):
+        self.items -= 1
+        if self.items <= 0:
+            self.finished.set()
+
+    async def wait(self):
+        await self.finished.wait()
+
+
+class JobGroup:
+    """合并处理的多个工作项产生的下一阶段工作项，属于其中所有的 Job"""
+
+    def __init__(self, jobs: Iterable[Job]):
+        self.jobs = list(dict.fromkeys(jobs))
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return tuple(dict.fromkeys(job.name for job in self.jobs))
+
+    @property
+    def error(self) -> Optional[Exception]:
+        return next((job.error for job in self.jobs if job.error is not None), None)
+
+    @error.setter
+    def error(self, error: Exception):
+        for job in self.jobs:
+            job.error = error
+
+    def add(self):
+        for job in self.jobs:
+            job.add()
+
+    def finish(self):
+        for job in self.jobs:
+            job.finish()
+
+
+Handler = Callable[[List[Tuple[Union[Job, JobGroup], Any]]], Awaitable[Any]]
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        handler: Handler,
+        workers: int = 1,
+        queue_size: int = 100,
+        batch_size: int = 1,
+    ):
+        """
+        流水线中的一个阶段，由固定数量的 worker 从有界队列中取出工作项处理，队列满时上一阶段等待
+
+        每批的处理耗时按批中涉及的每个贴吧各记录一次
+
+        Attributes:
+            - name: 阶段名，用于日志与指标
+            - handler: 处理一批工作项的协程函数，参数为 (Job, 工作项) 组成的列表
+            - workers: worker 数量，默认值为1，类型为int
+            - queue_size: 队列容量，默认值为100，类型为int
+            - batch_size: 单次处理的最大工作项数，大于1时可合并数据库查询，默认值为1，类型为int
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(workers, 1)
+        self.batch_size = max(batch_size, 1)
+        self.queue: asyncio.Queue[Tuple[Union[Job, JobGroup], Any]] = asyncio.Queue(queue_size)
+        self.tasks: List[asyncio.Task] = []
+        self.active = 0
+        self.peak_depth = 0
+        self.peak_active = 0
+        self.processed = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+
+    async def put(self, job: Union[Job, JobGroup], item: Any):
+        job.add()
+        await self.queue.put((job, item))
+        self.peak_depth = max(self.peak_depth, self.queue.qsize())
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.tasks = [
+            loop.create_task(self.work(), name=f"review:{self.name}:{i}")
+            for i in range(self.workers)
+        ]
+
+    async def work(self):
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            self.active += len(batch)
+            self.peak_active = max(self.peak_active, self.active)
+            start = time.perf_counter()
+            try:
+                await self.handler(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Review stage %s failed: %r", self.name, e)
+                for job, _ in batch:
+                    job.error = e
+            finally:
+                elapsed = time.perf_counter() - start
+                self.busy_seconds += elapsed
+                names = dict.fromkeys(name for job, _ in batch for name in job.names)
+                for name in names:
+                    REVIEW_STAGE_SECONDS.observe(elapsed, name, self.name)
+                self.active -= len(batch)
+                self.processed += len(batch)
+                REVIEW_STAGE_ITEMS.inc(self.name, amount=len(batch))
+                for job, _ in batch:
+                    job.finish()
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "depth": self.queue.qsize(),
+            "max_depth": self.queue.maxsize,
+            "peak_depth": self.peak_depth,
+            "active": self.active,
+            "peak_active": self.peak_active,
+            "processed": self.processed,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy_seconds, 3),
+        }
+
+
+class Pipeline:
+    """按顺序连接的多个阶段，首次使用时在当前事件循环中启动各阶段的 worker"""
+
+    def __init__(self, *stages: Stage):
+        self.stages = {stage.name: stage for stage in stages}
+        self.started = False
+
+    def __getitem__(self, name: str) -> Stage:
+        return self.stages[name]
+
+    def start(self):
+        if self.started:
+            return None
+        for stage in self.stages.values():
+            stage.start()
+        self.started = True
+
+    async def close(self):
+        for stage in self.stages.values():
+            await stage.close()
+        self.started = False
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stage.status() for name, stage in self.stages.items()}
@@ -0,0 +1,214 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from aiotieba import Client
+from sanic.log import logger
+
+from custom_type import Config
+from exceptions import InvalidParameter
+from metrics import WAIT_SECONDS
+
+# 与账号身份无关的只读接口，可以分摊到池中的任意账号
+SHARED_METHODS = {
+    "get_comments",
+    "get_fid",
+    "get_fname",
+    "get_forum",
+    "get_forum_detail",
+    "get_homepage",
+    "get_image",
+    "get_image_bytes",
+    "get_last_replyers",
+    "get_member_users",
+    "get_portrait",
+    "get_posts",
+    "get_rank_forums",
+    "get_square_forums",
+    "get_tab_map",
+    "get_threads",
+    "get_user_info",
+    "get_user_posts",
+    "get_user_posts_pc",
+    "get_user_threads",
+    "hash2image",
+    "search_global",
+    "search_in_forum",
+    "tieba_uid2user_info",
+}
+
+
+class TokenBucket:
+    """
+    令牌桶限流
+
+    Attributes:
+        - rate: 每秒补充的令牌数
+        - burst: 令牌桶容量
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return None
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PoolMember:
+    """
+    池中的一个账号
+
+    Attributes:
+        - name: 账号名称
+        - client: 该账号的贴吧客户端
+        - bucket: 该账号的令牌桶，为空时不限制请求速率
+    """
+
+    def __init__(self, name: str, client: Client, rate: Optional[float], burst: int):
+        self.name = name
+        self.client = client
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.inflight = 0
+        self.calls = 0
+        self.rate_limited = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def tokens(self) -> float:
+        if self.bucket is None:
+            return float("inf")
+        self.bucket._refill()
+        return self.bucket.tokens
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.cooldown_until
+
+    @asynccontextmanager
+    async def acquire(self):
+        start = time.perf_counter()
+        delay = self.cooldown_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.bucket is not None:
+            await self.bucket.acquire()
+        WAIT_SECONDS.observe(time.perf_counter() - start, "account")
+        self.inflight += 1
+        self.calls += 1
+        try:
+            yield self.client
+        finally:
+            self.inflight -= 1
+
+    def check(self, result: Any, codes: List[int], cooldown: float):
+        """遇到贴吧的频率限制错误时让该账号冷却一段时间"""
+        err = getattr(result, "err", None)
+        if err is not None and getattr(err, "code", None) in codes:
+            self.cooldown_until = time.monotonic() + cooldown
+            self.rate_limited += 1
+            logger.warning(
+                "Account %s was rate limited (%s), cooling down for %d seconds.",
+                self.name,
+                err,
+                cooldown,
+            )
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "inflight": self.inflight,
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "cooldown": round(max(self.cooldown_until - time.monotonic(), 0), 1),
+            "tokens": round(self.tokens, 2) if self.bucket else None,
+        }
+
+
+class ClientPool:
+    """
+    多账号客户端池，只读接口按最少在途请求分摊到各账号，其余接口使用默认账号
+
+    默认账号只在配置了 default_account_rate 时限流，其他账号按 account_rate 限流
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.members: Dict[str, PoolMember] = {}
+        self.default: Optional[PoolMember] = None
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, name: str, client: Client, default: bool = False) -> PoolMember:
+        rate = self.config.default_account_rate if default else self.config.account_rate
+        member = PoolMember(name, client, rate, self.config.account_burst)
+        self.members[name] = member
+        if default or self.default is None:
+            self.default = member
+        return member
+
+    async def open(self):
+        """登录配置文件中的其他账号"""
+        for account in self.config.accounts:
+            client = await Client(account.bduss, account.stoken).__aenter__()
+            user = await client.get_self_info()
+            name = account.name or user.show_name or str(user.user_id)
+            self.add(name, client)
+            logger.info("Account %s was added to the client pool.", name)
+
+    async def close(self):
+        for member in self.members.values():
+            if member is not self.default:
+                await member.client.__aexit__()
+
+    def get(self, name: str) -> PoolMember:
+        member = self.members.get(name)
+        if member is None:
+            raise InvalidParameter(f"unknown account {name}")
+        return member
+
+    def member_of(self, client: Client) -> Optional[PoolMember]:
+        for member in self.members.values():
+            if member.client is client:
+                return member
+        return None
+
+    def pick(self, method: str, client: Optional[Client] = None) -> Optional[PoolMember]:
+        """
+        为一次调用选择账号
+        Args:
+            method: aiotieba 方法名
+            client: 调用方指定的客户端，为空时由池选择
+        """
+        if client is not None:
+            return self.member_of(client)
+        if method not in SHARED_METHODS or len(self.members) <= 1:
+            return self.default
+        members = [member for member in self.members.values() if member.available]
+        if not members:
+            return min(self.members.values(), key=lambda m: m.cooldown_until)
+        return min(members, key=lambda m: (m.inflight, -m.tokens))
+
+    async def call(self, member: PoolMember, method: str, args=(), kwargs=None):
+        async with member.acquire() as client:
+            result = await getattr(client, method)(*(args or ()), **(kwargs or {}))
+        member.check(
+            result, self.config.rate_limit_codes, self.config.account_cooldown
+        )
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        return {name: member.status() for name, member in self.members.items()}
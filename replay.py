@@ -0,0 +1,240 @@
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_right
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from sanic.log import logger
+
+from filters import Topic
+from serializer import Payload
+
+# 记录头为序号、写入时间、筛选依据与消息的长度
+_RECORD = struct.Struct("!QdII")
+_SUFFIX = ".seg"
+
+
+def iter_records(buffer: Any, offset: int = 0) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    遍历分段中完整的记录，遇到写入中断的记录时停止
+    Returns:
+        Iterator[Tuple[int, int, int, int]]: 序号、筛选依据的起止位置、消息的结束位置
+    """
+    size = len(buffer)
+    while offset + _RECORD.size <= size:
+        seq, _, topic_size, data_size = _RECORD.unpack_from(buffer, offset)
+        topic_start = offset + _RECORD.size
+        data_start = topic_start + topic_size
+        end = data_start + data_size
+        if end > size:
+            break
+        yield seq, topic_start, data_start, end
+        offset = end
+
+
+def buffer_size(path: Path) -> int:
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+class ReplayLog:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 4 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        max_age: int = 24 * 3600,
+    ):
+        """
+        按序号追加推送消息的分段日志，断线重连的订阅者可从中补发错过的消息
+
+        只由巡查 worker 写入，各 worker 通过 mmap 读取，分段文件名为其中第一条消息的序号
+
+        Attributes:
+            - directory: 分段所在的目录，多 worker 部署时共享
+            - segment_bytes: 单个分段的大小，写满后开始新的分段，默认值为4MiB，类型为int
+            - max_bytes: 所有分段的大小上限，超出后删除最旧的分段，默认值为256MiB，类型为int
+            - max_age: 分段最后写入后保留的时间，默认值为86400秒，类型为int
+        """
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.file: Optional[BinaryIO] = None
+        self.file_size = 0
+        self.last_seq = 0
+        self.next_prune = 0.0
+        self._maps: Dict[Path, mmap.mmap] = {}
+        self.appended = 0
+        self.replayed = 0
+        self.pruned = 0
+        self.errors = 0
+
+    def segments(self) -> List[Tuple[int, Path]]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            (int(name[: -len(_SUFFIX)]), self.directory / name)
+            for name in names
+            if name.endswith(_SUFFIX) and name[: -len(_SUFFIX)].isdigit()
+        )
+
+    def first_seq(self) -> Optional[int]:
+        """最旧的可补发消息的序号，日志为空时为空"""
+        for first, path in self.segments():
+            buffer = self._map(path)
+            if buffer is not None:
+                for seq, *_ in iter_records(buffer):
+                    return seq
+        return None
+
+    def open(self) -> int:
+        """
+        成为写入者，截断最后一个分段中写入中断的记录
+        Returns:
+            int: 日志中最后一条消息的序号，日志为空时为0
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        segments = self.segments()
+        if segments:
+            first, path = segments[-1]
+            data = path.read_bytes()
+            self.last_seq, end = first - 1, 0
+            for seq, _, _, end in iter_records(data):
+                self.last_seq = seq
+            if end < len(data):
+                logger.warning("Truncated %d bytes of an interrupted record in %s.", len(data) - end, path)
+                os.truncate(path, end)
+            self.file = open(path, "ab", buffering=0)
+            self.file_size = end
+        self.prune()
+        logger.info("Replay log %s opened at seq %d.", self.directory, self.last_seq)
+        return self.last_seq
+
+    def append(self, payload: Payload):
+        """写入一条已分配序号的消息，写入失败时只记录日志，不影响实时推送"""
+        topic = payload.topic.pack() if payload.topic else b""
+        record = _RECORD.pack(payload.seq, time.time(), len(topic), len(payload.data)) + topic + payload.data
+        try:
+            if self.file is None or self.file_size >= self.segment_bytes:
+                self.rotate(payload.seq)
+            # 整条记录一次写入，读取者不会看到不完整的记录头
+            self.file.write(record)
+        except OSError as e:
+            self.errors += 1
+            logger.warning("Failed to append push %d to the replay log: %s", payload.seq, e)
+            return None
+        self.file_size += len(record)
+        self.last_seq = payload.seq
+        self.appended += 1
+        if time.monotonic() >= self.next_prune:
+            self.prune()
+
+    def rotate(self, seq: int):
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.directory / f"{seq:020d}{_SUFFIX}", "ab", buffering=0)
+        self.file_size = 0
+        self.prune()
+
+    def prune(self):
+        """删除超出大小上限或过期的分段，正在写入的分段总是保留"""
+        self.next_prune = time.monotonic() + 60
+        segments = []
+        for _, path in self.segments():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            segments.append((path, stat.st_size, stat.st_mtime))
+        total = sum(size for _, size, _ in segments)
+        cutoff = time.time() - self.max_age
+        for path, size, mtime in segments[:-1]:
+            if total <= self.max_bytes and mtime >= cutoff:
+                break
+            path.unlink(missing_ok=True)
+            self._unmap(path)
+            total -= size
+            self.pruned += 1
+            logger.info("Removed replay log segment %s.", path.name)
+
+    def read(self, after: int, limit: int) -> List[Payload]:
+        """
+        读取序号大于 after 的消息
+        Args:
+            after: 订阅者已收到的最后一条消息的序号
+            limit: 最多读取的消息数量
+        """
+        segments = self.segments()
+        for path in self._maps.keys() - {path for _, path in segments}:
+            self._unmap(path)
+        # 从可能包含 after 之后第一条消息的分段开始
+        start = max(bisect_right([first for first, _ in segments], after + 1) - 1, 0)
+        batch: List[Payload] = []
+        for _, path in segments[start:]:
+            buffer = self._map(path)
+            if buffer is None:
+                continue
+            for seq, topic_start, data_start, end in iter_records(buffer):
+                if seq <= after:
+                    continue
+                topic = buffer[topic_start:data_start]
+                batch.append(Payload(buffer[data_start:end], Topic.unpack(topic) if topic else None, seq))
+                if len(batch) >= limit:
+                    self.replayed += len(batch)
+                    return batch
+        self.replayed += len(batch)
+        return batch
+
+    def _map(self, path: Path) -> Optional[mmap.mmap]:
+        """映射分段文件，正在写入的分段变大后重新映射"""
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            self._unmap(path)
+            return None
+        buffer = self._maps.get(path)
+        if buffer is not None and len(buffer) == size:
+            return buffer
+        self._unmap(path)
+        if not size:
+            return None
+        try:
+            with open(path, "rb") as fp:
+                buffer = mmap.mmap(fp.fileno(), size, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
+        self._maps[path] = buffer
+        return buffer
+
+    def _unmap(self, path: Path):
+        buffer = self._maps.pop(path, None)
+        if buffer is not None:
+            buffer.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        for path in list(self._maps):
+            self._unmap(path)
+
+    def status(self) -> Dict[str, Any]:
+        segments = self.segments()
+        return {
+            "directory": str(self.directory),
+            "segments": len(segments),
+            "bytes": sum(buffer_size(path) for _, path in segments),
+            "first_seq": self.first_seq(),
+            "last_seq": self.last_seq,
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "pruned": self.pruned,
+            "errors": self.errors,
+        }
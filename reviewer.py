@@ -1,17 +1,71 @@
 import asyncio
-import json as sys_json
-from typing import Any, List, Literal, Optional, Union
+import logging
+import time
+from contextvars import ContextVar
+from functools import partial
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Literal,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
-from aiohttp import ClientConnectorError
 from aiotieba import Account, Client, PostSortType
 from aiotieba.typing import Comment, Comments, Post, Posts, Thread, Threads
 from pydantic import BaseModel
 from sanic.log import logger
+from tortoise import Model
 
+from cache import MISSING, LRUCache
 from custom_type import ApiType, App
+from db import Compactor, WriteBuffer, delete_records, field_value, save_records
+from filters import Topic
+from metrics import (
+    AIOTIEBA_CALL_ERRORS,
+    AIOTIEBA_CALL_SECONDS,
+    DB_QUERY_SECONDS,
+    REVIEW_STAGE_SECONDS,
+    waited,
+)
+from models import PendingPost, PendingThread
 from models import Post as PostRecord
 from models import Thread as ThreadRecord
-from utils import union_ws_send
+from pipeline import Job, JobGroup, Pipeline, Stage
+from pool import ClientPool, PoolMember
+from serializer import Payload
+
+# 主题贴记录中保存的检查进度: 最高楼层、其楼层id与回复数
+MARK_FIELDS = ("max_floor", "max_pid", "reply_num")
+POST_PAGE_SIZE = 30
+COMMENT_PAGE_SIZE = 30
+
+
+class ResumedThread(NamedTuple):
+    """从 PendingThread 恢复的主题贴，只包含检查楼层所需的字段"""
+
+    tid: int
+    reply_num: int
+
+
+class ResumedPost(NamedTuple):
+    """从 PendingPost 恢复的楼层，只包含检查楼中楼所需的字段"""
+
+    tid: int
+    pid: int
+    reply_num: int
+    comments: Tuple[Comment, ...] = ()
+
+
+_current_member: ContextVar[Optional[PoolMember]] = ContextVar(
+    "current_member", default=None
+)
 
 
 class Reviewer:
@@ -22,215 +76,931 @@ class Reviewer:
         max_request: int = 8,
         wait_time: int = 30,
         account: Account = Account(),
+        cache_size: int = 100_000,
+        min_wait_time: int = 5,
+        max_wait_time: int = 300,
+        busy_threshold: int = 5,
+        max_thread_pages: int = 3,
+        forum_max_thread_pages: Optional[dict[str, int]] = None,
+        churn_grow: float = 0.2,
+        churn_shrink: float = 0.05,
+        pool: Optional[ClientPool] = None,
+        writer: Optional[WriteBuffer] = None,
+        seen_interval: int = 3600,
+        retention: int = 0,
+        max_post_pages: int = 5,
+        max_comment_pages: int = 10,
+        fetch_workers: int = 8,
+        queue_size: int = 100,
+        diff_batch: int = 50,
     ):
         """
+        主题贴、楼层与楼中楼依次经过获取与对比阶段，各阶段由固定数量的 worker 处理，阶段之间为有界队列
+
         Attributes:
             - app: App对象，类型为App
             - fname_list: 贴吧名列表，类型为List[str]
             - max_request: 最大并发请求量，默认值为8，类型为int
             - wait_time: 最长等待时间，默认值为30秒，类型为int
             - account: 账户信息，默认为Account类的一个实例，类型为Account
+            - cache_size: 已检查主题贴及楼层缓存的最大条目数，默认值为100000，类型为int
+            - min_wait_time: 繁忙贴吧的最短检查间隔，默认值为5秒，类型为int
+            - max_wait_time: 冷清贴吧的最长检查间隔，默认值为300秒，类型为int
+            - busy_threshold: 一次检查中有变化的主题贴达到该数量时视为繁忙，默认值为5，类型为int
+            - max_thread_pages: 每个贴吧一次检查最多并发获取的主题贴列表页数，默认值为3，类型为int
+            - forum_max_thread_pages: 按贴吧名覆盖 max_thread_pages，类型为dict[str, int]
+            - churn_grow: 最后一页中有变化的主题贴比例达到该值时增加一页，默认值为0.2，类型为float
+            - churn_shrink: 最后一页中有变化的主题贴比例不超过该值时减少一页，默认值为0.05，类型为float
+            - pool: 客户端池，不为空时各贴吧按顺序分配到池中的账号，否则使用account创建的客户端
+            - writer: 检查记录的延迟写入缓冲区，为空时每次检查后直接写入数据库
+            - seen_interval: 未变化的主题贴更新最近出现时间的最短间隔，默认值为3600秒，类型为int
+            - retention: 检查记录的保留时间，大于0时没有记录且在保留时间之前创建的内容视为已清理的旧内容，只记录不推送，默认值为0，类型为int
+            - max_post_pages: 每个主题贴一次检查最多倒序获取的楼层页数，默认值为5，类型为int
+            - max_comment_pages: 每个楼层一次检查最多获取的楼中楼页数，默认值为10，类型为int
+            - fetch_workers: 每个获取阶段的 worker 数量，默认值为8，类型为int
+            - queue_size: 每个阶段的队列容量，默认值为100，类型为int
+            - diff_batch: 对比阶段单次合并处理的最大工作项数，默认值为50，类型为int
         """
         self.app = app
         self.client = Client(account=account)
         self.semaphore = asyncio.Semaphore(max_request)
+        self.pool = pool
+        self.writer = writer
+        self.members: dict[str, PoolMember] = {}
+        if pool:
+            members = list(pool.members.values())
+            self.members = {
+                fname: members[i % len(members)] for i, fname in enumerate(fname_list)
+            }
         self.fname_list = fname_list
         self.wait_time = wait_time
+        self.min_wait_time = min(min_wait_time, wait_time)
+        self.max_wait_time = max(max_wait_time, wait_time)
+        self.busy_threshold = busy_threshold
+        self.max_thread_pages = max(max_thread_pages, 1)
+        self.forum_max_thread_pages = forum_max_thread_pages or {}
+        self.churn_grow = churn_grow
+        self.churn_shrink = churn_shrink
+        self.schedules = {
+            fname: ForumSchedule(fname=fname, interval=wait_time)
+            for fname in fname_list
+        }
+        self.thread_cache: LRUCache[int, int] = LRUCache(cache_size)
+        self.post_cache: LRUCache[int, Optional[int]] = LRUCache(cache_size)
+        self.seen_interval = seen_interval
+        self.retention = retention
+        self.thread_seen: LRUCache[int, int] = LRUCache(cache_size)
+        self.thread_marks: LRUCache[int, Tuple[int, int, int]] = LRUCache(cache_size)
+        self.max_post_pages = max(max_post_pages, 1)
+        self.comment_cursors: LRUCache[int, int] = LRUCache(cache_size)
+        self.max_comment_pages = max(max_comment_pages, 1)
+        self.resumed = {"threads": 0, "posts": 0}
+        self.pipeline = Pipeline(
+            Stage("list_threads", self._list_threads, fetch_workers, queue_size),
+            Stage("diff_threads", self._diff_threads, 1, queue_size, diff_batch),
+            Stage("fetch_posts", self._fetch_posts, fetch_workers, queue_size),
+            Stage("diff_posts", self._diff_posts, 1, queue_size, diff_batch),
+            Stage("fetch_comments", self._fetch_comments, fetch_workers, queue_size),
+            Stage("diff_comments", self._diff_comments, 1, queue_size, diff_batch),
+            # 只有一个 worker，推送与写入按加入的顺序执行
+            Stage("emit", self._emit, 1, queue_size, diff_batch),
+        )
+
+    async def warm_cache(self):
+        """从数据库中载入最近的记录预热缓存，记录能全部放入缓存时未命中的查询将不再访问数据库"""
+        for cache, model, key, field in (
+            (self.thread_cache, ThreadRecord, "tid", "last_time"),
+            (self.thread_marks, ThreadRecord, "tid", MARK_FIELDS),
+            (self.post_cache, PostRecord, "pid", "reply_num"),
+            (self.comment_cursors, PostRecord, "pid", "comment_cursor"),
+        ):
+            fields = (field,) if isinstance(field, str) else field
+            rows = (
+                await model.all()
+                .order_by(f"-{key}")
+                .limit(cache.max_size + 1)
+                .values_list(key, *fields)
+            )
+            cache.clear()
+            cache.update(
+                (row[0], row[1] if isinstance(field, str) else tuple(row[1:]))
+                for row in rows
+            )
+            cache.complete = len(cache) < cache.max_size
+        logger.info(
+            "Reviewer cache warmed with %d threads and %d posts.",
+            len(self.thread_cache),
+            len(self.post_cache),
+        )
+
+    def announce_cutoff(self) -> int:
+        """
+        没有记录且在该时间之前创建的内容可能已被清理，重新出现时只记录不推送
+        Returns:
+            int: 时间戳，不清理记录时为0
+        """
+        return int(time.time()) - self.retention if self.retention else 0
+
+    def forget(self, tids: List[int], pids: List[int]):
+        """
+        清除已从数据库删除的记录，重新出现时按新记录插入，由 announce_cutoff 判断是否推送
+        Args:
+            tids: 已删除的主题贴 id
+            pids: 已删除的楼层 id
+        """
+        for cache in (self.thread_cache, self.thread_seen, self.thread_marks):
+            cache.discard(tids)
+        for cache in (self.post_cache, self.comment_cursors):
+            cache.discard(pids)
+
+    def status(self):
+        return {
+            "forums": {
+                fname: schedule.model_dump()
+                for fname, schedule in self.schedules.items()
+            },
+            "thread_cache": self.thread_cache.stats(),
+            "post_cache": self.post_cache.stats(),
+            "writer": self.writer.status() if self.writer else None,
+            "resumed": self.resumed,
+            "pipeline": self.pipeline.status(),
+        }
 
     async def start_review(self):
-        count = 0
-        async with self.client:
-            while True:
-                for fname in self.fname_list:
-                    try:
-                        await self.check_threads(fname)
-                    except Exception as e:
-                        logger.warning(e)
-                    await asyncio.sleep(3)
-
-                count += 1
-                logger.debug(
-                    "The %dth review loop has ended, waiting for %d seconds before the next loop.",
-                    count,
-                    self.wait_time,
+        await self.warm_cache()
+        self.pipeline.start()
+        try:
+            async with self.client:
+                await asyncio.gather(
+                    *[
+                        self.review_forum(
+                            fname, self.wait_time * i / len(self.fname_list)
+                        )
+                        for i, fname in enumerate(self.fname_list)
+                    ]
                 )
-                await asyncio.sleep(self.wait_time)
+        finally:
+            await self.pipeline.close()
 
-    async def check_threads(self, fname: str):
+    async def request(self, method: str, *args, **kwargs):
         """
-        检查主题贴的内容
+        在并发请求量限制下调用当前贴吧所分配账号的接口
+        Args:
+            method: aiotieba 方法名
+        """
+        member = _current_member.get()
+        async with waited(self.semaphore, "reviewer"):
+            try:
+                with AIOTIEBA_CALL_SECONDS.time(method, "reviewer"):
+                    if member is None:
+                        result = await getattr(self.client, method)(*args, **kwargs)
+                    else:
+                        result = await self.pool.call(member, method, args, kwargs)
+            except Exception as e:
+                AIOTIEBA_CALL_ERRORS.inc(method, "reviewer", type(e).__name__)
+                raise
+        if getattr(result, "err", None) is not None:
+            AIOTIEBA_CALL_ERRORS.inc(method, "reviewer", type(result.err).__name__)
+        return result
+
+    async def review_forum(self, fname: str, delay: float = 0):
+        """
+        按各自的间隔循环检查单个贴吧，所有贴吧共享同一个检查流水线与并发请求量
         Args:
-            client: 传入了执行账号的贴吧客户端
             fname: 贴吧名
+            delay: 首次检查前的等待时间，用于错开各贴吧的请求
+        """
+        schedule = self.schedules[fname]
+        await asyncio.sleep(delay)
+        # 启动时及检查出错后先继续未完成的检查
+        pending = True
+        while True:
+            schedule.failed = 0
+            if pending:
+                try:
+                    await self.resume(fname)
+                except Exception as e:
+                    logger.warning("Failed to resume pending work of %s: %s", fname, e)
+                pending = False
+            try:
+                changed = await self.review(fname)
+            except Exception as e:
+                logger.warning(e)
+                changed = 0
+                pending = True
+            # 获取失败的主题贴与楼层仍在待检查项中，下一轮先重试
+            if schedule.failed:
+                pending = True
 
+            schedule.loops += 1
+            schedule.changed = changed
+            schedule.last_review = time.time()
+            if changed >= self.busy_threshold:
+                schedule.interval = max(schedule.interval / 2, self.min_wait_time)
+            elif changed == 0:
+                schedule.interval = min(schedule.interval * 2, self.max_wait_time)
+
+            logger.debug(
+                "The %dth review loop of %s has ended with %d changed threads, "
+                "waiting for %.1f seconds before the next loop.",
+                schedule.loops,
+                fname,
+                changed,
+                schedule.interval,
+            )
+            await asyncio.sleep(schedule.interval)
+
+    async def review(self, fname: str) -> int:
         """
-        async with self.semaphore:
-            first_threads: Threads = await self.client.get_threads(fname)
+        将贴吧加入检查流水线，等待其主题贴、楼层和楼中楼全部检查完毕
+        Args:
+            fname: 贴吧名
 
-        will_check_child: List[Thread] = []
+        Returns:
+            int: 新增或有新回复的主题贴数量
+        """
+        self.pipeline.start()
+        job = Job(fname)
+        with REVIEW_STAGE_SECONDS.time(fname, "review"):
+            await self.pipeline["list_threads"].put(job, fname)
+            await job.wait()
+        self.schedules[fname].failed += job.failed
+        if job.error is not None:
+            raise job.error
+        return job.changed
 
-        async def check_last_time(_thread: Thread):
-            if _thread.is_livepost:
-                return None
-            prev_thread = await ThreadRecord.filter(tid=_thread.tid).get_or_none()
-            if prev_thread:
-                if _thread.last_time < prev_thread.last_time:
-                    await ThreadRecord.filter(tid=_thread.tid).update(
-                        last_time=_thread.last_time
-                    )
-                elif _thread.last_time > prev_thread.last_time:
-                    will_check_child.append(_thread)
-                    await ThreadRecord.filter(tid=_thread.tid).update(
-                        last_time=_thread.last_time
+    async def resume(self, fname: str):
+        """
+        继续上次运行或上次检查中断时未完成的检查，已推送的内容有记录，不会重复推送
+        Args:
+            fname: 贴吧名
+        """
+        # 写入尚在缓冲区中的待检查项
+        if self.writer:
+            await self.writer.flush()
+        job = Job(fname)
+        threads = [
+            (job, fname, ResumedThread(tid, reply_num))
+            for tid, reply_num in await PendingThread.filter(fname=fname).values_list(
+                "tid", "reply_num"
+            )
+        ]
+        posts = [
+            (job, fname, ResumedPost(tid, pid, reply_num), prev_reply_num)
+            for pid, tid, reply_num, prev_reply_num in await PendingPost.filter(
+                fname=fname
+            ).values_list("pid", "tid", "reply_num", "prev_reply_num")
+        ]
+        if not threads and not posts:
+            return None
+        logger.info(
+            "Resuming %d threads and %d posts of %s left pending.",
+            len(threads),
+            len(posts),
+            fname,
+        )
+        self.resumed["threads"] += len(threads)
+        self.resumed["posts"] += len(posts)
+        self.pipeline.start()
+        with REVIEW_STAGE_SECONDS.time(fname, "resume"):
+            await self.submit_threads(threads)
+            await self.submit_posts(posts)
+            await job.wait()
+        self.schedules[fname].failed += job.failed
+        if job.error is not None:
+            raise job.error
+
+    async def _list_threads(self, batch: List[Tuple[Job, str]]):
+        for job, fname in batch:
+            _current_member.set(self.members.get(fname))
+            pages: List[Threads] = await asyncio.gather(
+                *[
+                    self.request("get_threads", fname, pn)
+                    for pn in range(1, self.schedules[fname].pages + 1)
+                ]
+            )
+            await self.pipeline["diff_threads"].put(job, (fname, pages))
+
+    async def _diff_threads(self, batch: List[Tuple[Job, Tuple[str, List[Threads]]]]):
+        """对比主题贴的最后回复时间，推送新主题贴，新增或有新回复的主题贴进入楼层检查"""
+        # 并发翻页时被回复的主题贴可能出现在多页中，按最先出现的页计算
+        threads: dict[int, Tuple[Job, str, int, Thread, int]] = {}
+        churn: dict[str, ChurnCounter] = {}
+        for job, (fname, pages) in batch:
+            schedule = self.schedules[fname]
+            churn[fname] = ChurnCounter(len(pages), schedule.scanned_pages)
+            # 获取失败的页不含吧信息，从成功获取的页中取吧 id 并记录下来
+            schedule.fid = next(
+                (
+                    page.forum.fid
+                    for page in pages
+                    if page.err is None and page.forum.fid
+                ),
+                schedule.fid,
+            )
+            for pn, page in enumerate(pages, 1):
+                for thread in page:
+                    if not thread.is_livepost:
+                        threads.setdefault(
+                            thread.tid, (job, fname, schedule.fid, thread, pn)
+                        )
+        try:
+            await self.diff_threads(batch, threads, churn)
+            for counter in churn.values():
+                counter.complete = True
+        finally:
+            for _, (fname, pages) in batch:
+                self.adapt_depth(fname, pages, churn[fname])
+
+    async def diff_threads(
+        self,
+        batch: List[Tuple[Job, Any]],
+        threads: dict[int, Tuple[Job, str, int, Thread, int]],
+        churn: dict[str, "ChurnCounter"],
+    ):
+        if not threads:
+            return None
+        prev_last_time = await self.lookup(
+            self.thread_cache, ThreadRecord, "tid", "last_time", threads
+        )
+
+        now = int(time.time())
+        cutoff = self.announce_cutoff()
+        will_check_child: List[Tuple[Job, str, Thread]] = []
+        pushes: List[Tuple[Thread, str]] = []
+        new_records: List[ThreadRecord] = []
+        changed_records: List[ThreadRecord] = []
+        for job, fname, fid, thread, pn in threads.values():
+            last_time = prev_last_time.get(thread.tid, MISSING)
+            churn[fname].count(
+                pn,
+                last_time is MISSING or thread.last_time > last_time,
+                last_time is MISSING,
+            )
+            if last_time is not MISSING:
+                # 未变化的主题贴也需要定期更新最近出现时间，以免被清理
+                if (
+                    thread.last_time == last_time
+                    and now - self.thread_seen.get(thread.tid, 0) < self.seen_interval
+                ):
+                    continue
+                if thread.last_time > last_time:
+                    will_check_child.append((job, fname, thread))
+                changed_records.append(
+                    ThreadRecord(
+                        tid=thread.tid, last_time=thread.last_time, last_seen=now
                     )
+                )
             else:
-                self.send_to(_thread, "thread")
+                if not created_before(thread, cutoff):
+                    pushes.append((thread, "thread"))
 
-                will_check_child.append(_thread)
-                await ThreadRecord.create(
-                    tid=_thread.tid,
-                    fid=await self.client.get_fid(fname),
-                    last_time=_thread.last_time,
+                will_check_child.append((job, fname, thread))
+                new_records.append(
+                    ThreadRecord(
+                        tid=thread.tid,
+                        fid=fid,
+                        last_time=thread.last_time,
+                        last_seen=now,
+                    )
                 )
 
-        await asyncio.gather(*[check_last_time(thread) for thread in first_threads])
+        self.thread_cache.update(
+            (thread.tid, thread.last_time) for _, _, _, thread, _ in threads.values()
+        )
+        self.thread_seen.update(
+            (record.tid, now) for record in (*new_records, *changed_records)
+        )
+        self.thread_marks.update((record.tid, (0, 0, 0)) for record in new_records)
+        for job, _, _ in will_check_child:
+            job.changed += 1
 
-        await asyncio.gather(*[
-            self.check_posts(thread.tid) for thread in will_check_child
-        ])
+        # 待检查的主题贴与主题贴记录一起写入，记录更新后中断时下次启动可继续检查楼层
+        await self.commit(
+            batch,
+            pushes,
+            [
+                partial(
+                    self.save,
+                    PendingThread,
+                    [
+                        PendingThread(
+                            tid=thread.tid, fname=fname, reply_num=thread.reply_num
+                        )
+                        for _, fname, thread in will_check_child
+                    ],
+                ),
+                partial(
+                    self.save,
+                    ThreadRecord,
+                    new_records,
+                    changed_records,
+                    ["last_time", "last_seen"],
+                ),
+            ],
+        )
+        await self.submit_threads(will_check_child)
 
-    async def check_posts(self, tid: int):
+    def adapt_depth(self, fname: str, pages: List[Threads], churn: "ChurnCounter"):
         """
-        检查楼层内容
+        按最后两页中有变化的主题贴比例调整下次检查的主题贴列表页数
+
+        最后一页仍有较多变化时，两次检查之间可能有主题贴被挤出检查范围，增加一页；
+        最后一页几乎没有变化且倒数第二页变化也不多时减少一页，避免在两个页数之间反复切换
         Args:
-            client: 传入了执行账号的贴吧客户端
-            tid: 所在主题贴id
-        """
-        async with self.semaphore:
-            last_posts: Posts = await self.client.get_posts(
-                tid,
-                pn=0xFFFF,
-                sort=PostSortType.DESC,
-                with_comments=True,
-                comment_rn=10,
-            )
-
-        if last_posts and last_posts[-1].floor != 1:
-            last_floor = last_posts[0].floor
-            need_rn = last_floor - len(last_posts)
-            if need_rn > 0:
-                post_set = set(last_posts.objs)
-                rn_clamp = 30
-                if need_rn <= rn_clamp:
-                    async with self.semaphore:
-                        first_posts = await self.client.get_posts(
-                            tid, rn=need_rn, with_comments=True, comment_rn=10
-                        )
+            fname: 贴吧名
+            pages: 本次获取的各页主题贴列表
+            churn: 本次检查中各页有变化的主题贴数量
+        """
+        schedule = self.schedules[fname]
+        schedule.scanned_pages = len(pages)
+        if not churn.complete or pages[-1].err is not None:
+            return None
+        depth = len(pages)
+        max_pages = max(
+            self.forum_max_thread_pages.get(fname, self.max_thread_pages), 1
+        )
+        schedule.churn = churn.ratio(depth)
+        if schedule.churn >= self.churn_grow and pages[-1].page.has_more:
+            schedule.pages = depth + 1
+        elif (
+            schedule.churn <= self.churn_shrink
+            and churn.ratio(depth - 1) < self.churn_grow
+        ):
+            schedule.pages = depth - 1
+        schedule.pages = min(max(schedule.pages, 1), max_pages)
 
-                    post_set.update(first_posts.objs)
-                else:
-                    async with self.semaphore:
-                        first_posts = await self.client.get_posts(
-                            tid, rn=rn_clamp, with_comments=True, comment_rn=10
-                        )
+    async def submit_threads(
+        self, threads: List[Tuple[Job, str, Union[Thread, ResumedThread]]]
+    ):
+        """查询检查进度后将主题贴加入楼层检查"""
+        if not threads:
+            return None
+        marks = await self.lookup(
+            self.thread_marks,
+            ThreadRecord,
+            "tid",
+            MARK_FIELDS,
+            (thread.tid for _, _, thread in threads),
+        )
+        for job, fname, thread in threads:
+            await self.pipeline["fetch_posts"].put(
+                job, (fname, thread, marks.get(thread.tid))
+            )
+
+    async def _fetch_posts(
+        self,
+        batch: List[Tuple[Job, Tuple[str, Thread, Optional[Tuple[int, int, int]]]]],
+    ):
+        for job, (fname, thread, mark) in batch:
+            _current_member.set(self.members.get(fname))
+            posts, new_mark, failed = await self.fetch_posts(thread, mark)
+            await self.pipeline["diff_posts"].put(
+                job, (fname, thread, posts, mark, new_mark, failed)
+            )
 
-                    post_set.update(first_posts.objs)
+    async def fetch_posts(
+        self, thread: Union[Thread, ResumedThread], mark: Optional[Tuple[int, int, int]]
+    ) -> Tuple[List[Post], Optional[Tuple[int, int, int]], bool]:
+        """
+        从最新的楼层开始倒序翻页，直到翻过上次检查到的最高楼层或达到页数上限
+
+        回复数没有变化时主题贴的变化来自楼中楼，此时额外获取热门楼层
+        Args:
+            thread: 主题贴
+            mark: 上次检查到的最高楼层、其楼层id与回复数，未知时为空
 
-                    async with self.semaphore:
-                        hot_posts = await self.client.get_posts(
-                            tid,
-                            sort=PostSortType.HOT,
-                            with_comments=True,
-                            comment_rn=10,
+        Returns:
+            Tuple[List[Post], Optional[Tuple[int, int, int]], bool]: 获取到的楼层、新的检查进度及是否有页面获取失败，
+                有页面获取失败时进度为空，主题贴留在待检查项中重新获取
+        """
+        max_floor, _, reply_num = mark or (0, 0, 0)
+        kwargs = {"sort": PostSortType.DESC, "with_comments": True, "comment_rn": 10}
+        pages: List[Posts] = [
+            await self.request("get_posts", thread.tid, 1, rn=POST_PAGE_SIZE, **kwargs)
+        ]
+        if pages[0].objs:
+            # 楼层号连续递增，删除的楼层只会使实际需要的页数更少
+            lowest = min(post.floor for post in pages[0].objs)
+            need_pages = -(-(lowest - 1 - max_floor) // POST_PAGE_SIZE)
+            need_pages = min(need_pages, self.max_post_pages - 1)
+            pages.extend(
+                await asyncio.gather(
+                    *[
+                        self.request(
+                            "get_posts", thread.tid, pn, rn=POST_PAGE_SIZE, **kwargs
                         )
+                        for pn in range(2, need_pages + 2)
+                    ]
+                )
+            )
+            if max_floor and thread.reply_num == reply_num:
+                pages.append(
+                    await self.request(
+                        "get_posts",
+                        thread.tid,
+                        sort=PostSortType.HOT,
+                        with_comments=True,
+                        comment_rn=10,
+                    )
+                )
 
-                    post_set.update(hot_posts.objs)
-                posts = list(post_set)
-            else:
-                posts = last_posts.objs
-        else:
-            posts = last_posts.objs
+        posts = {post.pid: post for page in pages for post in page.objs}
+        failed = any(getattr(page, "err", None) is not None for page in pages)
+        if not posts or failed:
+            return list(posts.values()), None, failed
+        top = max(posts.values(), key=lambda post: post.floor)
+        if top.floor < max_floor:
+            return list(posts.values()), None, False
+        return list(posts.values()), (top.floor, top.pid, thread.reply_num), False
 
-        will_check_child: List[Post] = []
+    async def _diff_posts(
+        self, batch: List[Tuple[Job, Tuple[str, Thread, List[Post], Any, Any, bool]]]
+    ):
+        """
+        对比楼层的回复数，推送新楼层，新增或有新回复的楼层进入楼中楼检查，
+        楼层全部获取成功后从待检查的主题贴中移除，否则留待重试
+        """
+        posts: dict[int, Tuple[Job, str, Post, int]] = {}
+        mark_records: List[ThreadRecord] = []
+        finished: List[int] = []
+        for job, (fname, thread, thread_posts, mark, new_mark, failed) in batch:
+            if failed:
+                job.failed += 1
+            else:
+                finished.append(thread.tid)
+            posts.update(
+                (post.pid, (job, fname, post, thread.tid)) for post in thread_posts
+            )
+            if new_mark is not None and new_mark != mark:
+                mark_records.append(
+                    ThreadRecord(tid=thread.tid, **dict(zip(MARK_FIELDS, new_mark)))
+                )
+        self.thread_marks.update(
+            (record.tid, field_value(record, MARK_FIELDS)) for record in mark_records
+        )
+        prev_reply_num = {}
+        if posts:
+            prev_reply_num = await self.lookup(
+                self.post_cache, PostRecord, "pid", "reply_num", posts
+            )
 
-        async def check_reply_num(_post: Post):
-            prev_post = await PostRecord.filter(pid=_post.pid).get_or_none()
-            if prev_post:
-                if _post.reply_num < prev_post.reply_num:
-                    await PostRecord.filter(pid=_post.pid).update(
-                        reply_num=_post.reply_num
-                    )
-                elif _post.reply_num > prev_post.reply_num:
-                    will_check_child.append(_post)
-                    await PostRecord.filter(pid=_post.pid).update(
-                        reply_num=_post.reply_num
-                    )
+        cutoff = self.announce_cutoff()
+        will_check_child: List[Tuple[Job, str, Post, Optional[int]]] = []
+        pushes: List[Tuple[Post, str]] = []
+        new_records: List[PostRecord] = []
+        changed_records: List[PostRecord] = []
+        for job, fname, post, tid in posts.values():
+            reply_num = prev_reply_num.get(post.pid, MISSING)
+            if reply_num is not MISSING:
+                if post.reply_num == reply_num:
+                    continue
+                if reply_num is None or post.reply_num > reply_num:
+                    will_check_child.append((job, fname, post, reply_num))
+                changed_records.append(
+                    PostRecord(pid=post.pid, reply_num=post.reply_num)
+                )
             else:
-                self.send_to(_post, "post")
+                if not created_before(post, cutoff):
+                    pushes.append((post, "post"))
 
-                will_check_child.append(_post)
-                await PostRecord.create(
-                    pid=_post.pid, tid=tid, reply_num=_post.reply_num
+                will_check_child.append((job, fname, post, None))
+                new_records.append(
+                    PostRecord(pid=post.pid, tid=tid, reply_num=post.reply_num)
                 )
 
-        await asyncio.gather(*[check_reply_num(post) for post in posts])
+        self.post_cache.update(
+            (post.pid, post.reply_num) for _, _, post, _ in posts.values()
+        )
+        self.comment_cursors.update((record.pid, 0) for record in new_records)
 
-        await asyncio.gather(*[self.check_comment(post) for post in will_check_child])
+        await self.commit(
+            batch,
+            pushes,
+            [
+                partial(self.save, ThreadRecord, [], mark_records, list(MARK_FIELDS)),
+                partial(
+                    self.save,
+                    PendingPost,
+                    [
+                        PendingPost(
+                            pid=post.pid,
+                            tid=post.tid,
+                            fname=fname,
+                            reply_num=post.reply_num,
+                            prev_reply_num=reply_num,
+                        )
+                        for _, fname, post, reply_num in will_check_child
+                    ],
+                ),
+                partial(
+                    self.save, PostRecord, new_records, changed_records, ["reply_num"]
+                ),
+                partial(self.done, PendingThread, finished),
+            ],
+        )
+        await self.submit_posts(will_check_child)
 
-    async def check_comment(self, post: Post):
+    async def submit_posts(
+        self, posts: List[Tuple[Job, str, Union[Post, ResumedPost], Optional[int]]]
+    ):
+        """查询楼中楼游标后将楼层加入楼中楼检查"""
+        if not posts:
+            return None
+        cursors = await self.lookup(
+            self.comment_cursors,
+            PostRecord,
+            "pid",
+            "comment_cursor",
+            (post.pid for _, _, post, _ in posts),
+        )
+        for job, fname, post, reply_num in posts:
+            await self.pipeline["fetch_comments"].put(
+                job, (fname, post, reply_num, cursors.get(post.pid, 0))
+            )
+
+    async def _fetch_comments(
+        self, batch: List[Tuple[Job, Tuple[str, Post, Optional[int], int]]]
+    ):
+        for job, (fname, post, reply_num, cursor) in batch:
+            _current_member.set(self.members.get(fname))
+            comments, new_cursor, checked = await self.fetch_comments(
+                post, reply_num, cursor
+            )
+            await self.pipeline["diff_comments"].put(
+                job, (post, comments, cursor, new_cursor, checked)
+            )
+
+    async def fetch_comments(
+        self, post: Post, reply_num: Optional[int], cursor: int
+    ) -> Tuple[List[Comment], int, Optional[int]]:
         """
-        检查楼中楼内容
+        获取楼层中上次检查后新增的楼中楼
+
+        楼中楼按时间正序分页，只获取上次检查到的位置之后的页，并以上次检查到的最大楼中楼id为游标筛选新增的楼中楼，
+        游标未知时按楼中楼楼层筛选
+
+        只使用从起始页开始连续获取成功的页，遇到获取失败的页或达到页数上限时，游标只前进到已使用的页，
+        其后的页在下次检查时从该位置继续获取
         Args:
-            client: 传入了执行账号的贴吧客户端
             post: 楼层
+            reply_num: 上次检查时的回复数，新楼层为空
+            cursor: 上次检查到的最大楼中楼id，未知时为0
+
+        Returns:
+            Tuple[List[Comment], int, Optional[int]]: 新增的楼中楼、新的游标，
+                以及未检查完时下次继续检查的起始回复数，检查完毕时为空
         """
+        comments: dict[int, Comment] = {
+            comment.pid: comment for comment in post.comments
+        }
+        checked = None
+        if post.reply_num > len(post.comments):
+            first_page = (reply_num or 0) // COMMENT_PAGE_SIZE + 1
+            total_pages = (post.reply_num - 1) // COMMENT_PAGE_SIZE + 1
+            last_page = min(total_pages, first_page + self.max_comment_pages - 1)
+            pages: List[Comments] = await asyncio.gather(
+                *[
+                    self.request("get_comments", post.tid, post.pid, pn=pn)
+                    for pn in range(first_page, last_page + 1)
+                ]
+            )
+            done_page = first_page - 1
+            for page in pages:
+                if getattr(page, "err", None) is not None:
+                    break
+                comments.update((comment.pid, comment) for comment in page.objs)
+                done_page += 1
+            if done_page < total_pages:
+                checked = max(reply_num or 0, done_page * COMMENT_PAGE_SIZE)
 
-        if post.reply_num > 10 or (
-            len(post.comments) != post.reply_num and post.reply_num <= 10
-        ):
-            async with self.semaphore:
-                last_comments: Comments = await self.client.get_comments(
-                    post.tid, post.pid, pn=post.reply_num // 30 + 1
+        if cursor:
+            new_comments = [
+                comment for comment in comments.values() if comment.pid > cursor
+            ]
+        elif reply_num:
+            new_comments = [
+                comment for comment in comments.values() if comment.floor > reply_num
+            ]
+        else:
+            new_comments = list(comments.values())
+        if not comments:
+            return new_comments, cursor, checked
+        return new_comments, max(cursor, *comments), checked
+
+    async def _diff_comments(
+        self,
+        batch: List[Tuple[Job, Tuple[Post, List[Comment], int, int, Optional[int]]]],
+    ):
+        """
+        推送新楼中楼并保存游标，检查完毕后从待检查的楼层中移除，
+        否则记录下次继续检查的位置，留待重试
+        """
+        cutoff = self.announce_cutoff()
+        pushes: List[Tuple[Comment, str]] = []
+        changed_records: List[PostRecord] = []
+        unfinished: List[PendingPost] = []
+        finished: List[int] = []
+        for job, (post, comments, cursor, new_cursor, checked) in batch:
+            if checked is not None:
+                job.failed += 1
+                unfinished.append(PendingPost(pid=post.pid, prev_reply_num=checked))
+            else:
+                finished.append(post.pid)
+            pushes.extend(
+                (comment, "comment")
+                for comment in comments
+                if not created_before(comment, cutoff)
+            )
+            if new_cursor != cursor:
+                changed_records.append(
+                    PostRecord(pid=post.pid, comment_cursor=new_cursor)
                 )
+        self.comment_cursors.update(
+            (record.pid, record.comment_cursor) for record in changed_records
+        )
+        await self.commit(
+            batch,
+            pushes,
+            [
+                partial(self.save, PostRecord, [], changed_records, ["comment_cursor"]),
+                partial(self.save, PendingPost, [], unfinished, ["prev_reply_num"]),
+                partial(self.done, PendingPost, finished),
+            ],
+        )
 
-            comment_set = set(post.comments)
-            comment_set.update(last_comments.objs)
-            comments = list(comment_set)
-        else:
-            comments = post.comments
+    async def commit(
+        self,
+        batch: List[Tuple[Job, Any]],
+        pushes: List[Tuple[Union[Thread, Post, Comment], str]],
+        writes: List[Callable[[], Awaitable[Any]]],
+    ):
+        """
+        将一批工作项的推送与记录写入交给唯一的 emit worker，保证先推送后写入，且按加入的顺序写入
+        Args:
+            batch: 产生推送与写入的工作项
+            pushes: 需要推送的内容及其类型
+            writes: 依次执行的写入
+        """
+        await self.pipeline["emit"].put(
+            JobGroup(job for job, _ in batch), (pushes, writes)
+        )
 
-        async def check_comment_of_db(_comment: Comment):
-            prev_comment = await PostRecord.filter(pid=_comment.pid).get_or_none()
-            if not prev_comment:
-                self.send_to(_comment, "comment")
+    async def _emit(
+        self, batch: List[Tuple[JobGroup, Tuple[List[Tuple[Any, str]], List[Callable]]]]
+    ):
+        for _, (pushes, writes) in batch:
+            for context, ctx_type in pushes:
+                self.send_to(context, ctx_type)
+            for write in writes:
+                await write()
 
-                await PostRecord.create(
-                    pid=_comment.pid, tid=_comment.tid, ppid=post.pid
-                )
+    async def lookup(
+        self,
+        cache: LRUCache,
+        model: Type[Model],
+        key: str,
+        field: Union[str, Tuple[str, ...]],
+        ids: Iterable[int],
+    ) -> dict[int, Any]:
+        """
+        查询记录中已保存的字段值，优先使用缓存，未命中时再批量查询数据库
+        Args:
+            cache: 对应的缓存
+            model: 记录对应的模型
+            key: 主键字段名
+            field: 需要查询的字段名，为元组时查询多个字段的值组成的元组
+            ids: 需要查询的主键
+        Returns:
+            dict[int, Any]: 已有记录的主键到字段值的映射，不包含不存在的记录
+        """
+        values: dict[int, Any] = {}
+        missed: List[int] = []
+        for _id in ids:
+            value = cache.get(_id)
+            if value is MISSING:
+                missed.append(_id)
+            else:
+                values[_id] = value
+        if missed and self.writer:
+            pending = self.writer.lookup(model, field, missed)
+            if pending:
+                values.update(pending)
+                missed = [_id for _id in missed if _id not in pending]
+        if missed and not cache.complete:
+            for record in await filter_records(model, key, missed):
+                value = field_value(record, field)
+                values[getattr(record, key)] = value
+                cache.set(getattr(record, key), value)
+        return values
 
-        await asyncio.gather(*[check_comment_of_db(comment) for comment in comments])
+    async def save(
+        self,
+        model: Type[Model],
+        new_records: List[Model],
+        changed_records: Optional[List[Model]] = None,
+        fields: Optional[List[str]] = None,
+    ):
+        if self.writer:
+            await self.writer.add(model, new_records, changed_records, fields)
+        else:
+            await save_records(model, new_records, changed_records, fields)
+
+    async def done(self, model: Type[Model], ids: List[int]):
+        """从待检查的主题贴或楼层中移除已完成的项"""
+        if not ids:
+            return None
+        if self.writer:
+            await self.writer.delete(model, ids)
+        else:
+            await delete_records(model, ids)
 
     def send_to(self, context: Union[Thread, Post, Comment], ctx_type: str = "unknown"):
-        result = PushMessage(
+        topic = Topic.of(context, ctx_type)
+        if not self.app.ctx.fanout.wants(topic):
+            return None
+        payload = PushMessage(
             push_type="message",
             msg_type=ctx_type,
             data=context,
-        ).model_dump(exclude_none=True)
-        result = sys_json.dumps(result)
+        ).encode(topic)
 
-        logger.debug("send %s", result)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("send %s", payload.text)
 
-        for ws in self.app.ctx.ws_connections:
-            self.app.add_task(union_ws_send(ws, result))
+        self.app.ctx.fanout.publish(payload)
 
-        for http_url in self.app.ctx.config.http_callback_url:
-            self.app.add_task(self._post_send(http_url, result))
-    
-    async def _post_send(self, url: str, data):
-        try:
-            await self.app.ctx.http_session.post(url, json=data)
-        except ClientConnectorError:
-            logger.warning("post send to %s failed", url)
+
+async def filter_records(
+    model: Type[Model], key: str, ids: Iterable[int], chunk_size: int = 500
+) -> List[Model]:
+    """
+    按主键批量查询已存在的记录，为避免超出 SQLite 的变量上限会分块查询
+    Args:
+        model: 记录对应的模型
+        key: 主键字段名
+        ids: 需要查询的主键
+        chunk_size: 每次查询的主键数量
+    """
+    ids = list(ids)
+    records: List[Model] = []
+    with DB_QUERY_SECONDS.time(model.__name__, "select"):
+        for i in range(0, len(ids), chunk_size):
+            records.extend(
+                await model.filter(**{f"{key}__in": ids[i : i + chunk_size]})
+            )
+    return records
+
+
+def created_before(context: Union[Thread, Post, Comment], cutoff: int) -> bool:
+    """创建时间未知时视为新内容"""
+    return 0 < context.create_time < cutoff
+
+
+class ChurnCounter:
+    """
+    一次检查中各页主题贴列表里新增或有新回复的主题贴数量
+
+    上次检查未获取的页中没有记录的主题贴可能只是从未见过，不计为变化
+
+    Attributes:
+        - scanned_pages: 上次检查获取的页数
+        - sizes: 各页的主题贴数量
+        - changed: 各页有变化的主题贴数量
+        - complete: 对比是否完成，对比出错时不据此调整页数
+    """
+
+    __slots__ = ("scanned_pages", "sizes", "changed", "complete")
+
+    def __init__(self, pages: int, scanned_pages: int):
+        self.scanned_pages = scanned_pages
+        self.sizes = [0] * pages
+        self.changed = [0] * pages
+        self.complete = False
+
+    def count(self, pn: int, changed: bool, new: bool):
+        self.sizes[pn - 1] += 1
+        if changed and not (new and pn > self.scanned_pages):
+            self.changed[pn - 1] += 1
+
+    def ratio(self, pn: int) -> float:
+        """第 pn 页中有变化的主题贴比例，页码为0或该页为空时为0"""
+        if pn < 1 or not self.sizes[pn - 1]:
+            return 0.0
+        return self.changed[pn - 1] / self.sizes[pn - 1]
+
+
+class ForumSchedule(BaseModel):
+    fname: str
+    interval: float
+    changed: int = 0
+    loops: int = 0
+    last_review: Optional[float] = None
+    failed: int = 0
+    fid: int = 0
+    pages: int = 1
+    scanned_pages: int = 0
+    churn: float = 0
 
 
 class PushMessage(BaseModel):
@@ -239,6 +1009,12 @@ class PushMessage(BaseModel):
     event_type: Optional[str] = None
     data: Any = None
 
+    def encode(self, topic: Optional[Topic] = None) -> Payload:
+        return Payload.encode(
+            {key: value for key, value in self.__dict__.items() if value is not None},
+            topic,
+        )
+
 
 def create_reviewers(app: App):
     if (
@@ -246,9 +1022,38 @@ def create_reviewers(app: App):
         or ApiType.HTTP_CALLBACK in app.config.API_TYPE
         or ApiType.REVERSE_WS in app.config.API_TYPE
     ):
-        task = app.add_task(
-            Reviewer(app, app.ctx.config.fnames).start_review(),
-            name="reviewer",
+        app.ctx.writer = WriteBuffer(
+            app.ctx.config.db_write_batch, app.ctx.config.db_flush_ms
+        )
+        app.ctx.tasks.append(app.add_task(app.ctx.writer.run(), name="review-writer"))
+        app.ctx.reviewer = Reviewer(
+            app,
+            app.ctx.config.fnames,
+            wait_time=app.ctx.config.review_wait_time,
+            cache_size=app.ctx.config.review_cache_size,
+            min_wait_time=app.ctx.config.review_min_wait_time,
+            max_wait_time=app.ctx.config.review_max_wait_time,
+            pool=app.ctx.pool if app.ctx.config.accounts else None,
+            writer=app.ctx.writer,
+            max_post_pages=app.ctx.config.review_max_post_pages,
+            max_comment_pages=app.ctx.config.review_max_comment_pages,
+            fetch_workers=app.ctx.config.review_fetch_workers,
+            queue_size=app.ctx.config.review_queue_size,
+            diff_batch=app.ctx.config.review_diff_batch,
+            retention=app.ctx.config.db_retention,
+            max_thread_pages=app.ctx.config.review_max_thread_pages,
+            forum_max_thread_pages=app.ctx.config.review_forum_max_thread_pages,
         )
+        if app.ctx.config.db_retention:
+            app.ctx.compactor = Compactor(
+                app.ctx.config.db_retention,
+                app.ctx.config.db_compact_interval,
+                app.ctx.config.db_compact_batch,
+                on_prune=app.ctx.reviewer.forget,
+            )
+            app.ctx.tasks.append(
+                app.add_task(app.ctx.compactor.run(), name="compactor")
+            )
+        task = app.add_task(app.ctx.reviewer.start_review(), name="reviewer")
         logger.info("Reviewer task %s was created.", task.get_name())
         return task
@@ -1,18 +1,46 @@
+import asyncio
 import json as sys_json
-from typing import Any, Optional
+import time
+from typing import Any, List, Optional
 
-from aiohttp import WSMessage
+from aiohttp import ClientWebSocketResponse, WSMessage, WSMsgType
 from aiotieba import Client
-from sanic import Blueprint, Websocket
+from pydantic import ValidationError
+from sanic import Blueprint, NotFound, Websocket, text
 from sanic.log import logger
 from sanic_ext.extensions.openapi import openapi
+from sanic_ext.extensions.openapi.builders import SpecificationBuilder
 
+from cache import ResponseCache
 from config import load_env_config
-from custom_type import ApiType, App, Request, Result
+from custom_type import ApiType, App, PushFilter, Request, Result, WireFormat
+from delivery import WebsocketSubscriber
 from exceptions import AioTiebaException, InvalidParameter
-from utils import get_aiotieba_methods, inject_bot, union_ws_send
+from metrics import (
+    AIOTIEBA_CALL_ERRORS,
+    AIOTIEBA_CALL_SECONDS,
+    DELIVERY_QUEUE_DEPTH,
+    REVIEW_INTERVAL_SECONDS,
+    REVIEW_QUEUE_DEPTH,
+    REVIEW_THREAD_CHURN,
+    REVIEW_THREAD_PAGES,
+    WAIT_SECONDS,
+    WEBSOCKET_CONNECTIONS,
+    waited,
+)
+from pool import SHARED_METHODS, ClientPool
+from serializer import msgpack, unpackb
+from utils import (
+    get_aiotieba_methods,
+    inject_bot,
+    load_aiotieba_paths,
+    union_ws_send,
+)
+from validator import compile_validators
 
 env_config = load_env_config("BC_")
+# 反向 WebSocket 按优先顺序提供的子协议，未安装 msgpack 时只提供 json
+WIRE_SUBPROTOCOLS = [WireFormat.MSGPACK, WireFormat.JSON] if msgpack else [WireFormat.JSON]
 index = Blueprint("index")
 aiotieba_bp = Blueprint("aiotieba", url_prefix="/aiotieba")
 group = Blueprint.group(
@@ -22,100 +50,381 @@ group = Blueprint.group(
 
 
 async def call_aiotieba(
-    _name: str, bot: Client, _args=(), _kwargs: Optional[dict[str, Any]] = None
+    _name: str,
+    bot: Optional[Client],
+    _args=(),
+    _kwargs: Optional[dict[str, Any]] = None,
+    cache: Optional[ResponseCache] = None,
+    pool: Optional[ClientPool] = None,
 ):
-    bot.del_bawu()
-    method = getattr(bot, _name)
-    if _args or _kwargs:
-        result = await method(*_args, **_kwargs)
-    else:
-        result = await method()
-    if getattr(result, "err", None) is not None:
-        if isinstance(result.err, TypeError):
-            raise InvalidParameter(str(result.err))
-        else:
-            raise AioTiebaException(result.err)
-    return Result(data=result.__dict__)
+    """
+    调用 aiotieba 接口
+    Args:
+        _name: 方法名
+        bot: 指定的客户端，为空时由客户端池选择账号
+        _args: 位置参数
+        _kwargs: 关键字参数
+        cache: 响应缓存
+        pool: 客户端池
+    """
+    try:
+        _args, _kwargs = validators[_name].bind(_args, _kwargs)
+    except InvalidParameter:
+        AIOTIEBA_CALL_ERRORS.inc(_name, "api", "InvalidParameter")
+        raise
+    member = pool.pick(_name, bot) if pool else None
+
+    async def call():
+        try:
+            with AIOTIEBA_CALL_SECONDS.time(_name, "api"):
+                if member is None:
+                    method = getattr(bot, _name)
+                    result = await method(*(_args or ()), **(_kwargs or {}))
+                else:
+                    result = await pool.call(member, _name, _args, _kwargs)
+        except Exception as e:
+            AIOTIEBA_CALL_ERRORS.inc(_name, "api", type(e).__name__)
+            raise
+        if getattr(result, "err", None) is not None:
+            AIOTIEBA_CALL_ERRORS.inc(_name, "api", type(result.err).__name__)
+            if isinstance(result.err, TypeError):
+                raise InvalidParameter(str(result.err))
+            else:
+                raise AioTiebaException(result.err)
+        return Result(data=result.__dict__)
+
+    if cache is None:
+        return await call()
+    # 与账号相关的接口按账号分别缓存
+    scope = None if _name in SHARED_METHODS or member is None else member.name
+    return await cache.call(
+        _name, _args, _kwargs, call, lambda result: len(result.encode()), scope
+    )
 
 
 funcs = get_aiotieba_methods(Client)
+validators = compile_validators(funcs)
+
+
+@openapi.exclude()
+@inject_bot()
+async def http_call(request: Request, bot: Optional[Client], name: str):
+    if name not in funcs:
+        raise NotFound(f"unknown aiotieba method {name}")
+    data: dict[str, Any] = request.json or {}
+    result = await call_aiotieba(
+        name,
+        bot,
+        data.get("args", ()),
+        data.get("kwargs", {}),
+        request.app.ctx.api_cache,
+        request.app.ctx.pool,
+    )
+    return result.to_http()
+
+
+def register_aiotieba_openapi(app: App):
+    SpecificationBuilder().raw(
+        {"paths": load_aiotieba_paths(funcs, aiotieba_bp.url_prefix)}
+    )
 
 
 if ApiType.HTTP in env_config.API_TYPE:
-    for func_name, func in funcs.items():
-
-        @openapi.description(func.__doc__)
-        @inject_bot()
-        async def http_call(request: Request, bot: Client):
-            data: dict[str, Any] = request.json
-            name = request.name.split(".")[2]
-            result = await call_aiotieba(
-                name, bot, *data.get("args", []), **data.get("kwargs", {})
-            )
-            return result.to_http()
-
-        aiotieba_bp.add_route(
-            http_call,
-            f"/{func_name}",
-            ["POST"],
-            name=func_name,
-            unquote=True,
+    aiotieba_bp.before_server_start(register_aiotieba_openapi)
+    aiotieba_bp.add_route(
+        http_call,
+        "/<name:str>",
+        ["POST"],
+        name="call",
+        unquote=True,
+    )
+
+
+def _batch_calls(app: App, bot: Optional[Client], calls: Any, url="unknown") -> List[asyncio.Task]:
+    """
+    并发执行多个 aiotieba 调用，返回按输入顺序排列的任务
+    Args:
+        calls: 由 {action, args, kwargs} 组成的列表
+    Returns:
+        List[asyncio.Task]: 每个任务的结果为 (序号, Result)
+    """
+    if not isinstance(calls, list):
+        raise InvalidParameter("calls must be a list")
+    if len(calls) > app.ctx.config.batch_max_calls:
+        raise InvalidParameter(
+            f"too many calls, the limit is {app.ctx.config.batch_max_calls}"
         )
+    semaphore = asyncio.Semaphore(app.ctx.config.batch_max_concurrency)
 
+    async def run(index: int, call: Any):
+        async with waited(semaphore, "batch"):
+            try:
+                if not isinstance(call, dict):
+                    raise InvalidParameter("call must be an object")
+                action = str(call.get("action", "")).removeprefix("aiotieba.")
+                if action not in funcs:
+                    raise InvalidParameter(f"unknown action {action}")
+                result = await call_aiotieba(
+                    action,
+                    bot,
+                    call.get("args", ()),
+                    call.get("kwargs", {}),
+                    app.ctx.api_cache,
+                    app.ctx.pool,
+                )
+            except Exception as e:
+                result = Result.from_exception(app, url, e)
+        return index, result
 
-async def _websocket_call(app: App, ws: Websocket, bot: Client, url="unknown"):
-    app.ctx.ws_connections.append(ws)
+    return [asyncio.create_task(run(i, call)) for i, call in enumerate(calls)]
+
+
+def _parse_batch(data: Any) -> tuple[Any, bool]:
+    if isinstance(data, list):
+        return data, False
+    if isinstance(data, dict):
+        return data.get("calls"), bool(data.get("stream", False))
+    raise InvalidParameter("JSON format error")
+
+
+@openapi.description(
+    "批量调用 aiotieba 接口，请求体为 {calls: [{action, args, kwargs}], stream}，"
+    "按输入顺序返回每个调用的结果；stream 为真时以 NDJSON 按完成顺序返回，每行带有 index"
+)
+@inject_bot()
+async def batch_call(request: Request, bot: Optional[Client]):
+    calls, stream = _parse_batch(request.json)
+    tasks = _batch_calls(request.app, bot, calls, request.url)
     try:
-        async for msg in ws:
+        if not stream:
+            results = await asyncio.gather(*tasks)
+            return Result.from_results([result for _, result in results]).to_http()
+
+        response = await request.respond(content_type="application/x-ndjson")
+        for future in asyncio.as_completed(tasks):
+            index, result = await future
+            await response.send(result.encode_with(index=index) + b"\n")
+        await response.eof()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+if ApiType.HTTP in env_config.API_TYPE:
+    aiotieba_bp.add_route(batch_call, "/batch", ["POST"], name="batch")
+
+
+async def _websocket_batch(
+    app: App,
+    ws: Websocket,
+    bot: Optional[Client],
+    data: dict,
+    url="unknown",
+    wire_format: WireFormat = WireFormat.JSON,
+):
+    calls, stream = _parse_batch(data)
+    echo = data.get("echo", None)
+    tasks = _batch_calls(app, bot, calls, url)
+    try:
+        if not stream:
+            results = await asyncio.gather(*tasks)
+            return Result.from_results([result for _, result in results])
+
+        for future in asyncio.as_completed(tasks):
+            index, result = await future
+            await union_ws_send(ws, result.to_ws(echo, wire_format, index=index))
+        return Result(data={"count": len(tasks)})
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def _websocket_subscribe(
+    app: App, subscriber: Optional[WebsocketSubscriber], data: dict
+) -> Result:
+    """替换当前连接的推送过滤规则，filters 为空时接收所有消息"""
+    if subscriber is None:
+        raise InvalidParameter("push is not available on this connection")
+    filters = data.get("filters") or []
+    if not isinstance(filters, list):
+        raise InvalidParameter("filters must be a list")
+    try:
+        filters = [PushFilter.model_validate(item) for item in filters]
+    except ValidationError as e:
+        raise InvalidParameter(str(e))
+    app.ctx.delivery.set_filters(subscriber, filters)
+    return Result(data={"filters": len(filters)})
+
+
+def parse_seq(value: Any) -> int:
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        raise InvalidParameter("seq must be an integer")
+    if seq < 0:
+        raise InvalidParameter("seq must not be negative")
+    return seq
+
+
+def _websocket_resume(
+    app: App, subscriber: Optional[WebsocketSubscriber], seq: Any
+) -> Result:
+    """从回放日志补发序号大于 seq 的推送消息，之后继续推送实时消息"""
+    if subscriber is None:
+        raise InvalidParameter("push is not available on this connection")
+    if app.ctx.delivery.replay is None:
+        raise InvalidParameter("replay log is not enabled")
+    return Result(data=app.ctx.delivery.resume(subscriber, parse_seq(seq)))
+
+
+def parse_wire_format(value: Any) -> WireFormat:
+    try:
+        wire_format = WireFormat(value)
+    except ValueError:
+        raise InvalidParameter(f"unknown format {value}")
+    if wire_format == WireFormat.MSGPACK and msgpack is None:
+        raise InvalidParameter("msgpack is not installed")
+    return wire_format
+
+
+async def _websocket_handle(
+    app: App,
+    ws: Websocket,
+    bot: Optional[Client],
+    msg: str | bytes,
+    url="unknown",
+    subscriber: Optional[WebsocketSubscriber] = None,
+):
+    echo = None
+    # 以二进制帧发送 MessagePack 请求时总是以 MessagePack 返回
+    wire_format = subscriber.wire_format if subscriber else WireFormat.JSON
+    try:
+        logger.debug("Websocket receive: %s", msg)
+
+        if isinstance(msg, bytes):
+            wire_format = parse_wire_format(WireFormat.MSGPACK)
             try:
-                if isinstance(msg, WSMessage):
-                    msg = str(msg.data)
+                data = unpackb(msg)
+            except Exception:
+                raise InvalidParameter("binary msg must be msgpack")
+        else:
+            data = sys_json.loads(msg)
+        if not isinstance(data, dict):
+            raise InvalidParameter("msg must be an object")
+        echo = data.get("echo", None)
+        action = data.get("action", None)
+        if action:
+            action = action.split(".")
+        else:
+            raise InvalidParameter("JSON format error")
+        if action[0] == "get_server_status":
+            result = await _get_server_status(app)
 
-                logger.debug("Websocket receive: %s", msg)
+        elif action[0] == "batch":
+            result = await _websocket_batch(app, ws, bot, data, url, wire_format)
 
-                data: dict = sys_json.loads(msg)
-                action = data.get("action", None)
-                if action:
-                    action = action.split(".")
-                else:
-                    raise InvalidParameter("JSON format error")
-                if action[0] == "get_server_status":
-                    result = await _get_server_status(app)
-
-                elif action[0] == "aiotieba":
-                    if action[1] in funcs.keys():
-                        result = await call_aiotieba(
-                            action[1], bot, data.get("args", ()), data.get("kwargs", {})
-                        )
-                    else:
-                        result = Result(status="failed", msg=f"unknown action {action}")
+        elif action[0] == "set_format":
+            wire_format = parse_wire_format(data.get("format"))
+            if subscriber:
+                subscriber.wire_format = wire_format
+            result = Result(data={"format": wire_format})
 
-                else:
-                    result = Result(status="failed", msg=f"unknown action {action}")
-            except sys_json.JSONDecodeError:
-                result = Result(
-                    status="failed",
-                    retcode=500,
-                    msg="invalid json",
-                    description="msg must be json",
+        elif action[0] == "subscribe":
+            result = _websocket_subscribe(app, subscriber, data)
+
+        elif action[0] == "resume":
+            result = _websocket_resume(app, subscriber, data.get("seq"))
+
+        elif action[0] == "aiotieba":
+            if action[1] in funcs.keys():
+                result = await call_aiotieba(
+                    action[1],
+                    bot,
+                    data.get("args", ()),
+                    data.get("kwargs", {}),
+                    app.ctx.api_cache,
+                    app.ctx.pool,
                 )
+            else:
+                result = Result(status="failed", msg=f"unknown action {action}")
 
-            except Exception as e:
-                result = Result.from_exception(app, url, e)
+        else:
+            result = Result(status="failed", msg=f"unknown action {action}")
+    except sys_json.JSONDecodeError:
+        result = Result(
+            status="failed",
+            retcode=500,
+            msg="invalid json",
+            description="msg must be json",
+        )
+
+    except Exception as e:
+        result = Result.from_exception(app, url, e)
+
+    await union_ws_send(ws, result.to_ws(echo, wire_format))
+
+
+async def _websocket_call(
+    app: App,
+    ws: Websocket,
+    bot: Optional[Client],
+    url="unknown",
+    wire_format: WireFormat = WireFormat.JSON,
+    since: Optional[int] = None,
+):
+    app.ctx.ws_connections.append(ws)
+    subscriber = app.ctx.delivery.add_websocket(ws, url, wire_format)
+    if since is not None and app.ctx.delivery.replay is not None:
+        app.ctx.delivery.resume(subscriber, since)
+    semaphore = asyncio.Semaphore(app.ctx.config.ws_max_inflight)
+    tasks: set[asyncio.Task] = set()
+
+    def on_done(task: asyncio.Task):
+        tasks.discard(task)
+        semaphore.release()
+        if not task.cancelled() and task.exception():
+            logger.debug(task.exception())
+
+    try:
+        async for msg in ws:
+            if isinstance(msg, WSMessage):
+                if msg.type == WSMsgType.ERROR:
+                    break
+                msg = msg.data if msg.type == WSMsgType.BINARY else str(msg.data)
 
-            data = result.to_ws()
-            await union_ws_send(ws, data)
+            # 达到单连接并发上限时暂停读取，请求会在完成后乱序返回
+            start = time.perf_counter()
+            await semaphore.acquire()
+            WAIT_SECONDS.observe(time.perf_counter() - start, "websocket")
+            task = asyncio.create_task(
+                _websocket_handle(app, ws, bot, msg, url, subscriber)
+            )
+            tasks.add(task)
+            task.add_done_callback(on_done)
     except Exception as e:
         logger.debug(e)
     finally:
+        for task in list(tasks):
+            task.cancel()
+        await app.ctx.delivery.remove(subscriber)
         await ws.close()
 
     app.ctx.ws_connections.remove(ws)
 
 
 @inject_bot()
-async def websocket_call(request: Request, ws: Websocket, bot: Client):
-    await _websocket_call(request.app, ws, bot, request.url)
+async def websocket_call(request: Request, ws: Websocket, bot: Optional[Client]):
+    """
+    可通过查询参数 format=msgpack 或 set_format 动作使用 MessagePack，
+    重新连接时可通过查询参数 since 或 resume 动作补发断线期间的推送消息
+    """
+    wire_format = WireFormat.JSON
+    if request.args.get("format") == WireFormat.MSGPACK:
+        wire_format = parse_wire_format(WireFormat.MSGPACK)
+    since = request.args.get("since")
+    if since is not None:
+        since = parse_seq(since)
+    await _websocket_call(request.app, ws, bot, request.url, wire_format, since)
 
 
 if ApiType.WS in env_config.API_TYPE:
@@ -126,15 +435,70 @@ if ApiType.WS in env_config.API_TYPE:
 
 
 async def _get_server_status(app: App):
-    status = app.m.workers
+    try:
+        status = {"workers": app.m.workers}
+    except AttributeError:
+        # 单进程运行时没有 worker 管理器
+        status = {"workers": {}}
+    if app.ctx.fanout:
+        status["fanout"] = app.ctx.fanout.status()
+    if app.ctx.reviewer:
+        status["reviewer"] = app.ctx.reviewer.status()
+    if app.ctx.compactor:
+        status["compactor"] = app.ctx.compactor.status()
+    if app.ctx.reverse_ws:
+        status["reverse_ws"] = [ws.status() for ws in app.ctx.reverse_ws]
+    if app.ctx.delivery:
+        status["delivery"] = app.ctx.delivery.status()
+        if app.ctx.delivery.replay:
+            status["replay"] = app.ctx.delivery.replay.status()
+    if app.ctx.api_cache:
+        status["api_cache"] = app.ctx.api_cache.status()
+    if app.ctx.pool:
+        status["pool"] = app.ctx.pool.status()
     return Result(data=status)
 
 
 async def get_server_status(request: Request):
-    result = await _get_server_status(request)
+    result = await _get_server_status(request.app)
     return result.to_http()
 
 
+def refresh_gauges(app: App):
+    """更新瞬时指标，在写入或抓取指标前调用"""
+    WEBSOCKET_CONNECTIONS.clear()
+    reverse = sum(1 for ws in app.ctx.ws_connections if isinstance(ws, ClientWebSocketResponse))
+    WEBSOCKET_CONNECTIONS.set(len(app.ctx.ws_connections) - reverse, "ws")
+    WEBSOCKET_CONNECTIONS.set(reverse, "reverse-ws")
+
+    DELIVERY_QUEUE_DEPTH.clear()
+    if app.ctx.delivery:
+        depth: dict[str, int] = {}
+        for subscriber in app.ctx.delivery.subscribers:
+            depth[subscriber.kind] = depth.get(subscriber.kind, 0) + subscriber.queue.qsize()
+        for kind, value in depth.items():
+            DELIVERY_QUEUE_DEPTH.set(value, kind)
+
+    REVIEW_INTERVAL_SECONDS.clear()
+    REVIEW_QUEUE_DEPTH.clear()
+    REVIEW_THREAD_PAGES.clear()
+    REVIEW_THREAD_CHURN.clear()
+    if app.ctx.reviewer:
+        for fname, schedule in app.ctx.reviewer.schedules.items():
+            REVIEW_INTERVAL_SECONDS.set(schedule.interval, fname)
+            REVIEW_THREAD_PAGES.set(schedule.pages, fname)
+            REVIEW_THREAD_CHURN.set(schedule.churn, fname)
+        for name, stage in app.ctx.reviewer.pipeline.stages.items():
+            REVIEW_QUEUE_DEPTH.set(stage.queue.qsize(), name)
+
+
+async def get_metrics(request: Request):
+    return text(
+        request.app.ctx.metrics.collect(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
 index.add_route(
     get_server_status,
     "get_server_status",
@@ -142,3 +506,4 @@ index.add_route(
     name="status",
     unquote=True,
 )
+index.add_route(get_metrics, "metrics", ["GET"], name="metrics")
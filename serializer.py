@@ -0,0 +1,194 @@
+import dataclasses
+import json as sys_json
+import time
+from datetime import datetime
+from enum import Enum
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+import yarl
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from filters import Topic
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+_extractors: Dict[type, Callable[[Any], Any]] = {}
+
+
+def _identity(obj):
+    return obj
+
+
+def _compile(cls: type) -> Callable[[Any], Any]:
+    """为类型生成并缓存一个转换为 JSON 基础类型的函数"""
+    if issubclass(cls, Enum):
+        extract = lambda obj: obj.value  # noqa: E731
+    elif cls in (str, int, float, bool, type(None)):
+        extract = _identity
+    elif issubclass(cls, bool):
+        extract = bool
+    elif issubclass(cls, int):
+        extract = int
+    elif issubclass(cls, float):
+        extract = float
+    elif issubclass(cls, str):
+        extract = str
+    elif dataclasses.is_dataclass(cls):
+        names = tuple(field.name for field in dataclasses.fields(cls))
+
+        def extract(obj):
+            return {name: to_builtins(getattr(obj, name)) for name in names}
+    elif issubclass(cls, (list, tuple, set, frozenset)):
+        extract = lambda obj: [to_builtins(item) for item in obj]  # noqa: E731
+    elif issubclass(cls, dict):
+        extract = lambda obj: {  # noqa: E731
+            str(key): to_builtins(value) for key, value in obj.items()
+        }
+    elif issubclass(cls, datetime):
+        extract = lambda obj: int(obj.timestamp() * 1000)  # noqa: E731
+    elif issubclass(cls, BaseModel):
+        extract = lambda obj: to_builtins(obj.model_dump())  # noqa: E731
+    elif issubclass(cls, (yarl.URL, Exception)):
+        extract = str
+    else:
+        raise TypeError(f"Object of type {cls.__name__} is not JSON serializable")
+    _extractors[cls] = extract
+    return extract
+
+
+def to_builtins(obj: Any) -> Any:
+    """将 aiotieba 的数据类及容器转换为 JSON 基础类型"""
+    extract = _extractors.get(type(obj))
+    if extract is None:
+        extract = _compile(type(obj))
+    return extract(obj)
+
+
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, datetime):
+        return int(obj.timestamp() * 1000)
+    elif isinstance(obj, BaseModel):
+        return obj.model_dump()
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+    elif isinstance(obj, (yarl.URL, Exception)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _dumps_json(obj: Any) -> bytes:
+    return sys_json.dumps(
+        to_builtins(obj), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+
+
+def _dumps_orjson(obj: Any) -> bytes:
+    return orjson.dumps(
+        obj,
+        default=_orjson_default,
+        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+    )
+
+
+def dumps(obj: Any) -> bytes:
+    """编码为 JSON，安装了 orjson 时使用 orjson"""
+    return _dumps(obj)
+
+
+def set_backend(name: Optional[str] = None):
+    """
+    切换 JSON 编码后端
+    Args:
+        name: "orjson" 或 "json"，为空时自动选择
+    """
+    global _dumps
+    if name is None:
+        name = "orjson" if orjson else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise RuntimeError("orjson is not installed")
+        _dumps = _dumps_orjson
+    elif name == "json":
+        _dumps = _dumps_json
+    else:
+        raise ValueError(f"unknown json backend {name}")
+
+
+_dumps: Callable[[Any], bytes] = _dumps_json
+set_backend()
+
+
+def loads(data: bytes | str) -> Any:
+    if orjson:
+        return orjson.loads(data)
+    return sys_json.loads(data)
+
+
+def packb(obj: Any) -> bytes:
+    """编码为 MessagePack，需要安装 msgpack"""
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(obj, default=to_builtins)
+
+
+def unpackb(data: bytes) -> Any:
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.unpackb(data)
+
+
+class Payload:
+    """
+    只编码一次的消息，所有订阅者共享同一份数据
+
+    Attributes:
+        - data: 编码后的 JSON 字节
+        - created: 创建时间，用于统计推送延迟
+        - topic: 推送消息的筛选依据，为空时发送给所有订阅者
+        - seq: 推送消息的序号，由巡查 worker 分配
+    """
+
+    __slots__ = ("data", "created", "topic", "seq", "_text", "_packed")
+
+    def __init__(self, data: bytes, topic: Optional["Topic"] = None, seq: Optional[int] = None):
+        self.data = data
+        self.created = time.monotonic()
+        self.topic = topic
+        self.seq = seq
+        self._text: Optional[str] = None
+        self._packed: Optional[bytes] = None
+
+    @classmethod
+    def encode(cls, obj: Any, topic: Optional["Topic"] = None) -> "Payload":
+        return cls(dumps(obj), topic)
+
+    def with_seq(self, seq: int) -> "Payload":
+        """在已编码的对象前加入序号字段"""
+        payload = Payload(b'{"seq":%d,' % seq + self.data[1:], self.topic, seq)
+        payload.created = self.created
+        return payload
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode()
+        return self._text
+
+    @property
+    def packed(self) -> bytes:
+        """MessagePack 编码，首次使用时由 JSON 转换，所有 MessagePack 订阅者共享"""
+        if self._packed is None:
+            self._packed = packb(loads(self.data))
+        return self._packed
+
+    def __len__(self):
+        return len(self.data)
@@ -2,16 +2,22 @@ from asyncio import AbstractEventLoop
 
 from tortoise.contrib.sanic import register_tortoise
 
+from cache import ResponseCache
 from config import load_config, load_env_config
 from custom_type import ApiType, App, Context
+from db import db_config, prepare_db
+from delivery import Delivery
+from fanout import Fanout, setup_fanout
 from http_client import (
+    add_http_callbacks,
     close_http_session,
     create_http_session,
     create_reverse_ws_connections,
 )
 from log import logger
+from metrics import MetricsStore, cleanup_metrics, setup_metrics
 from reviewer import create_reviewers
-from route import group
+from route import group, refresh_gauges
 from utils import CustomErrorHandler, close_tieba_client, init_tieba_client
 
 env_config = load_env_config("BC_")
@@ -24,17 +30,34 @@ app = App(
 )
 register_tortoise(
     app,
-    db_url=env_config.DB_URL,
-    modules={"models": ["models"]},
-    generate_schemas=True,
+    config=db_config(env_config.DB_URL, ["models"]),
 )
 app.blueprint(group)
 
 
+@app.main_process_start
+async def main_process_start(_app: App, loop: AbstractEventLoop):
+    await prepare_db(db_config(_app.config.DB_URL, ["models"]))
+    if _app.config.WORKERS > 1:
+        setup_fanout(_app)
+        setup_metrics(_app)
+
+
+@app.main_process_stop
+async def main_process_stop(_app: App, loop: AbstractEventLoop):
+    cleanup_metrics(_app)
+
+
 @app.before_server_start
 async def before_server_start(_app: App, loop: AbstractEventLoop):
     _app.ctx.config = load_config()
     logger.info("Server config loaded.")
+    _app.ctx.delivery = Delivery(_app.ctx.config)
+    _app.ctx.api_cache = ResponseCache(
+        _app.ctx.config.api_cache_ttl, _app.ctx.config.api_cache_max_bytes
+    )
+    _app.ctx.metrics = MetricsStore(_app, refresh_gauges)
+    _app.ctx.tasks.append(_app.add_task(_app.ctx.metrics.run(), name="metrics"))
 
     await init_tieba_client(_app)
 
@@ -44,22 +67,33 @@ async def before_server_start(_app: App, loop: AbstractEventLoop):
     ):
         await create_http_session(_app)
 
-    if ApiType.REVERSE_WS in _app.config.API_TYPE:
-        ws_tasks = await create_reverse_ws_connections(_app)
-        _app.ctx.tasks.extend(ws_tasks)
-
     if (
         ApiType.HTTP_CALLBACK in _app.config.API_TYPE
         or ApiType.REVERSE_WS in _app.config.API_TYPE
         or ApiType.WS in _app.config.API_TYPE
     ):
-        review_task = create_reviewers(_app)
-        _app.ctx.tasks.append(review_task)
+        _app.ctx.fanout = Fanout(_app, start_leader)
+        await _app.ctx.fanout.start()
+
+
+async def start_leader(_app: App):
+    """成为巡查 worker 时注册回调地址、建立反向 WebSocket 连接并开始巡查"""
+    add_http_callbacks(_app)
+    if ApiType.REVERSE_WS in _app.config.API_TYPE:
+        ws_tasks = await create_reverse_ws_connections(_app)
+        _app.ctx.tasks.extend(ws_tasks)
+    return create_reviewers(_app)
 
 
 @app.before_server_stop
 async def before_server_stop(_app: App, loop):
+    if _app.ctx.fanout:
+        await _app.ctx.fanout.close()
+    if _app.ctx.writer:
+        await _app.ctx.writer.close()
     await close_tieba_client(_app)
+    await _app.ctx.delivery.close()
+    _app.ctx.metrics.close()
     await close_http_session(_app)
 
 
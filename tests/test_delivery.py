@@ -0,0 +1,80 @@
+import asyncio
+from typing import List
+
+from delivery import Subscriber
+from replay import ReplayLog
+from serializer import Payload
+
+
+class RecordingSubscriber(Subscriber):
+    kind = "test"
+
+    def __init__(self):
+        super().__init__("recorder", flush_interval=0.01)
+        self.seqs: List[int] = []
+
+    async def send(self, batch: List[Payload]):
+        self.seqs.extend(message.seq for message in batch)
+
+
+async def wait_for_seqs(subscriber: RecordingSubscriber, count: int):
+    for _ in range(200):
+        if len(subscriber.seqs) >= count:
+            return None
+        await asyncio.sleep(0.01)
+
+
+def push(replay: ReplayLog, subscriber: Subscriber, seq: int):
+    payload = Payload(b'{"seq":%d}' % seq, seq=seq)
+    replay.append(payload)
+    subscriber.put(payload)
+
+
+def test_resume_running_subscriber(tmp_path):
+    """已在等待实时消息的订阅者收到 resume 后立即补发，之后的实时消息不重复发送"""
+
+    async def main():
+        replay = ReplayLog(str(tmp_path))
+        replay.open()
+        for seq in range(1, 6):
+            replay.append(Payload(b'{"seq":%d}' % seq, seq=seq))
+        subscriber = RecordingSubscriber().start()
+        try:
+            await asyncio.sleep(0.05)
+            subscriber.resume(replay, 2)
+            await wait_for_seqs(subscriber, 3)
+            assert subscriber.seqs == [3, 4, 5]
+
+            push(replay, subscriber, 6)
+            await wait_for_seqs(subscriber, 4)
+            await asyncio.sleep(0.05)
+            assert subscriber.seqs == [3, 4, 5, 6]
+        finally:
+            await subscriber.close()
+            replay.close()
+
+    asyncio.run(main())
+
+
+def test_resume_skips_live_pushes_already_replayed(tmp_path):
+    """补发前已排队的实时消息由补发发送，不会在补发之前或之后重复发送"""
+
+    async def main():
+        replay = ReplayLog(str(tmp_path))
+        replay.open()
+        subscriber = RecordingSubscriber()
+        for seq in range(1, 4):
+            push(replay, subscriber, seq)
+        subscriber.resume(replay, 1)
+        subscriber.start()
+        try:
+            await wait_for_seqs(subscriber, 2)
+            push(replay, subscriber, 4)
+            await wait_for_seqs(subscriber, 3)
+            await asyncio.sleep(0.05)
+            assert subscriber.seqs == [2, 3, 4]
+        finally:
+            await subscriber.close()
+            replay.close()
+
+    asyncio.run(main())
@@ -0,0 +1,19 @@
+import json
+
+from custom_type import Result
+
+
+def test_batch_result_round_trip():
+    results = [Result(data={"fid": 1}), Result(status="failed", retcode=404, msg="NotFound")]
+    batch = Result.from_results(results)
+
+    assert batch.encode().count(b'"data"') == 2
+    assert json.loads(batch.encode()) == {
+        "status": "ok",
+        "retcode": 0,
+        "data": [
+            {"status": "ok", "retcode": 0, "data": {"fid": 1}},
+            {"status": "failed", "retcode": 404, "msg": "NotFound"},
+        ],
+    }
+    assert json.loads(batch.to_ws(echo=7)) == {"echo": 7, **json.loads(batch.encode())}
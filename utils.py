@@ -1,9 +1,14 @@
+import hashlib
 import inspect
+import json as sys_json
+import re
 from dataclasses import asdict, is_dataclass
 from datetime import datetime
 from functools import wraps
 from json import JSONEncoder
+from pathlib import Path
 
+import aiotieba
 import yarl
 from aiohttp import ClientWebSocketResponse
 from aiotieba import Client
@@ -12,9 +17,9 @@ from pydantic import BaseModel
 from sanic import HTTPResponse, Unauthorized, Websocket
 from sanic.handlers import ErrorHandler
 
-from custom_type import App, Request
+from custom_type import App, Request, Result
 from log import logger
-from route import Result
+from pool import ClientPool
 
 
 async def init_tieba_client(app: App):
@@ -30,20 +35,30 @@ async def init_tieba_client(app: App):
             "Bot %s was broken, Some operations may not be performed.",
             app.ctx.bot_show_name,
         )
+    app.ctx.pool = ClientPool(app.ctx.config)
+    app.ctx.pool.add(app.ctx.bot_show_name or "default", app.ctx.bot, default=True)
+    await app.ctx.pool.open()
 
 
 async def close_tieba_client(app: App):
+    await app.ctx.pool.close()
     await app.ctx.bot.__aexit__()
     logger.info("Bot %s was closed.", app.ctx.bot_show_name)
 
 
 def inject_bot():
+    """
+    校验 token 并注入客户端，可通过请求头 X-Account 或查询参数 account 指定账号，
+    未指定时注入 None，由客户端池为每次调用选择账号
+    """
     def decorator(func):
         @wraps(func)
         async def wrapper(request: Request, *args, **kwargs):
             token = request.headers.get("Authorization", "")
             if request.app.ctx.config.token == token:
-                return await func(request, *args, request.app.ctx.bot, **kwargs)
+                account = request.headers.get("X-Account") or request.args.get("account")
+                bot = request.app.ctx.pool.get(account).client if account else None
+                return await func(request, *args, bot, **kwargs)
             else:
                 raise Unauthorized("The token is invalid.")
 
@@ -61,6 +76,88 @@ def get_aiotieba_methods(cls: object):
     return non_hidden_methods
 
 
+_ARG_DOC = re.compile(r"^\s*(\w+) \(([^)]*)\): (.*)$")
+_JSON_TYPES = {"int": "integer", "float": "number", "bool": "boolean", "str": "string"}
+# 修改 _method_operation 生成的内容时递增，使旧的缓存失效
+_OPENAPI_SCHEMA_VERSION = 2
+
+
+def _method_operation(name: str, method) -> dict:
+    doc = inspect.cleandoc(method.__doc__ or "")
+    arg_docs = {}
+    for line in doc.splitlines():
+        match = _ARG_DOC.match(line)
+        if match:
+            arg_docs[match[1]] = (match[2], match[3])
+
+    properties = {}
+    for param in list(inspect.signature(method).parameters.values())[1:]:
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        type_name, description = arg_docs.get(param.name, (str(param.annotation), ""))
+        schema = {"description": f"({type_name}) {description}".strip()}
+        json_type = _JSON_TYPES.get(type_name.split(",")[0].strip())
+        if json_type:
+            schema["type"] = json_type
+        properties[param.name] = schema
+
+    return {
+        "operationId": f"post~aiotieba.{name}",
+        "summary": name,
+        "description": doc,
+        "tags": ["aiotieba"],
+        "requestBody": {
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "args": {"type": "array", "description": "位置参数"},
+                            "kwargs": {
+                                "type": "object",
+                                "description": "关键字参数",
+                                "properties": properties,
+                            },
+                        },
+                    }
+                }
+            }
+        },
+        "responses": {"200": {"description": "OK"}},
+    }
+
+
+def load_aiotieba_paths(methods: dict, prefix: str, cache_dir: str = ".cache") -> dict:
+    """
+    生成 aiotieba 接口的 OpenAPI 路径，结果按 aiotieba 版本、生成格式版本、路由前缀与方法列表缓存到磁盘
+    Args:
+        methods: 方法名到方法的映射
+        prefix: 路由前缀
+        cache_dir: 缓存目录
+    """
+    digest = hashlib.sha1("\0".join([prefix, *sorted(methods)]).encode()).hexdigest()[:12]
+    path = Path(cache_dir) / (
+        f"openapi-aiotieba-{aiotieba.__version__}-v{_OPENAPI_SCHEMA_VERSION}-{digest}.json"
+    )
+    try:
+        with open(path, "rb") as fp:
+            return sys_json.load(fp)
+    except (OSError, ValueError):
+        pass
+
+    paths = {
+        f"{prefix}/{name}": {"post": _method_operation(name, method)}
+        for name, method in methods.items()
+    }
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fp:
+            sys_json.dump(paths, fp, ensure_ascii=False)
+    except OSError as e:
+        logger.warning("Failed to cache openapi spec: %s", e)
+    return paths
+
+
 class CustomErrorHandler(ErrorHandler):
     def _default(self, request: Request, exception: Exception):
         return Result.from_exception(request.app, request.url, exception)
@@ -92,9 +189,9 @@ class CustomJSONEncoder(JSONEncoder):
         return {k: v for k, v in obj.items() if v is not None}
 
 
-async def union_ws_send(ws: Websocket | ClientWebSocketResponse, data: str):
+async def union_ws_send(ws: Websocket | ClientWebSocketResponse, data: str | bytes):
     if isinstance(ws, ClientWebSocketResponse):
-        ws_send_func = ws.send_str
+        ws_send_func = ws.send_bytes if isinstance(data, bytes) else ws.send_str
     elif isinstance(ws, Websocket):
         ws_send_func = ws.send
 
@@ -0,0 +1,271 @@
+import datetime as dt
+import inspect
+import types
+import typing
+from collections.abc import Iterable
+from enum import Enum, Flag
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple
+
+import aiotieba
+import aiotieba.enums
+
+from exceptions import InvalidParameter
+
+Coercer = Callable[[Any], Any]
+
+# aiotieba 的参数注解是字符串，其中的名称只在 TYPE_CHECKING 下导入
+_NAMESPACE = {
+    **vars(aiotieba),
+    **vars(aiotieba.enums),
+    "dt": dt,
+    "Iterable": Iterable,
+    "Literal": Literal,
+}
+
+
+def _unwrap(method: Callable) -> Callable:
+    """跳过 aiotieba 中没有使用 functools.wraps 的装饰器，找到原始方法"""
+    while True:
+        params = list(
+            inspect.signature(method, follow_wrapped=False).parameters.values()
+        )[1:]
+        if [param.kind for param in params] != [
+            inspect.Parameter.VAR_POSITIONAL,
+            inspect.Parameter.VAR_KEYWORD,
+        ]:
+            return method
+        inner = [
+            cell.cell_contents
+            for cell in method.__closure__ or ()
+            if inspect.isfunction(cell.cell_contents)
+        ]
+        if not inner:
+            return method
+        method = inner[0]
+
+
+def _resolve(annotation: Any) -> Any:
+    if annotation is inspect.Parameter.empty:
+        return Any
+    if isinstance(annotation, str):
+        try:
+            return eval(annotation, dict(_NAMESPACE))
+        except Exception:
+            return Any
+    return annotation
+
+
+def _passthrough(value: Any) -> Any:
+    return value
+
+
+def _coerce_int(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError("expected int")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return int(value)
+    raise ValueError("expected int")
+
+
+def _coerce_float(value: Any) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError("expected number")
+    return float(value)
+
+
+def _coerce_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    raise ValueError("expected bool")
+
+
+def _coerce_str(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    raise ValueError("expected str")
+
+
+def _coerce_datetime(value: Any) -> dt.datetime:
+    if isinstance(value, bool):
+        raise ValueError("expected datetime")
+    if isinstance(value, (int, float)):
+        return dt.datetime.fromtimestamp(value)
+    if isinstance(value, str):
+        return dt.datetime.fromisoformat(value)
+    raise ValueError("expected timestamp or ISO 8601 datetime")
+
+
+def _compile_enum(cls: type) -> Coercer:
+    def coerce(value: Any) -> Enum:
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, str) and value in cls.__members__:
+            return cls.__members__[value]
+        if issubclass(cls, Flag) and isinstance(value, list):
+            result = cls(0)
+            for item in value:
+                result |= coerce(item)
+            return result
+        if isinstance(value, bool):
+            raise ValueError(f"expected {cls.__name__}")
+        try:
+            return cls(value)
+        except ValueError:
+            raise ValueError(
+                f"expected one of {', '.join(cls.__members__)}"
+            ) from None
+
+    return coerce
+
+
+def _compile_union(coercers: List[Coercer], nullable: bool) -> Coercer:
+    def coerce(value: Any) -> Any:
+        if value is None and nullable:
+            return None
+        errors = []
+        for item in coercers:
+            try:
+                return item(value)
+            except ValueError as e:
+                errors.append(str(e))
+        raise ValueError(" or ".join(errors))
+
+    return coerce
+
+
+def _compile_type(tp: Any) -> Coercer:
+    """根据类型注解生成校验并转换参数的函数"""
+    origin = typing.get_origin(tp)
+    if tp is Any:
+        return _passthrough
+    if origin in (typing.Union, types.UnionType):
+        args = typing.get_args(tp)
+        return _compile_union(
+            [_compile_type(arg) for arg in args if arg is not type(None)],
+            type(None) in args,
+        )
+    if origin is Literal:
+        choices = typing.get_args(tp)
+
+        def coerce_literal(value: Any) -> Any:
+            if value not in choices:
+                raise ValueError(f"expected one of {', '.join(map(repr, choices))}")
+            return value
+
+        return coerce_literal
+    if origin in (list, Iterable):
+        item_coercer = _compile_type((typing.get_args(tp) or (Any,))[0])
+
+        def coerce_list(value: Any) -> list:
+            if not isinstance(value, (list, tuple)):
+                raise ValueError("expected list")
+            return [item_coercer(item) for item in value]
+
+        return coerce_list
+    if not isinstance(tp, type):
+        return _passthrough
+    if issubclass(tp, Enum):
+        return _compile_enum(tp)
+    if tp is bool:
+        return _coerce_bool
+    if tp is int:
+        return _coerce_int
+    if tp is float:
+        return _coerce_float
+    if tp is str:
+        return _coerce_str
+    if tp is dt.datetime:
+        return _coerce_datetime
+    return _passthrough
+
+
+class MethodValidator:
+    """
+    预编译的 aiotieba 方法调用计划，在发起请求前绑定并校验参数
+
+    Attributes:
+        - name: 方法名
+        - positional: 可按位置传入的参数名
+        - keywords: 可按关键字传入的参数名
+        - required: 必填参数名
+        - coercers: 参数名到转换函数的映射
+    """
+
+    def __init__(self, name: str, method: Callable):
+        self.name = name
+        params = list(inspect.signature(_unwrap(method)).parameters.values())[1:]
+        kind = inspect.Parameter
+        self.positional = [
+            p.name for p in params if p.kind in (kind.POSITIONAL_ONLY, kind.POSITIONAL_OR_KEYWORD)
+        ]
+        self.keywords = {
+            p.name for p in params if p.kind in (kind.POSITIONAL_OR_KEYWORD, kind.KEYWORD_ONLY)
+        }
+        self.required = [
+            p.name
+            for p in params
+            if p.default is kind.empty and p.kind not in (kind.VAR_POSITIONAL, kind.VAR_KEYWORD)
+        ]
+        self.var_positional = any(p.kind is kind.VAR_POSITIONAL for p in params)
+        self.var_keyword = any(p.kind is kind.VAR_KEYWORD for p in params)
+        self.coercers: Dict[str, Coercer] = {
+            p.name: _compile_type(_resolve(p.annotation)) for p in params
+        }
+
+    def _coerce(self, name: str, value: Any) -> Any:
+        coercer = self.coercers.get(name, _passthrough)
+        try:
+            return coercer(value)
+        except (ValueError, TypeError, OverflowError) as e:
+            raise InvalidParameter(f"{self.name}() argument '{name}': {e}") from None
+
+    def bind(self, args: Any = (), kwargs: Optional[Dict[str, Any]] = None) -> Tuple[tuple, Dict[str, Any]]:
+        """
+        校验参数并返回转换后的位置参数与关键字参数
+        Args:
+            args: 位置参数
+            kwargs: 关键字参数
+        """
+        args = args or ()
+        kwargs = kwargs or {}
+        if not isinstance(args, (list, tuple)):
+            raise InvalidParameter("args must be a list")
+        if not isinstance(kwargs, dict):
+            raise InvalidParameter("kwargs must be an object")
+        if len(args) > len(self.positional) and not self.var_positional:
+            raise InvalidParameter(
+                f"{self.name}() takes at most {len(self.positional)} positional arguments "
+                f"but {len(args)} were given"
+            )
+
+        bound_args = tuple(
+            self._coerce(name, value) for name, value in zip(self.positional, args)
+        ) + tuple(args[len(self.positional):])
+        given = set(self.positional[: len(args)])
+        bound_kwargs = {}
+        for name, value in kwargs.items():
+            if name in given:
+                raise InvalidParameter(f"{self.name}() got multiple values for argument '{name}'")
+            if name not in self.keywords and not self.var_keyword:
+                raise InvalidParameter(f"{self.name}() got an unexpected keyword argument '{name}'")
+            bound_kwargs[name] = self._coerce(name, value)
+            given.add(name)
+
+        missing = [name for name in self.required if name not in given]
+        if missing:
+            raise InvalidParameter(
+                f"{self.name}() missing required arguments: {', '.join(missing)}"
+            )
+        return bound_args, bound_kwargs
+
+
+def compile_validators(methods: Dict[str, Callable]) -> Dict[str, MethodValidator]:
+    return {name: MethodValidator(name, method) for name, method in methods.items()}